@@ -2,13 +2,16 @@
 
 set -ex
 
-echo "Updating manticore config for $1"
+echo "Updating manticore config for $@"
 
 cp /docker-mounted-manticore.conf /etc/manticoresearch/manticore.conf
 
 echo "Manticore config updated"
 
-time indexer --rotate $1
+# no table names = config reload only (e.g. swapping a distributed alias to a new table version)
+if [ "$#" -gt 0 ]; then
+    time indexer --rotate "$@"
+fi
 
 echo "Notify of rotate"
 kill -SIGHUP 1
\ No newline at end of file
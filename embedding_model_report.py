@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Startup time and memory of the embedding model, loaded from the hub cache (before the local copy) and from the
+memory-mapped local copy (EMBEDDING_MODEL_SETTINGS['cache_dir']).
+
+Every load runs in a fresh interpreter, like an encoder process or a demo worker starting up, and reports the
+import time of the embedding module, the model load time, the first encode and the peak RSS of that process.
+
+    uv run embedding_model_report.py
+"""
+
+import sys
+import json
+import subprocess
+import pandas as pd
+from py_index.database_settings import EMBEDDING_MODEL_SETTINGS
+from py_index.embedding_models import embedding_model
+
+
+RUNS = 5
+
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+t0 = time.time()
+from py_index.database_settings import EMBEDDING_MODEL_SETTINGS
+from py_index.embedding_models import embedding_model
+EMBEDDING_MODEL_SETTINGS['cache_dir'] = sys.argv[1] or None
+t1 = time.time()
+model = embedding_model()
+t2 = time.time()
+model.encode(['first query of a fresh process'])
+t3 = time.time()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'load_ms': (t2 - t1) * 1000,
+    'first_encode_ms': (t3 - t2) * 1000,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def measure_startup(cache_dir):
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, cache_dir or ''], text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_report(runs=RUNS):
+    cache_dir = EMBEDDING_MODEL_SETTINGS['cache_dir']
+    if not cache_dir:
+        print("EMBEDDING_MODEL_SETTINGS['cache_dir'] is not set, only the hub load can be measured")
+    # one load in this process writes the local copy, so every measured run below starts warm
+    embedding_model()
+
+    report = []
+    for mode, mode_cache_dir in [('hub cache', None), ('memory-mapped copy', cache_dir)]:
+        if mode != 'hub cache' and not mode_cache_dir:
+            continue
+        for run in range(runs):
+            report.append({'mode': mode, 'run': run, **measure_startup(mode_cache_dir)})
+
+    df = pd.DataFrame(report)
+    summary = df.groupby('mode')[['import_ms', 'load_ms', 'first_encode_ms', 'peak_rss_mb']].median()
+    print(f"Embedding model {EMBEDDING_MODEL_SETTINGS['name']}, median of {runs} fresh processes per mode")
+    print(summary.to_string(float_format=lambda v: f"{v:.1f}"))
+    return df
+
+
+if __name__ == "__main__":
+    run_report()
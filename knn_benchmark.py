@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+KNN recall and latency of text_vector_64_floats for the `ef` and `k` values of the KNN tab.
+
+Query texts are the first words of random stored chunks, embedded like the tab does. Their exact nearest
+neighbours are computed with NumPy over all stored vectors (streamed from the ClickHouse copy, `text_vectors`),
+then every (k, ef) pair is run against Manticore and scored as recall@k against that ground truth: a returned
+chunk is a hit when it is no farther than the exact k-th neighbour, so equidistant repeated chunks count as found.
+
+    uv run knn_benchmark.py
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from py_index.clickhouse_client import clickhouse_client
+from py_index.database_settings import CLICKHOUSE_VECTOR_SETTINGS
+from py_index.embedding_models import embedding_model
+from py_index.manticore_database_ops import manticore_client_weights_server, manticore_query_rows
+
+
+VECTOR_TABLE = 'text_vector_64_floats'
+QUERIES = 100
+QUERY_WORDS = 6
+K_VALUES = [5, 10, 20]
+EF_VALUES = [100, 250, 500, 1000, 2000, 3000, 5000]
+# the KNN tab's default k; the recommended ef is the smallest one reaching TARGET_RECALL for it
+TAB_K = 5
+TARGET_RECALL = 0.95
+# relative slack on the k-th exact distance under which a returned chunk still counts as a tie (float32 rounding)
+TIE_EPSILON = 1e-4
+
+
+def sample_query_texts(n=QUERIES, words=QUERY_WORDS):
+    with clickhouse_client() as client:
+        rows = client.query(f"""
+            SELECT arrayStringConcat(arraySlice(splitByWhitespace(text_str), 1, {words}), ' ') AS query
+            FROM {CLICKHOUSE_VECTOR_SETTINGS['table']}
+            WHERE length(text_str) > 0
+            ORDER BY rand() LIMIT {n}
+        """).result_rows
+    return [row[0] for row in rows]
+
+
+def exact_neighbours(queries, k):
+    """(doc ids, squared L2 distances) of the k nearest stored vectors per query row, nearest first, and the stored count.
+
+    Stored vectors are streamed from ClickHouse block by block and only a running top-k per query is kept,
+    so memory stays at one block whatever the number of vectors.
+    """
+    best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), 0), dtype=np.uint64)
+    query_norms = (queries ** 2).sum(axis=1)[:, None]
+    stored = 0
+    with clickhouse_client() as client:
+        sql = f"SELECT doc_id, embedding FROM {CLICKHOUSE_VECTOR_SETTINGS['table']} FINAL"
+        with client.query_column_block_stream(sql) as block_stream:
+            for block_ids, block_vectors in block_stream:
+                if len(block_ids) == 0:
+                    continue
+                block = np.asarray(block_vectors, dtype=np.float32)
+                stored += len(block)
+                # |q - x|^2 = |q|^2 - 2 q.x + |x|^2, one matrix product per block
+                distances = query_norms - 2 * queries @ block.T + (block ** 2).sum(axis=1)[None, :]
+                ids = np.broadcast_to(np.asarray(block_ids, dtype=np.uint64), distances.shape)
+                best_distances = np.concatenate([best_distances, distances], axis=1)
+                best_ids = np.concatenate([best_ids, ids], axis=1)
+                keep = min(k, best_distances.shape[1])
+                top = np.argpartition(best_distances, keep - 1, axis=1)[:, :keep]
+                best_distances = np.take_along_axis(best_distances, top, axis=1)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+    order = np.argsort(best_distances, axis=1)
+    return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_distances, order, axis=1), stored
+
+
+def stored_vectors(doc_ids, lookup_batch=10000):
+    """{doc_id: vector} of the given chunks, read from the ClickHouse copy"""
+    doc_ids = sorted({int(doc_id) for doc_id in doc_ids})
+    vectors = {}
+    with clickhouse_client() as client:
+        for start in range(0, len(doc_ids), lookup_batch):
+            id_list = ','.join(map(str, doc_ids[start:start + lookup_batch]))
+            rows = client.query(f"""
+                SELECT doc_id, any(embedding) FROM {CLICKHOUSE_VECTOR_SETTINGS['table']}
+                WHERE doc_id IN ({id_list}) GROUP BY doc_id
+            """).result_rows
+            vectors.update((int(doc_id), np.asarray(vector, dtype=np.float32)) for doc_id, vector in rows)
+    return vectors
+
+
+def tie_aware_recall(query, ids, exact_distances, k, vectors):
+    """Share of the k nearest neighbours found, where any returned chunk no farther than the exact k-th one is a hit.
+
+    Chunks repeat, so several stored vectors are often equidistant from a query; the exact search and the index
+    can then return different but equally near ids, which an id overlap would count as misses.
+    """
+    expected = min(k, len(exact_distances))
+    if expected == 0:
+        return None
+    kth = float(exact_distances[expected - 1])
+    limit = kth + TIE_EPSILON * max(1.0, abs(kth))
+    hits = sum(1 for doc_id in ids[:k] if doc_id in vectors and float(((vectors[doc_id] - query) ** 2).sum()) <= limit)
+    return hits / expected
+
+
+def manticore_knn_ids(client, vector, k, ef, table_name=VECTOR_TABLE):
+    vector_str = ','.join(map(repr, map(float, vector)))
+    t0 = time.time()
+    rows = manticore_query_rows(client, f"""
+        SELECT id FROM {table_name}
+        WHERE knn(text_vector, {k}, ({vector_str}), {ef})
+        LIMIT {k}
+    """)
+    return [int(row[0]) for row in rows], (time.time() - t0) * 1000
+
+
+def run_benchmark():
+    t0 = time.time()
+    texts = sample_query_texts()
+    if not texts:
+        print(f"No vectors in {CLICKHOUSE_VECTOR_SETTINGS['table']}, run process_3_encode_sentence.py first")
+        return None
+    queries = np.asarray(embedding_model().encode(texts), dtype=np.float32)
+    _, truth_distances, stored = exact_neighbours(queries, max(K_VALUES))
+    print(f"{stored} stored vectors, {len(queries)} queries, exact neighbours in {time.time() - t0:.1f} seconds")
+
+    runs = {}
+    with manticore_client_weights_server() as client:
+        for k in K_VALUES:
+            for ef in EF_VALUES:
+                runs[(k, ef)] = [manticore_knn_ids(client, query, k, ef) for query in queries]
+    # the returned chunks' own vectors, to score them by distance rather than by id
+    vectors = stored_vectors(doc_id for results in runs.values() for ids, _ in results for doc_id in ids)
+
+    report = []
+    for (k, ef), results in runs.items():
+        latencies = [latency_ms for _, latency_ms in results]
+        recalls = [tie_aware_recall(query, ids, distances, k, vectors)
+                   for query, distances, (ids, _) in zip(queries, truth_distances, results)]
+        recall = float(np.mean([r for r in recalls if r is not None]))
+        p50, p95 = np.percentile(latencies, [50, 95])
+        report.append({'k': k, 'ef': ef, 'recall': recall, 'p50_ms': p50, 'p95_ms': p95})
+        print(f"k={k} ef={ef}: recall={recall:.3f} p50={p50:.1f}ms p95={p95:.1f}ms")
+
+    df = pd.DataFrame(report)
+    print()
+    print(df.to_string(index=False))
+
+    reaching = df[(df['k'] == TAB_K) & (df['recall'] >= TARGET_RECALL)]
+    if reaching.empty:
+        print(f"\nNo ef reaches recall {TARGET_RECALL} at k={TAB_K}; keep the largest one")
+    else:
+        best = reaching.sort_values('ef').iloc[0]
+        print(f"\nRecommended default ef for the KNN tab (k={TAB_K}): {int(best['ef'])} "
+              f"(recall {best['recall']:.3f}, p50 {best['p50_ms']:.1f}ms)")
+    return df
+
+
+if __name__ == "__main__":
+    run_benchmark()
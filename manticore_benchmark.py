@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Manticore indexing and query benchmark.
+
+For every indexed table, records the last index build time, the on-disk size and
+p50/p95/p99 latencies of a fixed query mix (match, highlight, FACET, AUTOCOMPLETE,
+SUGGEST, KNN) into `manticore_benchmark_results`, tagged with the git revision and
+a hash of the table's index settings.
+
+    uv run manticore_benchmark.py            # run the benchmark
+    uv run manticore_benchmark.py --history  # latest results per table, query and config
+"""
+
+import sys
+import time
+import json
+import hashlib
+import datetime
+import subprocess
+import numpy as np
+from py_index.clickhouse_client import clickhouse_client
+from py_index.database_settings import MANTICORE_INDEX_SETTINGS
+from py_index.manticore_database_ops import (
+    manticore_client_data_server, manticore_client_weights_server, manticore_query,
+    manticore_table_status, manticore_local_table, manticore_local_tables, table_index_settings,
+    version_index_settings, live_table_version,
+)
+
+
+RUNS = 30
+TERMS = ['theft', 'street', 'battery']
+MAX_FACETS = 3
+KNN_K = 10
+KNN_EF = 2000
+
+
+def init_benchmark_table():
+    with clickhouse_client() as client:
+        client.command("""
+        CREATE TABLE IF NOT EXISTS manticore_benchmark_results (
+            event_time DateTime,
+            git_revision String,
+            config_hash String,
+            table_name String,
+            build_time_s Float64,
+            disk_bytes UInt64,
+            ram_bytes UInt64,
+            query_name LowCardinality(String),
+            runs UInt32,
+            errors UInt32,
+            p50_ms Float64,
+            p95_ms Float64,
+            p99_ms Float64
+        ) ENGINE = MergeTree() ORDER BY (table_name, query_name, event_time)
+        """)
+
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True).strip()
+        return revision + ('-dirty' if dirty else '')
+    except Exception as e:
+        print(f"Error reading git revision: {str(e)}")
+        return 'unknown'
+
+
+def config_hash(ch_client, table_name):
+    columns = ch_client.query_df(f"select name, type from system.columns where table = '{table_name}'")
+    version = live_table_version(table_name)
+    if version is None:
+        settings_lines = table_index_settings(ch_client, table_name, columns.to_dict(orient='records'))
+    else:
+        # the settings the live version was built with, not a fresh profile
+        settings_lines = version_index_settings(ch_client, table_name, version, columns.to_dict(orient='records'))
+    payload = json.dumps([MANTICORE_INDEX_SETTINGS, settings_lines, columns.to_dict(orient='records')], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def last_build_time_s(ch_client, table_name):
+    """Seconds between the last 'done' and the 'started' of that same build, the last one before it"""
+    result = ch_client.query(f"""
+        WITH (
+            SELECT max(event_time) FROM index_status_event
+            WHERE table_name = '{table_name}' AND status = 'done'
+        ) AS done_time
+        SELECT dateDiff('s', max(event_time), done_time), count()
+        FROM index_status_event
+        WHERE table_name = '{table_name}' AND status = 'started' AND event_time <= done_time
+    """)
+    build_time_s, started_events = result.result_rows[0]
+    return float(build_time_s) if started_events else 0.0
+
+
+def query_mix(table_name):
+    """(query_name, server, sql, args for each run) for the table"""
+    local_table = manticore_local_table(table_name)
+    with manticore_client_data_server() as client:
+        fields = manticore_query(client, f"DESC {local_table}")
+    string_fields = fields[fields['Type'] == 'string']['Field'].tolist()[:MAX_FACETS]
+
+    mix = [
+        ('match', 'data', f"SELECT id FROM {table_name} WHERE MATCH(%s) LIMIT 20", lambda term: (term,)),
+        ('highlight', 'data', f"SELECT id, HIGHLIGHT() FROM {table_name} WHERE MATCH(%s) LIMIT 20", lambda term: (term,)),
+        ('autocomplete', 'data', f"CALL AUTOCOMPLETE(%s, '{local_table}')", lambda term: (term[:3],)),
+        ('suggest', 'data', f"CALL SUGGEST(%s, '{local_table}', 5 as limit)", lambda term: (term[:-1] + 'x',)),
+    ]
+    if string_fields:
+        facets = " ".join(f"FACET {field}" for field in string_fields)
+        mix.append(('facet', 'data', f"SELECT id FROM {table_name} WHERE MATCH(%s) LIMIT 20 {facets}", lambda term: (term,)))
+
+    # KNN by document id, so no embedding model is needed
+    try:
+        with manticore_client_weights_server() as client:
+            df = manticore_query(client, "SELECT id FROM text_vector_64_floats WHERE table_name = %s LIMIT 1", (table_name,))
+        if df is not None and not df.empty:
+            doc_id = int(df['id'].iloc[0])
+            mix.append(('knn', 'weights', f"SELECT id, knn_dist() FROM text_vector_64_floats WHERE knn(text_vector, {KNN_K}, {doc_id}, {KNN_EF})", lambda term: None))
+    except Exception as e:
+        print(f"Skipping KNN for {table_name}: {str(e)}")
+    return mix
+
+
+def run_query(server, sql, args):
+    client_func = manticore_client_data_server if server == 'data' else manticore_client_weights_server
+    with client_func() as client:
+        t0 = time.time()
+        manticore_query(client, sql, args)
+        return (time.time() - t0) * 1000
+
+
+def benchmark_table(ch_client, table_name, revision):
+    statuses = []
+    with manticore_client_data_server() as client:
+        for local_table in manticore_local_tables(table_name):
+            statuses.append(manticore_table_status(client, local_table))
+    disk_bytes = sum(status.get('disk_bytes', 0) for status in statuses)
+    ram_bytes = sum(status.get('ram_bytes', 0) for status in statuses)
+    build_time_s = last_build_time_s(ch_client, table_name)
+    table_config_hash = config_hash(ch_client, table_name)
+
+    rows = []
+    for query_name, server, sql, make_args in query_mix(table_name):
+        timings = []
+        errors = 0
+        for i in range(RUNS):
+            try:
+                timings.append(run_query(server, sql, make_args(TERMS[i % len(TERMS)])))
+            except Exception as e:
+                errors += 1
+                print(f"Error running {query_name} on {table_name}: {str(e)}")
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99]) if timings else (0, 0, 0)
+        print(f"{table_name} {query_name}: p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms errors={errors}")
+        rows.append([
+            datetime.datetime.now(), revision, table_config_hash, table_name,
+            build_time_s, disk_bytes, ram_bytes,
+            query_name, len(timings), errors, float(p50), float(p95), float(p99)
+        ])
+    return rows
+
+
+def run_benchmark():
+    init_benchmark_table()
+    revision = git_revision()
+    with clickhouse_client() as client:
+        tables = client.query_df('select table_name from input_tables_summary')['table_name'].tolist()
+        for table_name in tables:
+            print(f"Benchmarking {table_name} @ {revision}")
+            try:
+                rows = benchmark_table(client, table_name, revision)
+            except Exception as e:
+                print(f"Error benchmarking {table_name}: {str(e)}")
+                continue
+            client.insert(
+                'manticore_benchmark_results',
+                rows,
+                column_names=[
+                    'event_time', 'git_revision', 'config_hash', 'table_name',
+                    'build_time_s', 'disk_bytes', 'ram_bytes',
+                    'query_name', 'runs', 'errors', 'p50_ms', 'p95_ms', 'p99_ms'
+                ]
+            )
+
+
+def show_history():
+    with clickhouse_client() as client:
+        df = client.query_df("""
+            SELECT table_name, query_name, config_hash, git_revision, event_time,
+                   build_time_s, disk_bytes, p50_ms, p95_ms, p99_ms
+            FROM manticore_benchmark_results
+            ORDER BY table_name, query_name, event_time DESC
+            LIMIT 1 BY table_name, query_name, config_hash
+        """)
+    print(df.to_string())
+    return df
+
+
+if __name__ == "__main__":
+    if '--history' in sys.argv:
+        show_history()
+    else:
+        run_benchmark()
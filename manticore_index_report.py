@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Index size and query latency report for the Manticore tables.
+
+Run it once before and once after changing the index settings, then compare:
+
+    uv run manticore_index_report.py before
+    uv run process_1_load_csv.py  # or re-run index_table_into_manticore() for the tables
+    uv run manticore_index_report.py after
+    uv run manticore_index_report.py --compare before after
+"""
+
+import sys
+import time
+import datetime
+from py_index.clickhouse_client import clickhouse_client
+from py_index.manticore_database_ops import manticore_client_data_server, manticore_query, manticore_table_status, manticore_local_tables, profile_index_fields
+
+
+REPEATS = 5
+MATCH_TERMS = ['theft', 'street', 'the']
+INFIX_TERM = '*ree*'
+MAX_HOT_ATTRS = 3
+
+
+def init_report_table():
+    with clickhouse_client() as client:
+        client.command("""
+        CREATE TABLE IF NOT EXISTS manticore_index_report (
+            event_time DateTime,
+            label String,
+            table_name String,
+            disk_bytes UInt64,
+            ram_bytes UInt64,
+            query_name String,
+            latency_ms Float64
+        ) ENGINE = MergeTree() ORDER BY (label, table_name, query_name)
+        """)
+
+
+def report_queries(table_name, hot_attrs):
+    queries = {
+        'count': f"SELECT COUNT(*) FROM {table_name}",
+        'infix': f"SELECT id FROM {table_name} WHERE MATCH('{INFIX_TERM}') LIMIT 20",
+    }
+    for term in MATCH_TERMS:
+        queries[f'match_{term}'] = f"SELECT id FROM {table_name} WHERE MATCH('{term}') LIMIT 20"
+    for attr in hot_attrs[:MAX_HOT_ATTRS]:
+        queries[f'group_{attr}'] = f"SELECT {attr}, COUNT(*) FROM {table_name} GROUP BY {attr} ORDER BY COUNT(*) DESC LIMIT 10"
+    return queries
+
+
+def median_latency_ms(client, sql):
+    timings = []
+    for _ in range(REPEATS):
+        t0 = time.time()
+        manticore_query(client, sql)
+        timings.append((time.time() - t0) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def report_table(ch_client, table_name, label):
+    columns = ch_client.query_df(f"select name, type from system.columns where table = '{table_name}'")
+    profile = profile_index_fields(ch_client, table_name, columns.to_dict(orient='records'))
+    rows = []
+    with manticore_client_data_server() as client:
+        statuses = [manticore_table_status(client, local_table) for local_table in manticore_local_tables(table_name)]
+        disk_bytes = sum(status.get('disk_bytes', 0) for status in statuses)
+        ram_bytes = sum(status.get('ram_bytes', 0) for status in statuses)
+        for query_name, sql in report_queries(table_name, profile['hot_attrs']).items():
+            try:
+                latency_ms = median_latency_ms(client, sql)
+            except Exception as e:
+                print(f"Error running {query_name} on {table_name}: {str(e)}")
+                continue
+            rows.append([
+                datetime.datetime.now(),
+                label,
+                table_name,
+                disk_bytes,
+                ram_bytes,
+                query_name,
+                latency_ms
+            ])
+    return rows
+
+
+def run_report(label):
+    init_report_table()
+    with clickhouse_client() as client:
+        tables = client.query_df('select table_name from input_tables_summary')['table_name'].tolist()
+        for table_name in tables:
+            print(f"Reporting on {table_name}")
+            rows = report_table(client, table_name, label)
+            if rows:
+                client.insert(
+                    'manticore_index_report',
+                    rows,
+                    column_names=['event_time', 'label', 'table_name', 'disk_bytes', 'ram_bytes', 'query_name', 'latency_ms']
+                )
+
+
+def compare_reports(label_before, label_after):
+    with clickhouse_client() as client:
+        df = client.query_df("""
+            SELECT
+                table_name,
+                query_name,
+                anyIf(disk_bytes, label = %(before)s) AS disk_bytes_before,
+                anyIf(disk_bytes, label = %(after)s) AS disk_bytes_after,
+                anyIf(latency_ms, label = %(before)s) AS latency_ms_before,
+                anyIf(latency_ms, label = %(after)s) AS latency_ms_after,
+                latency_ms_after - latency_ms_before AS latency_ms_diff
+            FROM (
+                SELECT * FROM manticore_index_report
+                WHERE label IN (%(before)s, %(after)s)
+                ORDER BY event_time DESC
+                LIMIT 1 BY label, table_name, query_name
+            )
+            GROUP BY table_name, query_name
+            ORDER BY table_name, query_name
+        """, parameters={'before': label_before, 'after': label_after})
+    print(df.to_string())
+    return df
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--compare':
+        compare_reports(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 2:
+        run_report(sys.argv[1])
+    else:
+        print(__doc__)
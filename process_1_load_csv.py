@@ -6,10 +6,10 @@ import glob
 from datetime import datetime
 import xml.etree.ElementTree as ET
 import pandas as pd
-from clickhouse_connect import get_client
+from py_index.clickhouse_client import clickhouse_client
 from py_index.clickhouse_database_ops import execute_query, fetch_table_raw_column_stats, recreate_table
-from py_index.database_settings import CLICKHOUSE_SETTINGS
-from py_index.manticore_database_ops import index_table_into_manticore
+from py_index.database_settings import MANTICORE_INDEX_SETTINGS
+from py_index.manticore_database_ops import index_table_into_manticore, index_unified_table_into_manticore
 import csv
 
 
@@ -19,7 +19,7 @@ def process_1_input_clickhouse():
     file_list.extend(glob.glob('docker/data/**/*.xml', recursive=True))
     # sort by file size increasing
     file_list.sort(key=lambda x: os.path.getsize(x))
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         existing_filenames_df =  client.query_df('select file_name from input_tables_list')
         if existing_filenames_df.empty:
             existing_filenames = set()
@@ -55,6 +55,10 @@ def process_1_input_clickhouse():
         index_table_into_manticore(table_name)
         print('Done indexing table', table_name)
 
+    if MANTICORE_INDEX_SETTINGS['unified_index']:
+        index_unified_table_into_manticore()
+        print('Done indexing the unified table')
+
 def ingest_wiki_xml_file(file_index, filepath, filename, file_size):
     file_stem = '_'.join(os.path.splitext(filename)[:-1])
     # remove all non_alphanumeric characters
@@ -81,7 +85,7 @@ def ingest_wiki_xml_file(file_index, filepath, filename, file_size):
     }
     col_defs = ', '.join([f'`{k}` {v}' for k, v in columns.items()])
 
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         try:
             # Create table
             create_table_query = f"CREATE TABLE {table_name} ({col_defs}) ENGINE = Log"
@@ -285,7 +289,7 @@ def ingest_csv_file(file_index, filepath, filename, file_size):
     table_name = f"_input_log_{item_name}"
     print(f"Loading CSV {filename} into Clickhouse as {table_name}")
 
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         try:
             try:
                 # Configure and create table from CSV
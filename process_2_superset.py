@@ -1,6 +1,5 @@
 import requests
-import clickhouse_connect
-from py_index.database_settings import CLICKHOUSE_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
 import json
 SUPERSET_URL = "http://localhost:8088"
 SUPERSET_DBNAME = "chicago_crime_search"
@@ -92,7 +91,7 @@ def create_superset_table(s, superset_db_id, table_name):
         r = r.json()
         table_id = r['id']
         table_data = json.dumps(r['data'], indent=2)
-        with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+        with clickhouse_client() as c:
             c.insert('superset_tables', [[superset_db_id, table_id, table_name, table_data]], column_names=[
                 'superset_database_id',
                 'superset_table_id',
@@ -103,7 +102,7 @@ def create_superset_table(s, superset_db_id, table_name):
         print(f"Error creating Superset table: {table_name}: {repr(e)}")
 
 def create_superset_tables(s, superset_db_id):
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+    with clickhouse_client() as c:
         tables_that_exist = c.query_df("SELECT table_name from superset_tables")
         if len(tables_that_exist) == 0:
             tables_that_exist = set()
@@ -119,7 +118,7 @@ def create_superset_tables(s, superset_db_id):
         create_superset_table(s, superset_db_id, table)
 
 def create_superset_charts_all_tables(s):
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+    with clickhouse_client() as c:
         charts_to_create = c.query_df("SELECT * FROM superset_tables")
     if len(charts_to_create) == 0:
         print("No charts to create")
@@ -137,7 +136,7 @@ def create_superset_chart_for_table(s, table):
     # _superset_table_info = table['superset_table_info']
 
     chart_name = f"{table_name}_chart"
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+    with clickhouse_client() as c:
         columns = c.query_df(f"SELECT name, type FROM system.columns WHERE table = '{table_name}' and database = 'chicago_crimes_search'").to_dict(orient='records')
 
     for column in columns:
@@ -230,7 +229,7 @@ def create_superset_chart_for_column(
         r = r.json()
         chart_id = r['id']
         chart_data = json.dumps(r['result'], indent=2)
-        with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+        with clickhouse_client() as c:
             c.insert(
                 'superset_charts',
                 [[superset_table_id, table_name, chart_id, chart_name, chart_data]],
@@ -249,7 +248,7 @@ def create_superset_chart_for_column(
 
 def init_clickhouse_tables_about_superset():
     print("Initializing clickhouse tables about superset")
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+    with clickhouse_client() as c:
         c.command("""CREATE TABLE IF NOT EXISTS superset_tables (
             superset_database_id UInt64,
             superset_table_id UInt64,
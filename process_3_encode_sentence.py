@@ -1,149 +1,386 @@
-from concurrent.futures import ThreadPoolExecutor
-import clickhouse_connect
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from py_index.clickhouse_client import clickhouse_client
+from py_index.database_settings import EMBEDDING_PIPELINE_SETTINGS, CLICKHOUSE_VECTOR_SETTINGS, EMBEDDING_MODEL_SETTINGS
+from py_index.embedding_models import embedding_model
+import multiprocessing
+import threading
+import queue
 import time
-from py_index.database_settings import CLICKHOUSE_SETTINGS
-from py_index.manticore_database_ops import manticore_client_weights_server, manticore_query
+import os
+from py_index.manticore_database_ops import manticore_client_weights_server, create_manticore_vector_table, manticore_vector_tables
+from py_index.vector_bulk_writer import VectorBulkWriter
+from py_index.clickhouse_vectors import init_clickhouse_vector_table, insert_clickhouse_vectors, backfill_clickhouse_vectors
 import datetime
 
 
 MIN_TEXT_LENGTH = 16
 CHUNK_SIZE = 2048
+# characters repeated from the end of one chunk at the start of the next one; 0 for disjoint chunks
+CHUNK_OVERLAP = 0
 
-from model2vec import StaticModel
-model = StaticModel.from_pretrained("minishlab/potion-base-2M")
+# one streamed block of chunks, as parallel columns; doc_ids are the chunks' ids in the vector table
+TextBatch = namedtuple('TextBatch', ['ids', 'texts', 'doc_ids'], defaults=(None,))
 
+MODEL_NAME = EMBEDDING_MODEL_SETTINGS['name']
 
-def load_text(table_name):
-    try:
-        yield from load_text_from_table(table_name)
-    except Exception as e:
-        print(f"Error loading text from table {table_name}: {e}")
 
+def table_text_columns(client, table_name):
+    table_columns = client.query_df(f"""
+        SELECT name FROM system.columns
+        WHERE table = '{table_name}'
+        and database = 'chicago_crimes_search'
+        and type in ('String', 'LowCardinality(String)', 'Nullable(String)')
+    """)
+    return table_columns['name'].tolist() if not table_columns.empty else []
 
-def load_text_from_table(table_name):
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as client:
-        table_columns = client.query_df(f"""
-            SELECT name FROM system.columns
-            WHERE table = '{table_name}'
-            and database = 'chicago_crimes_search'
-            and type in ('String', 'LowCardinality(String)', 'Nullable(String)')
-        """)
-        if table_columns.empty:
+
+def load_text_from_table(table_name, id_range=None):
+    with clickhouse_client() as client:
+        table_columns = table_text_columns(client, table_name)
+        if not table_columns:
             return
-        table_columns = table_columns['name'].tolist()
 
-        sql = f"""
-        SELECT id, concatWithSeparator(' ', {', '.join(f"CASE WHEN {col} IS NULL THEN '' ELSE {col} END" for col in table_columns)}) as text FROM {table_name}
-        WHERE ({' + '.join(f"CASE WHEN {col} IS NULL THEN 0 ELSE length(trim({col})) END" for col in table_columns)}) >= {MIN_TEXT_LENGTH}
-        ORDER BY id ASC
-        """
-        with client.query_df_stream(sql) as data_stream:
-            for data in data_stream:
-                if data.empty:
-                    break
-
-                new_rows = []
-                for _, row in data.iterrows():
-                    text = row['text']
-                    chunks = [text[i:i+CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
-                    for chunk in chunks:
-                        if len(chunk.strip()) >= MIN_TEXT_LENGTH:
-                            new_rows.append({'id': row['id'], 'text': chunk})
-
-                if not new_rows:
+        sql = chunked_text_sql(table_name, table_columns, id_range=id_range)
+        with client.query_column_block_stream(sql) as block_stream:
+            for ids, texts, doc_ids in block_stream:
+                if len(ids) == 0:
                     continue
-
-                chunked_df = pd.DataFrame(new_rows)
-                df_size = sum(chunked_df['text'].apply(lambda x:  len(x) if bool(x) else 16))
-                yield (table_name, chunked_df, df_size)
+                yield (table_name, TextBatch(ids, texts, doc_ids), sum(map(len, texts)))
+
+
+def chunked_text_sql(table_name, table_columns, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, id_range=None):
+    """Rows of (id, chunk, doc_id), chunked by ClickHouse itself, optionally only for ids in [start, end).
+
+    Every word goes to the window of step = chunk_size - overlap characters its end falls in, so words are never
+    cut and none is lost; a chunk is one window's words plus, with an overlap, the previous window's words ending
+    in its last `overlap` characters. A chunk can run past chunk_size by the words straddling a window or overlap
+    boundary; single words are capped at chunk_size characters. Windows are found with one pass over
+    the words (arraySplit), not one pass per chunk.
+    doc_id is a hash of (table, id, chunk index) that fits Manticore's signed ids, so re-uploading a chunk
+    replaces it instead of adding a duplicate.
+    """
+    id_condition = f"AND id >= {id_range[0]} AND id < {id_range[1]}" if id_range else ""
+    step = chunk_size - overlap
+    text_columns = ', '.join(f"ifNull({col}, '')" for col in table_columns)
+    if overlap > 0:
+        chunks_sql = f"""arrayMap(
+                (segment, previous, previous_ends) -> arrayConcat(
+                    arrayFilter((w, e) -> e > arrayMax(previous_ends) - {overlap}, previous, previous_ends), segment),
+                segments,
+                arrayPushFront(arrayPopBack(segments), CAST([], 'Array(String)')),
+                arrayPushFront(arrayPopBack(arraySplit((e, s) -> s, word_ends, window_starts)), CAST([], 'Array(UInt64)'))
+            )"""
+    else:
+        chunks_sql = "segments"
+    return f"""
+    SELECT id, text, bitAnd(cityHash64('{table_name}', id, chunk_index), 9223372036854775807) AS doc_id
+    FROM (
+        SELECT
+            id,
+            arrayMap(w -> substringUTF8(w, 1, {chunk_size}), splitByWhitespace(concatWithSeparator(' ', {text_columns}))) AS words,
+            -- end of each word (after its separator) and the window of its last character
+            arrayCumSum(arrayMap(w -> toUInt64(lengthUTF8(w) + 1), words)) AS word_ends,
+            arrayMap(e -> intDiv(e - 2, {step}), word_ends) AS word_windows,
+            arrayMap((c, p) -> c != p, word_windows, arrayPushFront(arrayPopBack(word_windows), word_windows[1])) AS window_starts,
+            arraySplit((w, s) -> s, words, window_starts) AS segments,
+            {chunks_sql} AS chunks,
+            arrayJoin(arrayEnumerate(chunks)) - 1 AS chunk_index,
+            arrayStringConcat(chunks[chunk_index + 1], ' ') AS text
+        FROM {table_name}
+        WHERE ({' + '.join(f"CASE WHEN {col} IS NULL THEN 0 ELSE length(trim({col})) END" for col in table_columns)}) >= {MIN_TEXT_LENGTH}
+        {id_condition}
+    )
+    WHERE lengthUTF8(text) >= {MIN_TEXT_LENGTH}
+    ORDER BY id ASC, chunk_index ASC
+    """
 
 
-def embed(data):
-    data = data['text'].tolist()
+def embed(batch):
+    data = batch.texts
     data_len = sum(len(x) for x in data)
     t0 = time.time()
-    embeddings = model.encode(data)
+    embeddings = embedding_model(MODEL_NAME).encode(data)
     t1 = time.time()
     print(f"Encoded {data_len} characters in {t1-t0} seconds = {data_len/(t1-t0)/1024/1024} MB/s")
-    embeddings = [list(i) for i in embeddings]
     return embeddings
 
 
 def insert_data_into_weights_table(table_name, data2, embeddings):
-    t0_total = time.time()
-    total_bytes = 0
-    batch_size = 10000
-
-    # Create a list of tuples, each containing a row's data and its corresponding embedding.
-    # This assumes data2 and embeddings are aligned.
-    rows_with_embeddings = list(zip(data2.to_dict('records'), embeddings))
-
-    for i in range(0, len(rows_with_embeddings), batch_size):
-        batch = rows_with_embeddings[i:i + batch_size]
-
-        value_clauses = []
-        params = []
-
-        for row_dict, embedding in batch:
-            vector_str = ','.join(map(str, embedding))
-
-            # The vector part is embedded directly into the query string because Manticore's tuple syntax `(1,2,3)`
-            # is not a standard SQL type that drivers understand for parameterization.
-            # The text_str part, however, IS parameterized to prevent SQL injection.
-            value_clause = f"('{table_name}', {row_dict['id']}, %s, ({vector_str}))"
-            value_clauses.append(value_clause)
-            params.append(row_dict['text'])
-
-        if not value_clauses:
-            continue
-
-        sql_values_part = ", ".join(value_clauses)
-        sql = f"""
-        INSERT INTO text_vector_64_floats (table_name, table_rowid, text_str, text_vector)
-        VALUES {sql_values_part}
-        """
-
-        with manticore_client_weights_server() as client:
-
-            manticore_query(client, sql, params)
-            total_bytes += len(sql) + sum(len(p) for p in params)
-
-            manticore_query(client, "COMMIT")
-
-    t1_total = time.time()
-    duration = t1_total - t0_total
-    total_rows_inserted = len(rows_with_embeddings)
-    print(f"Inserted {total_rows_inserted} rows ({total_bytes/1024/1024:.2f} MB) in {duration:.2f} seconds = {total_bytes/duration/1024/1024 if duration > 0 else 0:.2f} MB/s")
-
-
+    # rows are formatted and sent as they are read, in statements of VECTOR_UPLOAD_SETTINGS['batch_bytes'];
+    # the same doc ids go to the float table and to every enabled quantized variant of it
+    for vector_table in manticore_vector_tables():
+        with VectorBulkWriter(vector_table) as writer:
+            writer.add_many(table_name, data2.doc_ids, data2.ids, data2.texts, embeddings)
+        print(f"{vector_table}: {writer.report()}")
+    if CLICKHOUSE_VECTOR_SETTINGS['enabled']:
+        insert_clickhouse_vectors(table_name, data2, embeddings)
+
+
+
+def encode_batch(batch):
+    """Runs in an encoder process; each process holds its own copy of the model"""
+    return embed(batch)
+
+
+class StageStats:
+    """Throughput counters of one pipeline stage, shared by its worker threads"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.chars = 0
+        self.errors = 0
+        self.busy_s = 0.0
+        self.blocked_s = 0.0
+
+    def record(self, rows, chars, busy_s):
+        with self.lock:
+            self.batches += 1
+            self.rows += rows
+            self.chars += chars
+            self.busy_s += busy_s
+
+    def put(self, q, item):
+        """Put into the next stage's queue, counting the time spent blocked on backpressure"""
+        t0 = time.time()
+        q.put(item)
+        with self.lock:
+            self.blocked_s += time.time() - t0
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def summary(self, elapsed_s):
+        return (f"{self.name}: {self.batches} batches, {self.rows} rows, {self.chars/1024/1024:.2f} MB text, "
+                f"{self.rows/elapsed_s if elapsed_s > 0 else 0:.0f} rows/s, busy {self.busy_s:.1f}s, "
+                f"blocked {self.blocked_s:.1f}s, {self.errors} errors")
+
+
+def run_embedding_pipeline(table_names, readers=None, encoders=None, uploaders=None, queue_batches=None):
+    """ClickHouse readers -> encoder processes -> upload workers, connected by bounded queues.
+
+    A full queue blocks the stage feeding it, so at most `queue_batches` blocks wait between two stages and memory
+    stays flat whatever the number of tables. A table is marked in `input_table_vectors_computed` once all its
+    blocks are uploaded without errors. Each table is read in id ranges that are checkpointed as they complete, so
+    a rerun after a crash skips the ranges already done; chunks of a half-done range are replaced, not duplicated.
+    """
+    settings = EMBEDDING_PIPELINE_SETTINGS
+    readers = readers or settings['readers']
+    encoders = encoders or settings['encoders'] or os.cpu_count() or 1
+    uploaders = uploaders or settings['uploaders']
+    queue_batches = queue_batches or settings['queue_batches']
+
+    tables_queue = queue.Queue()
+    for table_name in table_names:
+        tables_queue.put(table_name)
+    encode_queue = queue.Queue(maxsize=queue_batches)
+    upload_queue = queue.Queue(maxsize=queue_batches)
+    stats = {name: StageStats(name) for name in ('read', 'encode', 'upload')}
+
+    # work is tracked per (table_name, range_start) id range: blocks read but not uploaded yet and rows uploaded;
+    # a range is checkpointed once it is fully read and uploaded, a table is done once all its ranges are
+    progress_lock = threading.Lock()
+    pending_blocks = {}
+    uploaded_rows = {}
+    ranges_read = set()
+    open_ranges = {table_name: 0 for table_name in table_names}
+    tables_read = set()
+    failed = set()
+
+    def block_finished(id_range, rows, ok=True):
+        with progress_lock:
+            if ok:
+                uploaded_rows[id_range] += rows
+            else:
+                failed.add(id_range)
+            pending_blocks[id_range] -= 1
+            finished = id_range in ranges_read and pending_blocks[id_range] == 0
+        if finished:
+            range_finished(id_range)
+
+    def range_read(id_range, ok=True):
+        with progress_lock:
+            if not ok:
+                failed.add(id_range)
+            ranges_read.add(id_range)
+            finished = pending_blocks[id_range] == 0
+        if finished:
+            range_finished(id_range)
+
+    def range_finished(id_range):
+        # runs on the stage threads: an error here must not escape, a dead upload thread stalls the whole pipeline
+        table_name, range_start, range_end = id_range
+        ok = id_range not in failed
+        if ok:
+            try:
+                save_checkpoint(table_name, range_start, range_end, uploaded_rows[id_range])
+            except Exception as e:
+                print(f"Error checkpointing {table_name} ids [{range_start}, {range_end}): {e}")
+                ok = False
+        if not ok:
+            print(f"Table {table_name} ids [{range_start}, {range_end}) had errors, not checkpointing them")
+            with progress_lock:
+                failed.add(id_range)
+                failed.add(table_name)
+        with progress_lock:
+            open_ranges[table_name] -= 1
+            finished = table_name in tables_read and open_ranges[table_name] == 0
+        if finished:
+            mark_table_done(table_name)
+
+    def table_read(table_name):
+        with progress_lock:
+            tables_read.add(table_name)
+            finished = open_ranges[table_name] == 0
+        if finished:
+            mark_table_done(table_name)
+
+    def mark_table_done(table_name):
+        if table_name in failed:
+            print(f"Table {table_name} had errors, not marking it as computed")
+            return
+        try:
+            with clickhouse_client() as c:
+                c.insert('input_table_vectors_computed', [[table_name, datetime.datetime.now()]], column_names=['table_name', 'event_time'])
+        except Exception as e:
+            # its ranges are all checkpointed, the next run only has to mark it
+            print(f"Error marking table {table_name} as computed: {e}")
+            return
+        print(f"Table {table_name} done")
+
+    def read_worker():
+        while True:
+            try:
+                table_name = tables_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                id_ranges = pending_id_ranges(table_name)
+            except Exception as e:
+                print(f"Error listing id ranges of table {table_name}: {e}")
+                id_ranges = []
+                with progress_lock:
+                    failed.add(table_name)
+            for range_start, range_end in id_ranges:
+                id_range = (table_name, range_start, range_end)
+                with progress_lock:
+                    open_ranges[table_name] += 1
+                    pending_blocks[id_range] = 0
+                    uploaded_rows[id_range] = 0
+                ok = True
+                t0 = time.time()
+                try:
+                    for (_, batch, batch_size) in load_text_from_table(table_name, (range_start, range_end)):
+                        with progress_lock:
+                            pending_blocks[id_range] += 1
+                        stats['read'].record(len(batch.ids), batch_size, time.time() - t0)
+                        stats['read'].put(encode_queue, (id_range, batch, batch_size))
+                        t0 = time.time()
+                except Exception as e:
+                    print(f"Error loading text from table {table_name} ids [{range_start}, {range_end}): {e}")
+                    stats['read'].error()
+                    ok = False
+                range_read(id_range, ok)
+            table_read(table_name)
+
+    def encode_worker(pool):
+        while True:
+            item = encode_queue.get()
+            if item is None:
+                return
+            id_range, batch, batch_size = item
+            t0 = time.time()
+            try:
+                embeddings = pool.submit(encode_batch, batch).result()
+            except Exception as e:
+                print(f"Error encoding a block of {id_range[0]}: {e}")
+                stats['encode'].error()
+                block_finished(id_range, 0, ok=False)
+                continue
+            stats['encode'].record(len(batch.ids), batch_size, time.time() - t0)
+            stats['encode'].put(upload_queue, (id_range, batch, batch_size, embeddings))
+
+    def upload_worker():
+        while True:
+            item = upload_queue.get()
+            if item is None:
+                return
+            id_range, batch, batch_size, embeddings = item
+            t0 = time.time()
+            try:
+                insert_data_into_weights_table(id_range[0], batch, embeddings)
+            except Exception as e:
+                print(f"Error uploading a block of {id_range[0]}: {e}")
+                stats['upload'].error()
+                block_finished(id_range, 0, ok=False)
+                continue
+            stats['upload'].record(len(batch.ids), batch_size, time.time() - t0)
+            block_finished(id_range, len(batch.ids))
 
-def process_table_compute_upload_vectors(table_name):
-    current_size = 0
     t0 = time.time()
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = []
-        for (_, data2, df_size) in load_text(table_name):
-            msg = f"Chunk in: {df_size/1024} KB"
-            current_size += df_size
-            embeddings = embed(data2)
-            msg += f" - Chunk out: {sum(len(x) for x in embeddings)/1024} KB"
-            futures.append(executor.submit(insert_data_into_weights_table, table_name, data2, embeddings))
-            current_speed_kb = current_size / (time.time() - t0) / 1024
-            print(f"  - Current speed: {current_speed_kb} KB/s - {msg}")
+    # load the model here first: the local memory-mapped copy is written once, before any encoder starts
+    embedding_model(MODEL_NAME)
+    # spawn, not fork: the readers and the connection pools run threads by the time the first process starts
+    # each encoder process loads the model once, when it starts
+    with ProcessPoolExecutor(max_workers=encoders, mp_context=multiprocessing.get_context('spawn'), initializer=embedding_model) as pool:
+        read_threads = [threading.Thread(target=read_worker, daemon=True) for _ in range(readers)]
+        encode_threads = [threading.Thread(target=encode_worker, args=(pool,), daemon=True) for _ in range(encoders)]
+        upload_threads = [threading.Thread(target=upload_worker, daemon=True) for _ in range(uploaders)]
+        for t in read_threads + encode_threads + upload_threads:
+            t.start()
+
+        for t in read_threads:
+            t.join()
+        for _ in encode_threads:
+            encode_queue.put(None)
+        for t in encode_threads:
+            t.join()
+        for _ in upload_threads:
+            upload_queue.put(None)
+        for t in upload_threads:
+            t.join()
+
+    elapsed_s = time.time() - t0
+    print(f"Embedding pipeline: {len(table_names)} tables in {elapsed_s:.1f} seconds "
+          f"({readers} readers, {encoders} encoders, {uploaders} uploaders)")
+    for stage in stats.values():
+        print(f"  - {stage.summary(elapsed_s)}")
+
+
+def pending_id_ranges(table_name, range_ids=None):
+    """[start, end) id ranges of the table, aligned on multiples of `range_ids`, that have no checkpoint yet"""
+    range_ids = range_ids or EMBEDDING_PIPELINE_SETTINGS['checkpoint_id_range']
+    with clickhouse_client() as client:
+        min_id, max_id = client.query(f"SELECT min(id), max(id) FROM {table_name}").result_rows[0]
+        done = set(client.query(
+            "SELECT range_start, range_end FROM input_table_vectors_checkpoints WHERE table_name = %(table_name)s",
+            parameters={'table_name': table_name}).result_rows)
+    first = min_id // range_ids * range_ids
+    id_ranges = [(start, start + range_ids) for start in range(first, max_id + 1, range_ids)]
+    pending = [r for r in id_ranges if r not in done]
+    if len(pending) < len(id_ranges):
+        print(f"Resuming {table_name}: {len(id_ranges) - len(pending)} of {len(id_ranges)} id ranges already done")
+    return pending
+
+
+def save_checkpoint(table_name, range_start, range_end, rows):
+    with clickhouse_client() as c:
+        c.insert('input_table_vectors_checkpoints', [[table_name, range_start, range_end, rows, datetime.datetime.now()]],
+                 column_names=['table_name', 'range_start', 'range_end', 'rows', 'event_time'])
 
-        for future in futures:
-            future.result()
 
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
-        current_time = datetime.datetime.now()
-        c.insert('input_table_vectors_computed', [[table_name, current_time]], column_names=['table_name', 'event_time'])
+def process_table_compute_upload_vectors(table_name):
+    run_embedding_pipeline([table_name])
 
 
 
 def process_all_tables_upload_vectors():
     init_various_tables()
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         all_tables_df = client.query_df("SELECT table_name FROM input_tables_summary ORDER BY table_name")
         data = all_tables_df['table_name'].tolist()
 
@@ -156,39 +393,34 @@ def process_all_tables_upload_vectors():
         print("All tables have already been processed.")
         return
 
-    # run in parallel
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(process_table_compute_upload_vectors, table_name) for table_name in data]
-        for future in futures:
-            future.result()
+    run_embedding_pipeline(data)
 
 
 def init_various_tables():
     with manticore_client_weights_server() as client:
-        tables = manticore_query(client, "SHOW TABLES")
-        if not tables.empty:
-            tables = tables['Table'].tolist()
-        else:
-            tables = []
-        if 'text_vector_64_floats' not in tables:
-            manticore_query(
-                client,
-            f"""
-            CREATE TABLE text_vector_64_floats (
-                table_name string attribute,
-                table_rowid bigint,
-                text_str text,
-                text_vector float_vector knn_type='hnsw' knn_dims='64' hnsw_similarity='l2'
-            )
-            """)
-
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+        for vector_table, quantization in manticore_vector_tables().items():
+            create_manticore_vector_table(client, vector_table, quantization=quantization)
+
+    with clickhouse_client() as c:
         c.command("""CREATE TABLE IF NOT EXISTS input_table_vectors_computed (
             table_name String,
             event_time DateTime DEFAULT now()
         ) ENGINE = MergeTree()
         ORDER BY (table_name, event_time)
         """)
+        c.command("""CREATE TABLE IF NOT EXISTS input_table_vectors_checkpoints (
+            table_name String,
+            range_start Int64,
+            range_end Int64,
+            rows UInt64,
+            event_time DateTime DEFAULT now()
+        ) ENGINE = ReplacingMergeTree()
+        ORDER BY (table_name, range_start, range_end)
+        """)
+        if CLICKHOUSE_VECTOR_SETTINGS['enabled']:
+            init_clickhouse_vector_table(c)
+    if CLICKHOUSE_VECTOR_SETTINGS['enabled']:
+        backfill_clickhouse_vectors()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Re-index the delta table of every indexed table, and merge the deltas that grew too big into their main table.
+
+    uv run process_4_update_delta_indexes.py          # refresh deltas, merge the big ones
+    uv run process_4_update_delta_indexes.py --merge  # refresh and merge every delta
+"""
+
+import sys
+from py_index.clickhouse_client import clickhouse_client
+from py_index.manticore_database_ops import (
+    manticore_client_data_server, manticore_query_rows, manticore_delta_table,
+    index_table_delta_into_manticore, merge_table_delta_into_main,
+)
+
+
+# merge once the delta holds this many rows; past that it stops being cheap to rebuild
+MERGE_DELTA_ROW_COUNT = 1_000_000
+
+
+def delta_row_count(table_name):
+    with manticore_client_data_server() as client:
+        return manticore_query_rows(client, f"SELECT COUNT(*) as count FROM {manticore_delta_table(table_name)}")[0][0]
+
+
+def process_4_update_delta_indexes(force_merge=False):
+    with clickhouse_client() as client:
+        tables = client.query_df('select table_name from input_tables_summary')['table_name'].tolist()
+
+    for table_name in tables:
+        try:
+            print(f"Updating delta for {table_name}")
+            index_table_delta_into_manticore(table_name)
+            row_count = delta_row_count(table_name)
+            print(f"Delta for {table_name} has {row_count} rows")
+            if force_merge or row_count >= MERGE_DELTA_ROW_COUNT:
+                merge_table_delta_into_main(table_name)
+        except Exception as e:
+            print(f"Error updating delta for {table_name}: {str(e)}")
+
+
+if __name__ == "__main__":
+    process_4_update_delta_indexes(force_merge='--merge' in sys.argv)
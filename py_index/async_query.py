@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import queue
+import asyncio
+import threading
+import urllib.parse
+from py_index.database_settings import ASYNC_QUERY_SETTINGS
+from py_index.query_telemetry import record_query
+from py_index.concurrency_limiter import async_adaptive_limiter
+
+
+class StaleConnectionError(ConnectionError):
+    """The connection failed before any byte of the response arrived"""
+
+
+class AsyncHttpConnectionPool:
+    """Minimal HTTP/1.1 keep-alive client on asyncio streams, bounded to `max_connections` in flight.
+
+    A reused keep-alive connection the server already closed fails before any response byte; such a request is
+    retried once on a fresh connection. The statements sent through it are reads, so a retry is safe.
+    """
+
+    def __init__(self, host, port, max_connections):
+        self.host = host
+        self.port = port
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = []
+
+    async def request(self, method, path, body=b'', headers=None):
+        async with self._slots:
+            reused = bool(self._idle)
+            if reused:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                try:
+                    status, response_headers, response_body = await self._roundtrip(reader, writer, method, path, body, headers or {})
+                except StaleConnectionError:
+                    if not reused:
+                        raise
+                    writer.close()
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                    status, response_headers, response_body = await self._roundtrip(reader, writer, method, path, body, headers or {})
+            except BaseException:
+                # timeouts and cancellations leave the stream mid-response, it can't be reused
+                writer.close()
+                raise
+            if response_headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self._idle.append((reader, writer))
+            return status, response_body
+
+    async def _roundtrip(self, reader, writer, method, path, body, headers):
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}", "Connection: keep-alive"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+            await writer.drain()
+            status_line = await reader.readline()
+        except OSError as e:
+            raise StaleConnectionError(f"{self.host}:{self.port}: {str(e)}") from e
+        if not status_line:
+            raise StaleConnectionError(f"{self.host}:{self.port} closed the connection")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            return status, response_headers, b''.join(chunks)
+        if 'content-length' in response_headers:
+            return status, response_headers, await reader.readexactly(int(response_headers['content-length']))
+        response_headers['connection'] = 'close'
+        return status, response_headers, await reader.read()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+_pools = {}
+
+
+def event_loop():
+    """The background event loop all async queries run on, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-query-loop', daemon=True).start()
+        return _loop
+
+
+def _pool(host, port):
+    # only touched from the event loop thread
+    if (host, port) not in _pools:
+        _pools[(host, port)] = AsyncHttpConnectionPool(host, port, ASYNC_QUERY_SETTINGS['max_concurrency'])
+    return _pools[(host, port)]
+
+
+def format_manticore_sql(sql, args=None):
+    """Inline `%s` args the way pymysql would, the HTTP endpoint has no parameter binding"""
+    if not args:
+        return sql
+    from pymysql.converters import escape_item
+    return sql % tuple(escape_item(arg, 'utf8mb4') for arg in args)
+
+
+async def manticore_sql_async(sql, args=None, server='data'):
+    """Rows (dicts) of a statement sent to Manticore's HTTP /sql endpoint"""
+    host, port = ASYNC_QUERY_SETTINGS['manticore_http'][server]
+    sql = format_manticore_sql(sql, args)
+    body = urllib.parse.urlencode({'mode': 'raw', 'query': sql}).encode()
+    t0 = time.time()
+    try:
+        async with async_adaptive_limiter(f'manticore_http:{server}').slot():
+            status, response = await _pool(host, port).request('POST', '/sql', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            result = json.loads(response)
+            if isinstance(result, dict) and result.get('error'):
+                raise RuntimeError(f"Manticore HTTP {status}: {result['error']}")
+            result = result[0] if isinstance(result, list) else result
+            if result.get('error'):
+                raise RuntimeError(f"Manticore HTTP {status}: {result['error']}")
+    except Exception as e:
+        record_query('manticore_http', sql, time.time() - t0, error=e)
+        raise
+    rows = result.get('data', [])
+    record_query('manticore_http', sql, time.time() - t0, len(rows), len(response))
+    return rows
+
+
+def fan_out(jobs, timeout_s=None, request=None):
+    """Run coroutines on the background loop; yield (key, result, error) in completion order.
+
+    `jobs` maps a key to a coroutine function taking no arguments. Every job gets its own timeout, so one slow
+    table only loses its own result. With a `SearchRequest`, the timeout is capped by its deadline and the
+    unfinished jobs are abandoned as soon as a newer search supersedes it.
+    """
+    timeout_s = timeout_s or ASYNC_QUERY_SETTINGS['request_timeout_s']
+    if request is not None:
+        timeout_s = min(timeout_s, request.remaining_s())
+    results = queue.Queue()
+
+    async def run(key, job):
+        try:
+            results.put((key, await asyncio.wait_for(job(), timeout_s), None))
+        except asyncio.TimeoutError:
+            results.put((key, None, TimeoutError(f"{key} timed out after {timeout_s}s")))
+        except Exception as e:
+            results.put((key, None, e))
+
+    async def run_all():
+        await asyncio.gather(*(run(key, job) for key, job in jobs.items()))
+
+    loop = event_loop()
+    future = asyncio.run_coroutine_threadsafe(run_all(), loop)
+    if request is not None:
+        request.attach(future)
+    try:
+        pending = len(jobs)
+        while pending:
+            if request is not None and request.cancelled:
+                break
+            try:
+                item = results.get(timeout=0.05)
+            except queue.Empty:
+                # cancelled jobs never report back
+                if future.done() and results.empty():
+                    break
+                continue
+            pending -= 1
+            yield item
+    finally:
+        # the caller stopped early: don't leave the remaining queries running
+        future.cancel()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+import contextlib
+import contextvars
+from py_index.database_settings import CLICKHOUSE_SETTINGS, CLICKHOUSE_CLIENT_PROFILES
+from py_index.query_telemetry import record_query
+
+
+# client methods that send a request to the server
+COUNTED_METHODS = {
+    'query', 'query_df', 'query_np', 'query_arrow', 'query_df_stream', 'query_rows_stream',
+    'query_column_block_stream', 'query_row_block_stream', 'raw_query', 'command', 'insert', 'insert_df', 'insert_arrow',
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+_pool_managers = {}
+_request_query_count = contextvars.ContextVar('clickhouse_request_query_count', default=None)
+
+
+class _CountingClient:
+    """Wraps a shared clickhouse_connect client; counts the queries of the current request and records telemetry"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in COUNTED_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            counter = _request_query_count.get()
+            if counter is not None:
+                counter[0] += 1
+            sql = args[0] if args and isinstance(args[0], str) else kwargs.get('query', kwargs.get('cmd', kwargs.get('table', '')))
+            if name.startswith('insert'):
+                sql = f"INSERT INTO {sql}"
+            t0 = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                record_query('clickhouse', sql, time.time() - t0, error=e)
+                raise
+            record_query('clickhouse', sql, time.time() - t0, *_result_size(result))
+            return result
+        return counted
+
+
+def _result_size(result):
+    """(rows, bytes) of a clickhouse_connect result, as far as it tells"""
+    summary = getattr(result, 'summary', None)
+    summary = summary if isinstance(summary, dict) else {}
+    if hasattr(result, 'written_rows'):
+        return int(summary.get('written_rows', 0)), int(summary.get('written_bytes', 0))
+    if hasattr(result, 'row_count'):
+        return result.row_count, int(summary.get('read_bytes', 0))
+    if hasattr(result, 'shape'):
+        return result.shape[0], 0
+    if hasattr(result, 'num_rows'):
+        return result.num_rows, result.nbytes
+    return 0, 0
+
+
+def _pool_manager(pool_size):
+    from clickhouse_connect.driver import httputil
+    key = (pool_size, os.getpid())
+    if key not in _pool_managers:
+        _pool_managers[key] = httputil.get_pool_manager(maxsize=pool_size)
+    return _pool_managers[key]
+
+
+def _shared_client(profile):
+    key = (profile, os.getpid())
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            from clickhouse_connect import get_client
+            options = dict(CLICKHOUSE_CLIENT_PROFILES[profile])
+            pool_size = options.pop('pool_size')
+            settings = {**CLICKHOUSE_SETTINGS['settings'], **options.pop('settings', {})}
+            client = get_client(
+                **{k: v for k, v in CLICKHOUSE_SETTINGS.items() if k != 'settings'},
+                settings=settings,
+                # one client is shared by every thread, a server session would serialize them
+                autogenerate_session_id=False,
+                pool_mgr=_pool_manager(pool_size),
+                **options,
+            )
+            _clients[key] = client
+        return client
+
+
+@contextlib.contextmanager
+def clickhouse_client(profile='ingest'):
+    """Process-wide keep-alive ClickHouse client for a settings profile from `CLICKHOUSE_CLIENT_PROFILES`.
+
+    Drop-in for `with get_client(**CLICKHOUSE_SETTINGS) as client:`, except that leaving the block does not
+    close the client, so there is no connection setup per call.
+    """
+    yield _CountingClient(_shared_client(profile))
+
+
+def start_request_query_count():
+    """Start counting the ClickHouse queries of the current request (thread / context)"""
+    _request_query_count.set([0])
+
+
+def request_query_count():
+    counter = _request_query_count.get()
+    return counter[0] if counter is not None else 0
+
+
+def close_clickhouse_clients():
+    pid = os.getpid()
+    with _clients_lock:
+        keys = [key for key in _clients if key[1] == pid]
+        clients = [_clients.pop(key) for key in keys]
+    for client in clients:
+        client.close()
@@ -1,6 +1,6 @@
 import time
 from clickhouse_connect import get_client
-from py_index.database_settings import CLICKHOUSE_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
 import re
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -24,7 +24,7 @@ def reset_database():
 
 
 def reset_tables():
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         execute_query(client, 'DROP TABLE IF EXISTS input_tables_list SYNC;')
         execute_query(client, '''CREATE TABLE input_tables_list (
             table_name String,
@@ -108,7 +108,7 @@ def reset_tables():
 
 
 def fetch_table_raw_column_stats(table_name):
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         table_row_count = client.query(f'''
         SELECT count()
         FROM {table_name}
@@ -145,7 +145,7 @@ def fetch_table_raw_column_stats(table_name):
 
 def _fetch_raw_column_stats(table_name, column_index, column_name, column_type, table_row_count):
     print(f"Loading column stats for {table_name}.{column_name}")
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         column_base_type = re.match(r'^(?:Nullable\()?([^()]+)(?:\))?$', column_type).group(1)
 
         # Get null count
@@ -205,7 +205,7 @@ def _fetch_raw_column_stats(table_name, column_index, column_name, column_type,
 
 
 def recreate_table(table_name):
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         item = client.query(f"select item_name, table_name from input_tables_list where table_name = '{table_name}'")
         if item.result_rows:
             item_name = item.result_rows[0][0]
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import time
+from py_index.database_settings import CLICKHOUSE_VECTOR_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
+
+
+VECTOR_COLUMNS = ['table_name', 'table_rowid', 'doc_id', 'text_str', 'embedding']
+
+# rows per Manticore page when backfilling
+BACKFILL_PAGE_ROWS = 10000
+
+
+def init_clickhouse_vector_table(client):
+    """ClickHouse copy of text_vector_64_floats, joinable with the table_* data on (table_name, table_rowid)"""
+    settings = CLICKHOUSE_VECTOR_SETTINGS
+    index_line = ""
+    if settings['similarity_index']:
+        index_line = f",\n        INDEX embedding_index embedding TYPE vector_similarity('hnsw', '{settings['distance']}', {settings['dims']})"
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {settings['table']} (
+        table_name LowCardinality(String),
+        table_rowid Int64,
+        doc_id UInt64,
+        text_str String,
+        embedding Array(Float32){index_line}
+    ) ENGINE = ReplacingMergeTree() ORDER BY (table_name, table_rowid, doc_id)
+    """, settings={'allow_experimental_vector_similarity_index': 1} if settings['similarity_index'] else None)
+
+
+def insert_clickhouse_vectors(table_name, batch, embeddings):
+    """Write one uploaded block (a TextBatch and its embeddings) to the ClickHouse vector table"""
+    embeddings = embeddings.tolist() if hasattr(embeddings, 'tolist') else [list(e) for e in embeddings]
+    columns = [[table_name] * len(batch.ids), list(batch.ids), list(batch.doc_ids), list(batch.texts), embeddings]
+    with clickhouse_client() as client:
+        client.insert(CLICKHOUSE_VECTOR_SETTINGS['table'], columns, column_names=VECTOR_COLUMNS, column_oriented=True)
+
+
+def clickhouse_knn(vector, k, exact=False):
+    """The k nearest chunks to `vector` as a DataFrame shaped like the Manticore KNN result.
+
+    Uses the vector similarity index when the table has one; `exact=True` skips it for a brute-force scan,
+    which is the ground truth to check the approximate indexes against. Distances are squared L2, like
+    knn_dist() of the hnsw_similarity='l2' Manticore table.
+    """
+    settings = CLICKHOUSE_VECTOR_SETTINGS
+    vector_literal = '[' + ','.join(map(repr, map(float, vector))) + ']'
+    query_settings = {'use_skip_indexes': 0} if exact else None
+    # the similarity index is only used for an ORDER BY on its own distance function; same order either way
+    order_by = f"{settings['distance']}(embedding, {vector_literal})" if settings['similarity_index'] and not exact else 'distance'
+    with clickhouse_client('interactive') as client:
+        # rows re-inserted for a chunk wait for a merge to be replaced, keep one per doc_id instead of using FINAL
+        return client.query_df(f"""
+            SELECT doc_id AS id, table_name, table_rowid, text_str, L2SquaredDistance(embedding, {vector_literal}) AS distance
+            FROM {settings['table']}
+            ORDER BY {order_by} ASC
+            LIMIT 1 BY doc_id
+            LIMIT {int(k)}
+        """, settings=query_settings)
+
+
+def backfill_clickhouse_vectors():
+    """Copy the vectors of tables encoded before the ClickHouse copy existed from text_vector_64_floats.
+
+    Those tables are in input_table_vectors_computed (or have checkpointed ranges) but have no row in the vector
+    table, and process_3 does not encode them again. Rows are paged by id from Manticore and inserted per page.
+    """
+    from py_index.manticore_database_ops import manticore_client_weights_server, manticore_query_rows
+    settings = CLICKHOUSE_VECTOR_SETTINGS
+    with clickhouse_client() as client:
+        tables = [row[0] for row in client.query(f"""
+            SELECT DISTINCT table_name FROM (
+                SELECT table_name FROM input_table_vectors_computed
+                UNION ALL SELECT table_name FROM input_table_vectors_checkpoints
+            )
+            WHERE table_name NOT IN (SELECT DISTINCT table_name FROM {settings['table']})
+            ORDER BY table_name
+        """).result_rows]
+    for table_name in tables:
+        t0 = time.time()
+        rows = 0
+        last_id = 0
+        with manticore_client_weights_server() as manticore_client:
+            while True:
+                page = manticore_query_rows(manticore_client, f"""
+                    SELECT id, table_rowid, text_str, text_vector FROM text_vector_64_floats
+                    WHERE table_name = %s AND id > {last_id}
+                    ORDER BY id ASC LIMIT {BACKFILL_PAGE_ROWS}
+                    OPTION max_matches={BACKFILL_PAGE_ROWS}
+                """, (table_name,))
+                if not page:
+                    break
+                columns = [
+                    [table_name] * len(page),
+                    [row[1] for row in page],
+                    [row[0] for row in page],
+                    [row[2] for row in page],
+                    [_parse_manticore_vector(row[3]) for row in page],
+                ]
+                with clickhouse_client() as client:
+                    client.insert(settings['table'], columns, column_names=VECTOR_COLUMNS, column_oriented=True)
+                rows += len(page)
+                last_id = page[-1][0]
+        print(f"Backfilled {rows} vectors of {table_name} into {settings['table']} in {time.time() - t0:.1f} seconds")
+
+
+def _parse_manticore_vector(value):
+    # float_vector attributes come back over the MySQL protocol as a comma separated string
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    return [float(x) for x in value.strip('()[] ').split(',')]
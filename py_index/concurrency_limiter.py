@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import time
+import asyncio
+import threading
+import contextlib
+from collections import deque
+from py_index.database_settings import ADAPTIVE_CONCURRENCY_SETTINGS
+
+
+class AIMDLimit:
+    """Additive-increase / multiplicative-decrease concurrency limit, driven by the latency and errors of completed calls.
+
+    Every call under `latency_target_ms` grows the limit by 1/limit (about +1 per window of calls); an error or a
+    slow call shrinks it by `backoff`, at most once per `cooldown_s` so one burst of slow calls counts once.
+    """
+
+    def __init__(self, name, initial_limit, min_limit, max_limit, latency_target_ms, backoff, cooldown_s):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_s = latency_target_ms / 1000
+        self.backoff = backoff
+        self.cooldown_s = cooldown_s
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'errors': 0, 'decreases': 0, 'queued': 0, 'wait_time_total_s': 0.0, 'wait_time_max_s': 0.0}
+
+    def has_room(self):
+        return self.in_flight < int(self.limit)
+
+    def on_acquired(self, wait_s):
+        self.in_flight += 1
+        with self._stats_lock:
+            self._stats['calls'] += 1
+            self._stats['wait_time_total_s'] += wait_s
+            self._stats['wait_time_max_s'] = max(self._stats['wait_time_max_s'], wait_s)
+            if wait_s > 0:
+                self._stats['queued'] += 1
+
+    def on_released(self, latency_s, error=False):
+        self.in_flight -= 1
+        if error or latency_s > self.latency_target_s:
+            now = time.time()
+            with self._stats_lock:
+                self._stats['errors'] += int(error)
+            if now - self._last_decrease >= self.cooldown_s:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                with self._stats_lock:
+                    self._stats['decreases'] += 1
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_cancelled(self):
+        """A call abandoned by its caller tells nothing about the target's load: free the slot, keep the limit"""
+        self.in_flight -= 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['limit'] = int(self.limit)
+        stats['in_flight'] = self.in_flight
+        stats['queue_delay_avg_ms'] = 1000 * stats['wait_time_total_s'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+
+
+class AdaptiveLimiter(AIMDLimit):
+    """For threads: `with limiter.slot():` blocks while the limit is reached"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        t0 = time.time()
+        with self._condition:
+            while not self.has_room():
+                self._condition.wait(timeout=0.1)
+            self.on_acquired(time.time() - t0)
+        t1 = time.time()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            with self._condition:
+                self.on_released(time.time() - t1, error)
+                self._condition.notify_all()
+
+
+class AsyncAdaptiveLimiter(AIMDLimit):
+    """For coroutines on one event loop: `async with limiter.slot():`"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiters = deque()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        t0 = time.time()
+        while not self.has_room():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # woken and cancelled before running: pass the wakeup on, or the next waiter sleeps through the free slot
+                    self._wake_waiters()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.on_acquired(time.time() - t0)
+        t1 = time.time()
+        error = False
+        cancelled = False
+        try:
+            yield
+        except (OSError, asyncio.TimeoutError):
+            # connection trouble means overload; a query error from the server does not
+            error = True
+            raise
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            latency_s = time.time() - t1
+            # a cancelled call is no success; it only counts when it was already slower than the target, like a timeout
+            if cancelled and latency_s <= self.latency_target_s:
+                self.on_cancelled()
+            else:
+                self.on_released(latency_s, error)
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        # woken waiters check for room again, waking one too many is harmless
+        for _ in range(max(0, int(self.limit) - self.in_flight)):
+            if not self._waiters:
+                break
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter_settings(name):
+    return {**ADAPTIVE_CONCURRENCY_SETTINGS['default'], **ADAPTIVE_CONCURRENCY_SETTINGS.get(name, {})}
+
+
+def adaptive_limiter(name):
+    """The process-wide thread limiter for a target, e.g. 'manticore_weights_insert'"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name, **_limiter_settings(name))
+        return _limiters[name]
+
+
+def async_adaptive_limiter(name):
+    """The limiter for a target on the async query loop, e.g. 'manticore_http:data'; use from that loop only"""
+    key = ('async', name)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AsyncAdaptiveLimiter(name, **_limiter_settings(name))
+        return _limiters[key]
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -10,4 +10,175 @@ CLICKHOUSE_SETTINGS = {
         'input_format_allow_errors_num': 1024,
         'input_format_allow_errors_ratio': 0.05,
     }
-}
\ No newline at end of file
+}
+
+# Settings profiles for py_index.clickhouse_client; `settings` are merged over CLICKHOUSE_SETTINGS['settings']
+CLICKHOUSE_CLIENT_PROFILES = {
+    # search demo callbacks: short queries, fail fast instead of piling up behind a slow one
+    'interactive': {
+        'pool_size': 32,
+        'compress': 'lz4',
+        'connect_timeout': 5,
+        'send_receive_timeout': 60,
+        'settings': {
+            'max_execution_time': 30,
+            # query history rows are fire-and-forget
+            'wait_for_async_insert': 0,
+        },
+    },
+    # loading, indexing and encoding scripts: long reads and bulk inserts
+    'ingest': {
+        'pool_size': 16,
+        'compress': 'zstd',
+        'connect_timeout': 10,
+        'send_receive_timeout': 600,
+    },
+}
+
+MANTICORE_INDEX_SETTINGS = {
+    # False falls back to the old `min_infix_len = 3` + `columnar_attrs = *` for every table
+    'profile_driven': True,
+    'min_infix_len': 3,
+    'min_prefix_len': 3,
+    # text fields with a shorter average length (codes like IUCR, beat, ward) get infixes,
+    # longer free text only gets prefixes
+    'infix_max_avg_length': 32,
+    # attributes with at most this many distinct values are hot filter/facet attributes
+    'hot_filter_max_unique_count': 10000,
+    'length_sample_rows': 100000,
+    # one extra index with the text of every table, so cross-table search
+    # (autocomplete, highlights, suggestions) takes one query instead of one per table
+    'unified_index': False,
+    'unified_index_name': 'all_tables_search',
+    # reindexing builds a new table version behind the alias; the old one is deleted this long after the swap
+    'retired_version_grace_period_s': 600,
+}
+
+MANTICORE_SERVERS = {
+    'data': {'host': 'localhost', 'port': 9306, 'user': 'user', 'password': 'pass'},
+    'weights': {'host': 'localhost', 'port': 19306, 'user': 'user', 'password': 'pass'},
+}
+
+# py_index.async_query: Manticore HTTP endpoints used for the per-table fan-out in the search demo
+ASYNC_QUERY_SETTINGS = {
+    'manticore_http': {'data': ('localhost', 9308), 'weights': ('localhost', 19308)},
+    # queries in flight per server
+    'max_concurrency': 32,
+    'request_timeout_s': 2.0,
+}
+
+# py_index.query_cache: search results shared by the demo tabs, invalidated when a table gets a new index generation
+QUERY_CACHE_SETTINGS = {
+    'enabled': True,
+    # 'memory' (per process) or 'disk' (diskcache, shared by all app processes)
+    'backend': 'memory',
+    'disk_path': '/tmp/search_demo_query_cache',
+    'disk_size_limit_bytes': 256 * 1024 * 1024,
+    'max_entries': 2048,
+    'ttl_s': 600,
+}
+
+# py_index.query_telemetry: every Manticore / ClickHouse query, batched into the query_telemetry table
+TELEMETRY_SETTINGS = {
+    'enabled': True,
+    # share of queries recorded; errors and slow queries are always recorded
+    'sample_rate': 0.1,
+    'slow_query_ms': 500,
+    # run SHOW META after sampled Manticore SELECTs (one extra statement on the same connection)
+    'show_meta': True,
+    # print every query to stdout, as manticore_query used to
+    'echo_queries': False,
+    'batch_size': 1000,
+    'flush_interval_s': 2.0,
+    'max_queue': 100000,
+    'max_sql_length': 4000,
+    'ttl_days': 30,
+}
+
+# py_index.search_requests: time budget of one keystroke-driven search, newer keystrokes cancel older ones
+SEARCH_DEADLINE_SETTINGS = {
+    'autocomplete_ms': 500,
+    'highlights_ms': 2000,
+    'facet_ms': 3000,
+}
+
+# py_index.concurrency_limiter: AIMD limits on concurrent calls per target, sized from latency and errors
+ADAPTIVE_CONCURRENCY_SETTINGS = {
+    'default': {
+        'initial_limit': 8,
+        'min_limit': 1,
+        'max_limit': 64,
+        'latency_target_ms': 250,
+        'backoff': 0.7,
+        'cooldown_s': 1.0,
+    },
+    # bulk vector inserts from process_3: slow by nature, only back off when they get much slower
+    'manticore_weights_insert': {
+        'initial_limit': 4,
+        'max_limit': 16,
+        'latency_target_ms': 10000,
+    },
+}
+
+MANTICORE_POOL_SETTINGS = {
+    'max_size': 16,
+    'max_lifetime_s': 300,
+    'health_check_idle_s': 30,
+    'wait_timeout_s': 10,
+}
+
+# py_index.vector_bulk_writer: process_3 vector uploads to the weights server
+VECTOR_UPLOAD_SETTINGS = {
+    # one INSERT statement is sent once it reaches this size
+    'batch_bytes': 4 * 1024 * 1024,
+    # 6 significant digits are well past what a float32 embedding carries
+    'float_format': '%.6g',
+}
+
+# process_3_encode_sentence: threads per stage of the read -> encode -> upload pipeline
+EMBEDDING_PIPELINE_SETTINGS = {
+    # ClickHouse readers, one table each at a time
+    'readers': 4,
+    # encoder processes, each with its own model; None for one per core
+    'encoders': None,
+    'uploaders': 4,
+    # blocks waiting between two stages before the upstream stage blocks
+    'queue_batches': 8,
+    # ids per checkpointed range; a rerun skips ranges already checkpointed
+    'checkpoint_id_range': 100000,
+}
+
+# py_index.clickhouse_vectors: ClickHouse mirror of the Manticore vector table, also the KNN fallback
+CLICKHOUSE_VECTOR_SETTINGS = {
+    'enabled': True,
+    'table': 'text_vectors',
+    'dims': 64,
+    # distance function of the similarity index; KNN results always report squared L2, like Manticore's 'l2'
+    'distance': 'L2Distance',
+    # experimental HNSW skip index; without it KNN queries are exact full scans
+    'similarity_index': False,
+}
+
+# quantized copies of text_vector_64_floats, written by process_3 next to it when enabled;
+# `uv run vector_index_report.py` compares their memory, build time, latency and recall with the float table
+VECTOR_INDEX_VARIANTS = {
+    'text_vector_64_q8': {'quantization': '8bit', 'enabled': False},
+    'text_vector_64_q1': {'quantization': '1bit', 'enabled': False},
+}
+
+# py_index.embedding_models: models are loaded on first use, once per process
+EMBEDDING_MODEL_SETTINGS = {
+    'name': 'minishlab/potion-base-2M',
+    # local copy of the model with memory-mapped weights, shared by all processes; None to load from the hub cache
+    'cache_dir': 'models',
+}
+
+# py_index.query_embeddings: search query vectors for the demo, micro-batched and cached per process
+QUERY_EMBEDDING_SETTINGS = {
+    # None for EMBEDDING_MODEL_SETTINGS['name']
+    'model_name': None,
+    # how long the first query of a batch waits for others to join it
+    'batch_window_ms': 5,
+    'max_batch': 64,
+    'cache_entries': 4096,
+}
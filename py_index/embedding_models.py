@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+from py_index.database_settings import EMBEDDING_MODEL_SETTINGS
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def embedding_model(name=None):
+    """The process-wide model for `name` (default EMBEDDING_MODEL_SETTINGS['name']), loaded on first use.
+
+    Importing this module costs nothing; the first caller in a process pays the load, later callers and threads
+    get the same instance.
+    """
+    name = name or EMBEDDING_MODEL_SETTINGS['name']
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = _load_model(name)
+    return model
+
+
+def loaded_embedding_models():
+    return list(_models)
+
+
+def _load_model(name):
+    from model2vec import StaticModel
+    t0 = time.time()
+    local_dir = _local_model_dir(name)
+    if local_dir is None:
+        model = StaticModel.from_pretrained(name)
+    elif os.path.exists(os.path.join(local_dir, 'embeddings.npy')):
+        model = _load_memory_mapped(name, local_dir)
+    else:
+        model = StaticModel.from_pretrained(name)
+        _save_local(model, local_dir)
+    print(f"Loaded embedding model {name} in {(time.time() - t0) * 1000:.0f} ms (pid {os.getpid()})")
+    return model
+
+
+def _local_model_dir(name):
+    cache_dir = EMBEDDING_MODEL_SETTINGS['cache_dir']
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, name.replace('/', '__'))
+
+
+def _save_local(model, local_dir):
+    """Keep a copy with the embedding matrix as a plain .npy, which later loads memory-mapped.
+
+    The copy is written to a directory of this process and renamed into place whole, so processes saving at the
+    same time never write over each other's files and a reader sees either no copy or a complete one.
+    """
+    import shutil
+    import numpy as np
+    tmp_dir = f"{local_dir}.tmp{os.getpid()}"
+    try:
+        model.save_pretrained(tmp_dir)
+        np.save(os.path.join(tmp_dir, 'embeddings.npy'), np.asarray(model.embedding))
+        if os.path.isdir(local_dir) and not os.path.exists(os.path.join(local_dir, 'embeddings.npy')):
+            # an incomplete copy left by an interrupted save
+            shutil.rmtree(local_dir, ignore_errors=True)
+        os.replace(tmp_dir, local_dir)
+    except Exception as e:
+        # os.replace fails when another process renamed its copy first, which is as good as ours
+        if not os.path.exists(os.path.join(local_dir, 'embeddings.npy')):
+            print(f"Error saving embedding model to {local_dir}: {str(e)}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _load_memory_mapped(name, local_dir):
+    """The weights stay in the page cache, shared by every process that maps them, instead of a copy each"""
+    import numpy as np
+    from model2vec import StaticModel
+    from tokenizers import Tokenizer
+    vectors = np.load(os.path.join(local_dir, 'embeddings.npy'), mmap_mode='r')
+    tokenizer = Tokenizer.from_file(os.path.join(local_dir, 'tokenizer.json'))
+    with open(os.path.join(local_dir, 'config.json')) as f:
+        config = json.load(f)
+    return StaticModel(vectors=vectors, tokenizer=tokenizer, config=config, normalize=config.get('normalize'), base_model_name=name)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+import contextlib
+from collections import deque
+
+
+class ManticoreConnectionPool:
+    """Bounded, thread-safe pool of pymysql connections to one Manticore server.
+
+    Connections idle for longer than `health_check_idle_s` are pinged before being handed out,
+    connections older than `max_lifetime_s` are closed and replaced, and connections that saw an
+    error are dropped instead of being put back.
+    """
+
+    def __init__(self, name, connect_kwargs, max_size=16, max_lifetime_s=300, health_check_idle_s=30, wait_timeout_s=10):
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.max_lifetime_s = max_lifetime_s
+        self.health_check_idle_s = health_check_idle_s
+        self.wait_timeout_s = wait_timeout_s
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # [connection, created_at, last_used_at]; the most recently used connection goes out first
+        self._idle = deque()
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'discarded_after_error': 0,
+            'wait_time_total_s': 0.0,
+            'wait_time_max_s': 0.0,
+            'wait_timeouts': 0,
+        }
+
+    @contextlib.contextmanager
+    def connection(self):
+        t0 = time.time()
+        if not self._slots.acquire(timeout=self.wait_timeout_s):
+            with self._lock:
+                self._stats['wait_timeouts'] += 1
+            raise TimeoutError(f"No free connection in the {self.name} pool after {self.wait_timeout_s}s ({self.max_size} in use)")
+        wait_s = time.time() - t0
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['wait_time_total_s'] += wait_s
+            self._stats['wait_time_max_s'] = max(self._stats['wait_time_max_s'], wait_s)
+
+        entry = None
+        healthy = False
+        try:
+            entry = self._checkout()
+            yield entry[0]
+            healthy = True
+        finally:
+            if entry is not None:
+                self._checkin(entry, healthy)
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                return self._connect()
+
+            connection, created_at, last_used_at = entry
+            now = time.time()
+            if now - created_at > self.max_lifetime_s:
+                with self._lock:
+                    self._stats['recycled'] += 1
+                self._close(connection)
+                continue
+            if now - last_used_at > self.health_check_idle_s:
+                try:
+                    connection.ping(reconnect=False)
+                except Exception as e:
+                    print(f"Manticore {self.name} pool: dropping dead connection: {str(e)}")
+                    with self._lock:
+                        self._stats['health_check_failures'] += 1
+                    self._close(connection)
+                    continue
+            return entry
+
+    def _checkin(self, entry, healthy):
+        if not healthy:
+            # it may still hold unread result sets or be half-closed, don't hand it out again
+            with self._lock:
+                self._stats['discarded_after_error'] += 1
+            self._close(entry[0])
+            return
+        entry[2] = time.time()
+        with self._lock:
+            self._idle.append(entry)
+
+    def _connect(self):
+        import pymysql
+        from pymysql.constants import CLIENT
+        # multi-statements let manticore_multi_query() send a batch of queries in one round trip
+        connection = pymysql.connect(client_flag=CLIENT.MULTI_STATEMENTS, **self.connect_kwargs)
+        with self._lock:
+            self._stats['created'] += 1
+        now = time.time()
+        return [connection, now, now]
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection, _, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['max_size'] = self.max_size
+        stats['wait_time_avg_ms'] = 1000 * stats['wait_time_total_s'] / stats['acquired'] if stats['acquired'] else 0.0
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(name, connect_kwargs, **pool_kwargs):
+    """The process-wide pool for `name`; a forked child gets its own pool instead of the parent's sockets"""
+    key = (name, os.getpid())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ManticoreConnectionPool(name, connect_kwargs, **pool_kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def connection_pool_stats():
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [pool for (name, pool_pid), pool in _pools.items() if pool_pid == pid]
+    return {pool.name: pool.stats() for pool in pools}
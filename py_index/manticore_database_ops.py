@@ -1,44 +1,413 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import time
-from clickhouse_connect import get_client
-from py_index.database_settings import CLICKHOUSE_SETTINGS
+import datetime
+from collections import namedtuple
+from py_index.clickhouse_client import clickhouse_client
+from py_index.database_settings import CLICKHOUSE_SETTINGS, MANTICORE_INDEX_SETTINGS, MANTICORE_SERVERS, MANTICORE_POOL_SETTINGS, TELEMETRY_SETTINGS, VECTOR_INDEX_VARIANTS
+from py_index.manticore_connection_pool import get_connection_pool, connection_pool_stats
+from py_index.query_telemetry import record_query, should_sample
+from py_index.search_requests import keyword_count
+
+
+MANTICORE_ATTRIBUTE_TYPES = [
+    'LowCardinality(String)',
+    'Int64', 'Nullable(Int64)',
+    'Float64', 'Nullable(Float64)',
+    'DateTime', 'Nullable(DateTime)', 'Date', 'Nullable(Date)',
+]
+MANTICORE_TEXT_TYPES = [
+    'String', 'Nullable(String)', 'LowCardinality(String)', 'LowCardinality(Nullable(String))',
+]
+
+# rows fetched per round trip by the streaming cursor
+STREAM_BATCH_ROWS = 10000
+
+# searchd's default max_batch_queries; larger batches are split into several round trips
+MULTI_QUERY_MAX_STATEMENTS = 32
 
 
 
 def index_table_into_manticore(table_name):
+    """Build a new version of the table next to the live one, warm it, then swap the alias over to it"""
+    version = next_table_version(table_name)
+    set_table_version_status(table_name, version, 'building')
+    try:
+        search_configs, folders = generate_configs()
+        write_manticore_config(search_configs, folders)
+        rotate_manticore_tables(manticore_local_tables(table_name, version))
+        if not wait_until_manticore_table_is_ready(table_name, version):
+            set_table_version_status(table_name, version, 'failed')
+            print(f"Table {table_name} version {version} did not come up, keeping the live version")
+            return
+        swap_table_alias(table_name, version)
+        # connect_clickhouse_table_to_manticore_idx(table_name)
+        with clickhouse_client() as client:
+            client.command(f"INSERT INTO input_indexing_done (table_name, event_time) VALUES ('{table_name}', NOW())")
+    except Exception as e:
+        print(f"Error indexing table {table_name} version {version}: {str(e)}")
+        # a version that made it to live stays live; anything short of that is failed, so gc collects it
+        if live_table_version(table_name) != version:
+            set_table_version_status(table_name, version, 'failed')
+        return
+    gc_table_versions()
+
+
+def swap_table_alias(table_name, version):
+    """Point the distributed `table_name` at `version` and retire the version it pointed at before"""
+    previous_version = live_table_version(table_name)
+    set_table_version_status(table_name, version, 'live')
+    if previous_version is not None and previous_version != version:
+        set_table_version_status(table_name, previous_version, 'retired')
+    search_configs, folders = generate_configs()
+    write_manticore_config(search_configs, folders)
+    # no tables to index: just reload the config, which swaps the distributed table in one go
+    rotate_manticore_tables([])
+    print(f"Table {table_name} now serves version {version} (was {previous_version})")
+
+
+def gc_table_versions(grace_period_s=None):
+    """Drop the versions retired more than the grace period ago, from the config and from disk"""
+    if grace_period_s is None:
+        grace_period_s = MANTICORE_INDEX_SETTINGS['retired_version_grace_period_s']
+    with clickhouse_client() as client:
+        init_table_versions(client)
+        expired = client.query_df(f"""
+            SELECT table_name, version FROM (
+                SELECT table_name, version, argMax(status, (event_time, seq)) AS status, max(event_time) AS status_time
+                FROM manticore_table_versions
+                GROUP BY table_name, version
+            )
+            WHERE status IN ('retired', 'failed') AND status_time < NOW() - INTERVAL {int(grace_period_s)} SECOND
+        """)
+    if expired.empty:
+        return
+    for table_name, version in zip(expired['table_name'], expired['version']):
+        set_table_version_status(table_name, version, 'deleted')
     search_configs, folders = generate_configs()
+    write_manticore_config(search_configs, folders)
+    rotate_manticore_tables([])
+
+    import subprocess
+    version_folders = [manticore_version_folder(t, v) for t, v in zip(expired['table_name'], expired['version'])]
+    print(f"Deleting retired table versions: {version_folders}")
+    subprocess.check_call(['docker', 'exec', 'manticore', 'bash', '-c', f'rm -rf {" ".join(version_folders)}'])
+
+
+def index_table_delta_into_manticore(table_name):
+    """Re-index only the delta table of the live version: the rows above the main's high-water mark plus the updated ids"""
+    version = live_table_version(table_name)
+    rotate_manticore_tables([manticore_delta_table(table_name, version)])
+    wait_until_manticore_table_is_ready(table_name, version)
+
+
+def merge_table_delta_into_main(table_name):
+    """Merge the delta into the main table, move the high-water mark up and rebuild an empty delta"""
+    version = live_table_version(table_name)
+    main_table = manticore_main_table(table_name, version)
+    delta_table = manticore_delta_table(table_name, version)
+    print(f"Merging {delta_table} into {main_table}")
+    import subprocess
+    subprocess.check_call(['docker', 'exec', 'manticore', 'indexer', '--merge', main_table, delta_table, '--rotate'])
+    with clickhouse_client() as client:
+        # the delta recorded the highest id it indexed; it is now part of the main table.
+        # Keep the delta's own timestamp: ids updated after that delta was built are not in the merged main
+        # table yet, and updated_ids_sql only picks up the ones recorded since the main high-water mark.
+        client.command(f"""
+            INSERT INTO manticore_index_hwm (table_name, kind, max_id, event_time)
+            SELECT table_name, 'main', argMax(max_id, event_time), max(event_time)
+            FROM manticore_index_hwm
+            WHERE table_name = '{manticore_version_name(table_name, version)}' AND kind = 'delta'
+            GROUP BY table_name
+        """)
+    index_table_delta_into_manticore(table_name)
+
+
+def mark_rows_updated(table_name, ids):
+    """Record updated row ids, so the next delta re-indexes them and kills the old copies in the main table"""
+    with clickhouse_client() as client:
+        now = datetime.datetime.now()
+        client.insert(
+            'manticore_index_updated_ids',
+            [[table_name, int(i), now] for i in ids],
+            column_names=['table_name', 'id', 'event_time']
+        )
+
+
+def index_unified_table_into_manticore(force=False):
+    """Rebuild the unified cross-table index from all the indexed tables, when a table was indexed since its last build"""
+    if not MANTICORE_INDEX_SETTINGS['unified_index']:
+        print("Unified index is disabled")
+        return
+    if not force and not unified_index_is_stale():
+        print("Unified index is up to date")
+        return
+    search_configs, folders = generate_configs()
+    write_manticore_config(search_configs, folders)
+    rotate_manticore_tables([MANTICORE_INDEX_SETTINGS['unified_index_name']])
+    wait_until_manticore_table_is_ready(MANTICORE_INDEX_SETTINGS['unified_index_name'])
+
+
+def unified_index_is_stale():
+    """Never built, or some table finished indexing after the unified index last did"""
+    unified_name = MANTICORE_INDEX_SETTINGS['unified_index_name']
+    with clickhouse_client() as client:
+        result = client.query(f"""
+            SELECT
+                maxIf(event_time, table_name = '{unified_name}'),
+                maxIf(event_time, table_name != '{unified_name}'),
+                countIf(table_name = '{unified_name}')
+            FROM index_status_event
+            WHERE status = 'done'
+        """)
+    unified_done, tables_done, unified_builds = result.result_rows[0]
+    return unified_builds == 0 or tables_done > unified_done
 
+
+def write_manticore_config(search_configs, folders):
     print(f"Writing manticore.conf - {len(search_configs)} bytes")
     with open('docker/manticore.conf', 'w') as f:
         f.write(search_configs)
 
+    import subprocess
+    subprocess.check_call(['docker', 'exec', 'manticore', 'bash', '-c', f'mkdir -p {" ".join(folders)}'])
+
+
+def rotate_manticore_tables(table_names):
     print("Updating manticore configs")
     import subprocess
     envs = os.environ.copy()
     envs['MSYS_NO_PATHCONV'] = '1'
-    subprocess.check_call(['docker', 'exec', 'manticore', 'bash', '-c', f'mkdir -p {" ".join(folders)}'])
-    subprocess.check_call(['docker', 'exec', 'manticore', 'bash', '/manticore-update-config.sh', table_name], env=envs)
-    try:
-        wait_until_manticore_table_is_ready(table_name)
-        # connect_clickhouse_table_to_manticore_idx(table_name)
-        with get_client(**CLICKHOUSE_SETTINGS) as client:
-            client.command(f"INSERT INTO input_indexing_done (table_name, event_time) VALUES ('{table_name}', NOW())")
-    except Exception as e:
-        print(f"Error connecting table {table_name} to manticore: {str(e)}")
-        return
+    subprocess.check_call(['docker', 'exec', 'manticore', 'bash', '/manticore-update-config.sh', *table_names], env=envs)
+
+
+def init_table_versions(client):
+    client.command("""
+        CREATE TABLE IF NOT EXISTS manticore_table_versions (
+            table_name String,
+            version UInt64,
+            status LowCardinality(String),
+            event_time DateTime,
+            seq UInt64
+        ) ENGINE = MergeTree() ORDER BY (table_name, version, event_time)
+    """)
+    # event_time has one-second resolution: 'building' and 'failed' of a quick failure tie, seq orders them
+    client.command("ALTER TABLE manticore_table_versions ADD COLUMN IF NOT EXISTS seq UInt64")
+
+
+def set_table_version_status(table_name, version, status):
+    with clickhouse_client() as client:
+        init_table_versions(client)
+        client.insert(
+            'manticore_table_versions',
+            [[table_name, int(version), status, datetime.datetime.now(), time.time_ns()]],
+            column_names=['table_name', 'version', 'status', 'event_time', 'seq']
+        )
+    global _live_versions_cache
+    _live_versions_cache = {}
+
+
+def next_table_version(table_name):
+    with clickhouse_client() as client:
+        init_table_versions(client)
+        result = client.query(f"SELECT max(version) FROM manticore_table_versions WHERE table_name = '{table_name}'")
+        return int(result.result_rows[0][0] or 0) + 1
+
+
+def table_version_events(client, table_name):
+    """[(version, status, event_time, seq), ...] of the table, every status change of every version"""
+    return client.query(f"""
+        SELECT version, status, event_time, seq
+        FROM manticore_table_versions
+        WHERE table_name = '{table_name}'
+    """).result_rows
+
+
+def latest_version_statuses(events):
+    """{version: status} from version events, the latest event of each version winning"""
+    statuses = {}
+    for version, status, event_time, seq in sorted(events, key=lambda e: (e[2], e[3])):
+        statuses[int(version)] = status
+    return statuses
+
+
+def config_table_versions(events, indexed):
+    """(versions still in the config as {version: status}, live versions, legacy) for a table.
+
+    `legacy`: indexed before versioning and no version of it has gone live yet. Its old plain table stays in the
+    config while the first version builds, and after that build fails.
+    """
+    statuses = latest_version_statuses(events)
+    versions = {version: status for version, status in sorted(statuses.items()) if status in ('building', 'live', 'retired')}
+    live_versions = [version for version, status in versions.items() if status == 'live']
+    ever_live = any(status == 'live' for _, status, _, _ in events)
+    return versions, live_versions, indexed and not ever_live
+
+
+def table_versions(client, table_name):
+    """{version: status} for the versions that still have tables in the config"""
+    return config_table_versions(table_version_events(client, table_name), False)[0]
+
+
+# the live versions are read on every DESC / CALL AUTOCOMPLETE, so keep them for a few seconds;
+# the dict is never mutated, a reload rebinds the global so concurrent readers see either the old or the new one
+LIVE_VERSIONS_CACHE_TTL_S = 5
+_live_versions_cache = {}
+
+
+def live_table_version(table_name):
+    global _live_versions_cache
+    now = time.time()
+    cache = _live_versions_cache
+    if not cache or now - cache['loaded_at'] > LIVE_VERSIONS_CACHE_TTL_S:
+        with clickhouse_client() as client:
+            init_table_versions(client)
+            df = client.query_df("""
+                SELECT table_name, argMax(version, event_time) AS version
+                FROM (
+                    SELECT table_name, version, argMax(status, (event_time, seq)) AS status, max(event_time) AS event_time
+                    FROM manticore_table_versions
+                    GROUP BY table_name, version
+                )
+                WHERE status = 'live'
+                GROUP BY table_name
+            """)
+        cache = {'versions': dict(zip(df['table_name'], df['version'])) if not df.empty else {}, 'loaded_at': now}
+        _live_versions_cache = cache
+    version = cache['versions'].get(table_name)
+    return int(version) if version is not None else None
+
+
+_table_generations_cache = {}
+
+
+def table_generation(table_name):
+    """Changes whenever the table's indexes change: the live version plus its last indexing event.
+
+    Used to key caches of query results and metadata, so a rotate or an alias swap invalidates them. The vector
+    table `text_vector_64_floats` moves with `input_table_vectors_computed`.
+    """
+    return (live_table_version(table_name), table_generations().get(table_name))
+
+
+def all_tables_generation():
+    """Changes whenever any table is (re)indexed, including a new table being added"""
+    generations = table_generations()
+    return (len(generations), max(generations.values(), default=None))
+
+
+def table_generations():
+    """{table_name: time of its last indexing event}, reloaded at most every LIVE_VERSIONS_CACHE_TTL_S"""
+    global _table_generations_cache
+    now = time.time()
+    cache = _table_generations_cache
+    if not cache or now - cache['loaded_at'] > LIVE_VERSIONS_CACHE_TTL_S:
+        generations = {}
+        try:
+            with clickhouse_client() as client:
+                df = client.query_df("""
+                    SELECT table_name, max(event_time) AS event_time
+                    FROM (
+                        SELECT table_name, event_time FROM index_status_event
+                        UNION ALL SELECT table_name, event_time FROM input_indexing_done
+                        UNION ALL SELECT 'text_vector_64_floats' AS table_name, event_time FROM input_table_vectors_computed
+                    )
+                    GROUP BY table_name
+                """)
+            generations = dict(zip(df['table_name'], df['event_time'].astype(str))) if not df.empty else {}
+        except Exception as e:
+            print(f"Error loading table generations: {str(e)}")
+        # rebound, not mutated, like _live_versions_cache
+        cache = {'generations': generations, 'loaded_at': now}
+        _table_generations_cache = cache
+    return cache['generations']
+
+
+def manticore_version_name(table_name, version=None):
+    if version is None:
+        version = live_table_version(table_name)
+        if version is None:
+            raise LookupError(f"Table {table_name} has no live version in manticore_table_versions, index it with index_table_into_manticore() first")
+    return f"{table_name}_v{version}"
+
+
+def manticore_version_folder(table_name, version):
+    return f"/var/lib/manticore/v1/{table_name}/v{version}"
+
+
+def manticore_main_table(table_name, version=None):
+    return f"{manticore_version_name(table_name, version)}_main"
+
+
+def manticore_delta_table(table_name, version=None):
+    return f"{manticore_version_name(table_name, version)}_delta"
+
+
+def manticore_local_table(table_name):
+    """The local table behind the distributed `table_name`.
+
+    `DESC` needs a local table, the main and delta tables share their schema so it goes to the main table of the
+    live version; plain searches keep using the distributed name. `CALL AUTOCOMPLETE` and `CALL SUGGEST` only
+    see one dictionary, use manticore_dictionary_tables() so the rows still in the delta are not missed.
+    Tables indexed before versioning are still a plain table under their own name until their first rebuild.
+    """
+    if table_name == MANTICORE_INDEX_SETTINGS['unified_index_name']:
+        return table_name
+    if live_table_version(table_name) is None:
+        return table_name
+    return manticore_main_table(table_name)
+
+
+def manticore_local_tables(table_name, version=None):
+    if version is None and live_table_version(table_name) is None:
+        return [table_name]
+    return [manticore_main_table(table_name, version), manticore_delta_table(table_name, version)]
+
+
+def manticore_dictionary_tables(table_name):
+    """The local tables whose dictionaries `CALL AUTOCOMPLETE` and `CALL SUGGEST` must query for `table_name`"""
+    if table_name == MANTICORE_INDEX_SETTINGS['unified_index_name']:
+        return [table_name]
+    return manticore_local_tables(table_name)
+
+
+def manticore_suggest(client, query, table_name, limit=5):
+    """`CALL SUGGEST` over the main and delta dictionaries of `table_name`, merged like one dictionary"""
+    import pandas as pd
+    suggestions = []
+    for local_table in manticore_dictionary_tables(table_name):
+        df = manticore_query(client, f"CALL SUGGEST(%s, '{local_table}', {int(limit)} as limit)", (query,))
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            suggestions.append(df)
+    if not suggestions:
+        return pd.DataFrame()
+    df = pd.concat(suggestions, ignore_index=True)
+    df['docs'] = df['docs'].astype(int)
+    df = df.groupby('suggest', as_index=False).agg({'distance': 'min', 'docs': 'sum'})
+    return df.sort_values(['distance', 'docs'], ascending=[True, False]).head(limit)
+
 
 def generate_configs():
     config_sections = []
     folders = []
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
+        init_delta_tables(client)
+        init_table_versions(client)
+        init_table_index_settings(client)
         tables = client.query_df('select table_name from input_tables_recreated')['table_name'].tolist()
         for table in tables:
             print(f"Generating config for table {table}")
-            container_folder, config = table_config_section(client, table)
+            table_folders, config = table_config_section(client, table)
             config_sections.append(config)
-            folders.append(container_folder)
+            folders.extend(table_folders)
+        if MANTICORE_INDEX_SETTINGS['unified_index']:
+            print("Generating config for the unified index")
+            container_folder, config = unified_config_section(client, tables)
+            if config:
+                config_sections.append(config)
+                folders.append(container_folder)
     top_section = """
         searchd {
             listen = 0.0.0.0:9312
@@ -55,7 +424,34 @@ def generate_configs():
     return config_text, folders
 
 
+def init_delta_tables(client):
+    client.command("""
+        CREATE TABLE IF NOT EXISTS manticore_index_hwm (
+            table_name String,
+            kind LowCardinality(String),
+            max_id Int64,
+            event_time DateTime
+        ) ENGINE = MergeTree() ORDER BY (table_name, kind, event_time)
+    """)
+    client.command("""
+        CREATE TABLE IF NOT EXISTS manticore_index_updated_ids (
+            table_name String,
+            id Int64,
+            event_time DateTime
+        ) ENGINE = MergeTree() ORDER BY (table_name, event_time, id)
+    """)
+
+
 def table_config_section(client, table_name):
+    """Main + delta tables for every version of the table still around, and the distributed alias on the live one.
+
+    A table indexed before versioning keeps its old unversioned plain table until a version of it goes live, so
+    writing the config and reloading does not drop it from the server, neither during nor after a failed first build.
+    """
+    versions, live_versions, legacy = config_table_versions(table_version_events(client, table_name), table_was_indexed(client, table_name))
+    if not versions and not legacy:
+        return [], ""
+
     columns = client.query_df(f"select name, type from system.columns where table = '{table_name}'")
     column_select_sql = []
     extra_attribute_lines = []
@@ -76,15 +472,48 @@ def table_config_section(client, table_name):
         else:
             column_select_sql.append(f"{column['name']}")
     column_list_str = ", ".join(column_select_sql)
-    sql_query = f"SELECT {column_list_str} FROM {table_name}"
     extra_attribute_lines = "\n".join(extra_attribute_lines)
 
-    container_folder = f"/var/lib/manticore/v1/{table_name}"
-    table_config = f"""
+    folders = []
+    sections = []
+    if legacy:
+        folders.append(manticore_legacy_folder(table_name))
+        sections.append(legacy_table_config_section(table_name, column_list_str, extra_attribute_lines))
+    for version in versions:
+        index_settings_lines = version_index_settings(client, table_name, version, columns.to_dict(orient='records'))
+        folders.append(manticore_version_folder(table_name, version))
+        sections.append(table_version_config_section(table_name, version, column_list_str, extra_attribute_lines, index_settings_lines))
+
+    if live_versions:
+        main_table = manticore_main_table(table_name, live_versions[-1])
+        delta_table = manticore_delta_table(table_name, live_versions[-1])
+        sections.append(f"""
+    table {table_name} {{
+        type = distributed
+        local = {main_table}
+        local = {delta_table}
+    }}
+    """)
+    return (folders, "\n".join(sections))
+
+
+def table_was_indexed(client, table_name):
+    """In input_indexing_done: indexed before versioning, or through a version that went live"""
+    result = client.query(f"SELECT count() FROM input_indexing_done WHERE table_name = '{table_name}'")
+    return result.result_rows[0][0] > 0
+
+
+def manticore_legacy_folder(table_name):
+    return f"/var/lib/manticore/v1/{table_name}"
+
+
+def legacy_table_config_section(table_name, column_list_str, extra_attribute_lines):
+    """The section tables had before versioning, unchanged, so the server keeps loading their existing files"""
+    return f"""
 
     table {table_name} {{
         type = plain
-        path = {container_folder}/data
+        path = {manticore_legacy_folder(table_name)}/data
         source = {table_name}
         columnar_attrs = *
         min_infix_len = 3
@@ -105,16 +534,224 @@ def table_config_section(client, table_name):
         sql_query_post = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'query_ended');
         sql_query_post_index = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'done');
 
-        sql_query = {sql_query}
+        sql_query = SELECT {column_list_str} FROM {table_name}
 
         {extra_attribute_lines}
     }}
     """
+
+
+def table_version_config_section(table_name, version, column_list_str, extra_attribute_lines, index_settings_lines):
+    # the high-water marks are kept per version, so building a new version leaves the live one alone
+    version_name = manticore_version_name(table_name, version)
+
+    # main: everything up to the high-water mark recorded when it was built (or last merged)
+    # delta: everything above it, plus the rows updated since then
+    main_hwm_sql = f"(SELECT argMax(max_id, event_time) FROM manticore_index_hwm WHERE table_name = '{version_name}' AND kind = 'main')"
+    delta_hwm_sql = f"(SELECT argMax(max_id, event_time) FROM manticore_index_hwm WHERE table_name = '{version_name}' AND kind = 'delta')"
+    updated_ids_sql = f"""SELECT id FROM manticore_index_updated_ids WHERE table_name = '{table_name}' AND event_time >= (SELECT max(event_time) FROM manticore_index_hwm WHERE table_name = '{version_name}' AND kind = 'main')"""
+    main_sql_query = f"SELECT {column_list_str} FROM {table_name} WHERE id <= {main_hwm_sql}"
+    delta_sql_query = f"SELECT {column_list_str} FROM {table_name} WHERE (id > {main_hwm_sql} AND id <= {delta_hwm_sql}) OR id IN ({updated_ids_sql})"
+
+    main_table = manticore_main_table(table_name, version)
+    delta_table = manticore_delta_table(table_name, version)
+    container_folder = manticore_version_folder(table_name, version)
+    return f"""
+
+    table {main_table} {{
+        type = plain
+        path = {container_folder}/main
+        source = {main_table}
+        {index_settings_lines}
+
+    }}
+    table {delta_table} {{
+        type = plain
+        path = {container_folder}/delta
+        source = {delta_table}
+        killlist_target = {main_table}
+        {index_settings_lines}
+
+    }}
+    source {main_table} {{
+        type =  mysql
+
+        sql_host = clickhouse
+        sql_port = 9004
+        sql_user = {CLICKHOUSE_SETTINGS['user']}
+        sql_pass = {CLICKHOUSE_SETTINGS['password']}
+        sql_db = {CLICKHOUSE_SETTINGS['database']}
+
+        sql_query_pre    = SET CHARACTER_SET_RESULTS=utf8
+        sql_query_pre    = SET NAMES utf8
+        sql_query_pre    = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'started');
+        sql_query_pre    = INSERT INTO manticore_index_hwm (table_name, kind, max_id, event_time) SELECT '{version_name}', 'main', max(id), NOW() FROM {table_name};
+        sql_query_post = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'query_ended');
+        sql_query_post_index = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'done');
+
+        sql_query = {main_sql_query}
+
+        {extra_attribute_lines}
+    }}
+    source {delta_table} : {main_table} {{
+        sql_query_pre    = SET CHARACTER_SET_RESULTS=utf8
+        sql_query_pre    = SET NAMES utf8
+        sql_query_pre    = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'delta_started');
+        sql_query_pre    = INSERT INTO manticore_index_hwm (table_name, kind, max_id, event_time) SELECT '{version_name}', 'delta', max(id), NOW() FROM {table_name};
+        sql_query_post = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'delta_query_ended');
+        sql_query_post_index = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'delta_done');
+
+        sql_query = {delta_sql_query}
+        sql_query_killlist = {updated_ids_sql}
+    }}
+    """
+
+
+def unified_config_section(client, tables):
+    """One plain index holding the text of every table, with the source `table_name` and `table_rowid` as attributes"""
+    table_name = MANTICORE_INDEX_SETTINGS['unified_index_name']
+    text_types = ", ".join(f"'{t}'" for t in MANTICORE_TEXT_TYPES)
+    columns = client.query_df(f"""
+        SELECT table, name FROM system.columns
+        WHERE database = '{CLICKHOUSE_SETTINGS['database']}' AND type IN ({text_types})
+        ORDER BY table, position
+    """)
+    selects = []
+    for table in tables:
+        text_columns = columns[columns['table'] == table]['name'].tolist()
+        if not text_columns:
+            continue
+        content_sql = ", ".join(f"ifNull(`{c}`, '')" for c in text_columns)
+        selects.append(f"""SELECT toInt64(bitAnd(sipHash64('{table}', id), 9223372036854775807)) AS id, '{table}' AS table_name, id AS table_rowid, concatWithSeparator(' ', {content_sql}) AS content FROM {table}""")
+    if not selects:
+        return None, None
+    sql_query = " UNION ALL ".join(selects)
+
+    container_folder = f"/var/lib/manticore/v1/{table_name}"
+    table_config = f"""
+
+    table {table_name} {{
+        type = plain
+        path = {container_folder}/data
+        source = {table_name}
+        # infixes, not only prefixes: CALL SUGGEST and CALL AUTOCOMPLETE go to this index when it is enabled
+        min_infix_len = {MANTICORE_INDEX_SETTINGS['min_infix_len']}
+        columnar_attrs = table_rowid
+
+    }}
+    source {table_name} {{
+        type =  mysql
+
+        sql_host = clickhouse
+        sql_port = 9004
+        sql_user = {CLICKHOUSE_SETTINGS['user']}
+        sql_pass = {CLICKHOUSE_SETTINGS['password']}
+        sql_db = {CLICKHOUSE_SETTINGS['database']}
+
+        sql_query_pre    = SET CHARACTER_SET_RESULTS=utf8
+        sql_query_pre    = SET NAMES utf8
+        sql_query_pre    = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'started');
+        sql_query_post_index = INSERT INTO index_status_event (table_name, event_time, status) VALUES ('{table_name}', NOW(), 'done');
+
+        sql_query = {sql_query}
+
+        sql_attr_string = table_name
+        sql_attr_bigint = table_rowid
+    }}
+    """
     return (container_folder, table_config)
 
 
+def init_table_index_settings(client):
+    client.command("""
+        CREATE TABLE IF NOT EXISTS manticore_table_index_settings (
+            table_name String,
+            version UInt64,
+            settings String,
+            event_time DateTime
+        ) ENGINE = ReplacingMergeTree(event_time) ORDER BY (table_name, version)
+    """)
+
+
+def version_index_settings(client, table_name, version, columns):
+    """The settings lines a version is built with: profiled once, when its config is first generated, then reused.
+
+    Profiling a fresh sample on every config generation would cost a scan per table each time, and could hand a
+    version already on disk settings it was not built with.
+    """
+    rows = client.query(f"""
+        SELECT argMax(settings, event_time) FROM manticore_table_index_settings
+        WHERE table_name = '{table_name}' AND version = {int(version)}
+        GROUP BY table_name
+    """).result_rows
+    if rows:
+        return rows[0][0]
+    settings = table_index_settings(client, table_name, columns)
+    client.insert('manticore_table_index_settings', [[table_name, int(version), settings, datetime.datetime.now()]],
+                  column_names=['table_name', 'version', 'settings', 'event_time'])
+    return settings
+
+
+def table_index_settings(client, table_name, columns):
+    """Infix/prefix and columnar settings for the table section, picked from the profiling stats"""
+    if not MANTICORE_INDEX_SETTINGS['profile_driven']:
+        return "columnar_attrs = *\n        min_infix_len = 3"
+
+    profile = profile_index_fields(client, table_name, columns)
+    print(f"Index profile for {table_name}: {profile}")
+    # always on: CALL SUGGEST and CALL AUTOCOMPLETE need infixes in the dictionary
+    lines = [f"min_infix_len = {MANTICORE_INDEX_SETTINGS['min_infix_len']}"]
+    if profile['infix_fields'] and profile['prefix_fields']:
+        # only split when there is something to split; with no short field every field keeps its infixes
+        lines.append(f"infix_fields = {', '.join(profile['infix_fields'])}")
+        lines.append(f"min_prefix_len = {MANTICORE_INDEX_SETTINGS['min_prefix_len']}")
+        lines.append(f"prefix_fields = {', '.join(profile['prefix_fields'])}")
+    if profile['columnar_attrs']:
+        lines.append(f"columnar_attrs = {', '.join(profile['columnar_attrs'])}")
+    return "\n        ".join(lines)
+
+
+def profile_index_fields(client, table_name, columns):
+    """Split the text fields into infix/prefix fields and the attributes into hot (row-wise) and columnar ones.
+
+    Uses the column stats from `input_tables_raw_columns` and the average text length
+    over a sample of the table.
+    """
+    stats = client.query_df(f"""
+        SELECT c.column_name_fixed AS name, c.column_unique_count AS unique_count
+        FROM input_tables_raw_columns c INNER JOIN input_tables_recreated r
+            ON c.table_name = r.original_table_name
+        WHERE r.table_name = '{table_name}'
+    """)
+    unique_counts = dict(zip(stats['name'], stats['unique_count'])) if not stats.empty else {}
+
+    text_fields = [c['name'] for c in columns if c['name'] != 'id' and c['type'] in MANTICORE_TEXT_TYPES]
+    avg_lengths = {}
+    if text_fields:
+        length_sql = ", ".join(f"ifNotFinite(avg(lengthUTF8(ifNull(`{c}`, ''))), 0)" for c in text_fields)
+        row = client.query(f"SELECT {length_sql} FROM {table_name} SAMPLE {MANTICORE_INDEX_SETTINGS['length_sample_rows']}").result_rows[0]
+        avg_lengths = dict(zip(text_fields, row))
+
+    infix_fields = [c for c in text_fields if avg_lengths.get(c, 0) <= MANTICORE_INDEX_SETTINGS['infix_max_avg_length']]
+    prefix_fields = [c for c in text_fields if c not in infix_fields]
+
+    attributes = [c['name'] for c in columns if c['name'] != 'id' and c['type'] in MANTICORE_ATTRIBUTE_TYPES]
+    hot_attrs = [c for c in attributes
+                 if unique_counts.get(c) is not None
+                 and unique_counts[c] <= MANTICORE_INDEX_SETTINGS['hot_filter_max_unique_count']]
+    columnar_attrs = [c for c in attributes if c not in hot_attrs]
+
+    return {
+        'infix_fields': infix_fields,
+        'prefix_fields': prefix_fields,
+        'hot_attrs': hot_attrs,
+        'columnar_attrs': columnar_attrs,
+        'avg_lengths': avg_lengths,
+    }
+
+
 def connect_clickhouse_table_to_manticore_idx(table):
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client() as client:
         # Get both name and type columns from system.columns
         column_df = client.query_df(f"select name, type from system.columns where table = '{table}'")
         if column_df.empty:
@@ -160,14 +797,8 @@ def convert_clickhouse_type_to_manticore_mysql(clickhouse_type):
 
 
 def manticore_client_data_server():
-    import pymysql
-    return pymysql.connect(
-        host='localhost',
-        port=9306,
-        user='user',
-        password='pass',
-        # database='manticore'
-    )
+    """Pooled connection to the data server, to be used as `with manticore_client_data_server() as client:`"""
+    return get_connection_pool('data', MANTICORE_SERVERS['data'], **MANTICORE_POOL_SETTINGS).connection()
     # this does not work because manticore does not support sqlalchemy
     # (it returns int for get_isolation_leve() where something wanted string)
     # import sqlalchemy
@@ -175,63 +806,242 @@ def manticore_client_data_server():
 
 
 def manticore_client_weights_server():
-    import pymysql
-    return pymysql.connect(
-        host='localhost',
-        port=19306,
-        user='user',
-        password='pass',
-    )
+    """Pooled connection to the weights (vector) server, to be used as `with manticore_client_weights_server() as client:`"""
+    return get_connection_pool('weights', MANTICORE_SERVERS['weights'], **MANTICORE_POOL_SETTINGS).connection()
+
+
+def manticore_pool_stats():
+    """Per-pool counters: connections created/recycled, health check failures, wait times"""
+    return connection_pool_stats()
 
 
 def manticore_query(client, query, args=None):
     import pandas as pd
-    print('manticore query: ', query[:160])
-    with client.cursor() as cursor:
+    result_sets = _manticore_result_sets(client, query, args)
+    if result_sets is None:
+        return None
+    result_sets = [pd.DataFrame(rows, columns=column_names) for column_names, rows in result_sets]
+
+    # Return single DataFrame if only one result set, otherwise return list
+    if len(result_sets) == 1:
+        return result_sets[0]
+    return result_sets
+
+
+def manticore_query_rows(client, query, args=None, named=False):
+    """`manticore_query` without pandas: a list of row tuples, or one such list per result set.
+
+    With `named=True` the rows are namedtuples; columns that are not identifiers (`count(*)`) get positional
+    names (`_1`), so alias them in the query to read them by name.
+    """
+    result_sets = _manticore_result_sets(client, query, args)
+    if result_sets is None:
+        return None
+    if named:
+        result_sets = [(column_names, _named_rows(column_names, rows)) for column_names, rows in result_sets]
+    if len(result_sets) == 1:
+        return result_sets[0][1]
+    return [rows for _, rows in result_sets]
+
+
+def manticore_query_stream(client, query, args=None, named=False, batch_size=STREAM_BATCH_ROWS):
+    """Yield the rows of a single result set as they arrive, through an unbuffered cursor.
+
+    The connection is busy until the generator is exhausted or closed, so consume it inside the `with` block.
+    """
+    import pymysql
+    if TELEMETRY_SETTINGS['echo_queries']:
+        print('manticore stream: ', query[:160])
+    t0 = time.time()
+    row_count = 0
+    with client.cursor(pymysql.cursors.SSCursor) as cursor:
         cursor.execute(query, args)
+        if cursor.description is None:
+            return
+        row_type = _row_type([col[0] for col in cursor.description]) if named else None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            row_count += len(rows)
+            for row in rows:
+                yield row_type._make(row) if named else row
+    # includes the time the consumer spent between batches
+    record_query('manticore', cursor._executed or query, time.time() - t0, row_count, len(cursor._executed or query))
+
 
-        # Get all result sets
-        result_sets = []
+def manticore_query_arrow(client, query, args=None, batch_size=STREAM_BATCH_ROWS):
+    """A single result set as a `pyarrow.Table`, built batch by batch from the streaming cursor"""
+    import pymysql
+    import pyarrow as pa
+    if TELEMETRY_SETTINGS['echo_queries']:
+        print('manticore arrow: ', query[:160])
+    t0 = time.time()
+    with client.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(query, args)
+        if cursor.description is None:
+            return None
+        column_names = [col[0] for col in cursor.description]
+        batches = []
         while True:
-            # For non-SELECT queries (INSERT, UPDATE, etc), description will be None
-            if cursor.description is None:
-                # For non-SELECT queries, just return None
-                return None
-
-            column_names = [col[0] for col in cursor.description]
-            data = cursor.fetchall()
-            df = pd.DataFrame(data, columns=column_names)
-            result_sets.append(df)
-
-            # Try to get next result set
-            try:
-                has_more = cursor.nextset()
-                if not has_more:
-                    break
-            except:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
                 break
+            batches.append(pa.record_batch([pa.array(column) for column in zip(*rows)], names=column_names))
+    record_query('manticore', cursor._executed or query, time.time() - t0, sum(b.num_rows for b in batches), sum(b.nbytes for b in batches))
+    if not batches:
+        return pa.table({name: pa.array([], type=pa.null()) for name in column_names})
+    return pa.Table.from_batches(batches)
 
-        # Return single DataFrame if only one result set, otherwise return list
-        if len(result_sets) == 1:
-            return result_sets[0]
-        return result_sets
+
+def manticore_multi_query(client, queries):
+    """Send several SELECTs as one Manticore multi-query and map the result sets back to their names.
+
+    `queries` is a dict of name -> sql or (sql, args). Every statement returns one result set plus one per
+    FACET clause, so each name gets what `manticore_query` would have returned for it alone.
+    """
+    import pandas as pd
+    statements = []
+    with client.cursor() as cursor:
+        for name, query in queries.items():
+            sql, args = query if isinstance(query, tuple) else (query, None)
+            sql = cursor.mogrify(sql, args).strip().rstrip(';')
+            # a search for the word "facet" is no FACET clause: only count the ones outside string literals
+            statements.append((name, sql, 1 + keyword_count(sql, 'FACET')))
+
+    results = {}
+    for i in range(0, len(statements), MULTI_QUERY_MAX_STATEMENTS):
+        batch = statements[i:i + MULTI_QUERY_MAX_STATEMENTS]
+        result_sets = _manticore_result_sets(client, ';\n'.join(sql for _, sql, _ in batch)) or []
+        expected = sum(count for _, _, count in batch)
+        if len(result_sets) != expected:
+            raise ValueError(f"Manticore multi-query returned {len(result_sets)} result sets, expected {expected}")
+        offset = 0
+        for name, _, count in batch:
+            dfs = [pd.DataFrame(rows, columns=column_names) for column_names, rows in result_sets[offset:offset + count]]
+            results[name] = dfs[0] if count == 1 else dfs
+            offset += count
+    return results
+
+
+def _manticore_result_sets(client, query, args=None):
+    """[(column_names, rows), ...] for every result set of the query, None for statements without results"""
+    if TELEMETRY_SETTINGS['echo_queries']:
+        print('manticore query: ', query[:160])
+    sampled = should_sample()
+    t0 = time.time()
+    result_sets = []
+    meta = None
+    executed = query
+    with client.cursor() as cursor:
+        try:
+            cursor.execute(query, args)
+            executed = cursor._executed or query
+
+            # Get all result sets
+            while True:
+                # For non-SELECT queries (INSERT, UPDATE, etc), description will be None
+                if cursor.description is None:
+                    result_sets = None
+                    break
+
+                column_names = [col[0] for col in cursor.description]
+                result_sets.append((column_names, cursor.fetchall()))
+
+                # Try to get next result set
+                try:
+                    has_more = cursor.nextset()
+                    if not has_more:
+                        break
+                except:
+                    break
+            latency_s = time.time() - t0
+            if sampled and result_sets and TELEMETRY_SETTINGS['show_meta']:
+                try:
+                    cursor.execute("SHOW META")
+                    meta = dict(cursor.fetchall())
+                except Exception as e:
+                    # telemetry only: the query itself succeeded and its results are returned
+                    print(f"Error reading SHOW META: {str(e)}")
+        except Exception as e:
+            record_query('manticore', executed, time.time() - t0, error=e, sampled=sampled)
+            raise
+        rows = sum(len(rows) for _, rows in result_sets) if result_sets else cursor.rowcount
+    record_query('manticore', executed, latency_s, rows, len(executed), meta=meta, sampled=sampled)
+    return result_sets
+
+
+def _row_type(column_names):
+    return namedtuple('Row', column_names, rename=True)
+
+
+def _named_rows(column_names, rows):
+    row_type = _row_type(column_names)
+    return [row_type._make(row) for row in rows]
+
+
+def create_manticore_vector_table(client, table_name, dims=64, quantization=None):
+    """RT table of chunk vectors for KNN; `quantization` ('8bit', '1bit', ...) stores the HNSW vectors compressed"""
+    quantization_option = f" quantization='{quantization}'" if quantization else ""
+    manticore_query(client, f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        table_name string attribute,
+        table_rowid bigint,
+        text_str text,
+        text_vector float_vector knn_type='hnsw' knn_dims='{dims}' hnsw_similarity='l2'{quantization_option}
+    )
+    """)
+
+
+def manticore_vector_tables():
+    """The float vector table and the enabled quantized variants, as {table_name: quantization}"""
+    tables = {'text_vector_64_floats': None}
+    for table_name, variant in VECTOR_INDEX_VARIANTS.items():
+        if variant['enabled']:
+            tables[table_name] = variant['quantization']
+    return tables
+
+
+def manticore_table_status(client, table_name):
+    """`SHOW TABLE ... STATUS` as a dict, with the numeric values converted"""
+    status = {}
+    for name, value in manticore_query_rows(client, f"SHOW TABLE {table_name} STATUS"):
+        try:
+            status[name] = int(value)
+        except (TypeError, ValueError):
+            status[name] = value
+    return status
 
 
 def manticore_executemany(client, query, args_list):
-    print('manticore executemany: ', query[:160], ' - ', len(args_list), ' args')
+    if TELEMETRY_SETTINGS['echo_queries']:
+        print('manticore executemany: ', query[:160], ' - ', len(args_list), ' args')
+    t0 = time.time()
     with client.cursor() as cursor:
         cursor.executemany(query, args_list)
+    record_query('manticore', query, time.time() - t0, cursor.rowcount)
 
 
-def wait_until_manticore_table_is_ready(table_name):
+def wait_until_manticore_table_is_ready(table_name, version=None):
+    """Run the readiness queries until they pass.
+
+    With a version, they go to that version's local tables, which also warms them up before the alias swap.
+    """
     print('wait until manticore table is ready')
+    if version is None:
+        tables = [table_name]
+        autocomplete_table = manticore_local_table(table_name)
+    else:
+        tables = manticore_local_tables(table_name, version)
+        autocomplete_table = manticore_main_table(table_name, version)
 
     for i in range(10):
         try:
             with manticore_client_data_server() as client:
-                manticore_query(client, f"SELECT COUNT(*) as count FROM {table_name}")['count'].iloc[0]
-                manticore_query(client, f"SELECT * FROM {table_name} LIMIT 1")
-                manticore_query(client, f"CALL AUTOCOMPLETE('the', '{table_name}')")
+                for table in tables:
+                    manticore_query_rows(client, f"SELECT COUNT(*) as count FROM {table}")[0][0]
+                    manticore_query_rows(client, f"SELECT * FROM {table} LIMIT 1")
+                manticore_query_rows(client, f"CALL AUTOCOMPLETE('the', '{autocomplete_table}')")
                 print('manticore table OK')
                 return True
         except Exception as e:
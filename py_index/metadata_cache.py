@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import threading
+from py_index.clickhouse_client import clickhouse_client
+from py_index.manticore_database_ops import (
+    manticore_client_data_server, manticore_query, manticore_local_table, table_generation, all_tables_generation,
+)
+
+
+_entries = {}
+_lock = threading.Lock()
+
+
+def cached_metadata(kind, table_name, load):
+    """`load()` once per table and index generation; `table_name=None` for data about the whole table list.
+
+    The values are shared between callbacks, treat them as read-only.
+    """
+    generation = table_generation(table_name) if table_name is not None else all_tables_generation()
+    key = (kind, table_name)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    value = load()
+    with _lock:
+        _entries[key] = (generation, value)
+    return value
+
+
+def manticore_table_structure(table_name):
+    """`DESC` of the table's live local table as a DataFrame (Field, Type, Properties)"""
+    def load():
+        with manticore_client_data_server() as client:
+            return manticore_query(client, f"DESC {manticore_local_table(table_name)}")
+    return cached_metadata('desc', table_name, load)
+
+
+def indexed_tables():
+    def load():
+        with clickhouse_client('interactive') as client:
+            return client.query_df('select table_name from input_tables_summary')['table_name'].tolist()
+    return cached_metadata('tables', None, load)
+
+
+def table_to_file_mapping():
+    def load():
+        with clickhouse_client('interactive') as client:
+            df = client.query_df('SELECT file_name, table_name FROM input_tables_summary')
+            return dict(zip(df['table_name'], df['file_name']))
+    return cached_metadata('table_to_file', None, load)
+
+
+def warm_metadata_cache(per_table_loaders=()):
+    """Load the table list, the `DESC` of every table and whatever `per_table_loaders(table_name)` cache"""
+    try:
+        tables = indexed_tables()
+        table_to_file_mapping()
+    except Exception as e:
+        print(f"Error warming metadata cache: {str(e)}")
+        return
+    for table_name in tables:
+        for load in (manticore_table_structure, *per_table_loaders):
+            try:
+                load(table_name)
+            except Exception as e:
+                print(f"Error warming metadata cache for {table_name}: {str(e)}")
+    print(f"Metadata cache warmed for {len(tables)} tables")
+
+
+def warm_metadata_cache_in_background(per_table_loaders=()):
+    threading.Thread(target=warm_metadata_cache, args=(per_table_loaders,), name='metadata-cache-warmup', daemon=True).start()
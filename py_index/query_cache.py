@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import re
+import copy
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from py_index.database_settings import QUERY_CACHE_SETTINGS
+from py_index.manticore_database_ops import table_generation
+
+
+class MemoryResultCache:
+    """LRU with a TTL; values are copied in and out, callers are free to mutate what they get back"""
+
+    def __init__(self, max_entries, ttl_s):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_s:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return (copy.deepcopy(value),)
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskResultCache:
+    """The same interface on `diskcache` (installed with dash[diskcache]), shared by all app processes"""
+
+    def __init__(self, path, size_limit_bytes, ttl_s):
+        import diskcache
+        self.ttl_s = ttl_s
+        self._cache = diskcache.Cache(path, size_limit=size_limit_bytes, eviction_policy='least-recently-used')
+
+    def get(self, key):
+        marker = object()
+        value = self._cache.get(key, default=marker)
+        if value is marker:
+            return None
+        return (value,)
+
+    def set(self, key, value):
+        self._cache.set(key, value, expire=self.ttl_s)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_stats = {}
+
+
+def result_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if QUERY_CACHE_SETTINGS['backend'] == 'disk':
+                _cache = DiskResultCache(QUERY_CACHE_SETTINGS['disk_path'], QUERY_CACHE_SETTINGS['disk_size_limit_bytes'], QUERY_CACHE_SETTINGS['ttl_s'])
+            else:
+                _cache = MemoryResultCache(QUERY_CACHE_SETTINGS['max_entries'], QUERY_CACHE_SETTINGS['ttl_s'])
+        return _cache
+
+
+def normalize_sql(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def result_cache_key(tables, sql, args=None):
+    generations = [(table, table_generation(table)) for table in sorted(tables)]
+    raw = pickle.dumps((normalize_sql(sql), args, generations))
+    return hashlib.sha1(raw).hexdigest()
+
+
+def cached_query(name, tables, sql, args, compute):
+    """`compute()`'s result for this SQL and args, reused until one of `tables` gets a new index generation.
+
+    `name` only groups the hit ratio stats (e.g. 'facet', 'autocomplete').
+    """
+    key, hit = cache_lookup(name, tables, sql, args)
+    if hit is not None:
+        return hit[0]
+    value = compute()
+    cache_store(key, value)
+    return value
+
+
+def cache_lookup(name, tables, sql, args=None):
+    """(key, (value,)) on a hit, (key, None) on a miss; for callers that can't wrap the work in a function"""
+    if not QUERY_CACHE_SETTINGS['enabled']:
+        return None, None
+    key = result_cache_key(tables, sql, args)
+    hit = result_cache().get(key)
+    _count(name, hit is not None)
+    return key, hit
+
+
+def cache_store(key, value):
+    if key is not None:
+        result_cache().set(key, value)
+
+
+def _count(name, hit):
+    with _cache_lock:
+        stats = _stats.setdefault(name, {'hits': 0, 'misses': 0})
+        stats['hits' if hit else 'misses'] += 1
+
+
+def query_cache_stats():
+    """Hits, misses and hit ratio per cache user, plus the number of cached entries"""
+    with _cache_lock:
+        stats = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in stats.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = counts['hits'] / total if total else 0.0
+    stats['entries'] = len(result_cache()) if QUERY_CACHE_SETTINGS['enabled'] else 0
+    return stats
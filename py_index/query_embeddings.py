@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from py_index.database_settings import QUERY_EMBEDDING_SETTINGS
+from py_index.embedding_models import embedding_model
+
+
+class QueryEmbeddingService:
+    """Embeds search queries for the demo: an LRU of recent query vectors in front of a micro-batching encoder.
+
+    Misses are queued and a background thread encodes everything that arrives within `batch_window_ms` of the
+    first one in a single `model.encode()` call, up to `max_batch` texts. Concurrent misses on the same text share
+    one encode.
+    """
+
+    def __init__(self, model_name=None, batch_window_ms=5, max_batch=64, cache_entries=4096):
+        self.model_name = model_name
+        self.batch_window_s = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.cache_entries = cache_entries
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._queue = []
+        self._wakeup = threading.Condition(self._lock)
+        self._stats = {'hits': 0, 'misses': 0, 'batches': 0, 'batched_texts': 0, 'max_batch_size': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def embed(self, text, timeout_s=None):
+        """(vector, cache_hit) for one query text"""
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self._stats['hits'] += 1
+                return vector, True
+            self._stats['misses'] += 1
+            future = self._in_flight.get(text)
+            if future is None:
+                future = self._in_flight[text] = Future()
+                self._queue.append(text)
+                self._wakeup.notify()
+        return future.result(timeout=timeout_s), False
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._wakeup.wait()
+            # let the concurrent requests of the same moment join this batch
+            time.sleep(self.batch_window_s)
+            with self._lock:
+                texts = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+                futures = [self._in_flight[text] for text in texts]
+            try:
+                vectors = embedding_model(self.model_name).encode(texts)
+            except Exception as e:
+                with self._lock:
+                    for text in texts:
+                        del self._in_flight[text]
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                for text, vector in zip(texts, vectors):
+                    del self._in_flight[text]
+                    self._cache[text] = vector
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+                self._stats['batches'] += 1
+                self._stats['batched_texts'] += len(texts)
+                self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(texts))
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._cache)
+            stats['queued'] = len(self._queue)
+        stats['avg_batch_size'] = stats['batched_texts'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def query_embedding_service():
+    """The service of this process; a forked worker gets its own, the batching thread does not survive a fork"""
+    key = os.getpid()
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = _services[key] = QueryEmbeddingService(**QUERY_EMBEDDING_SETTINGS)
+    return service
+
+
+def embed_query(text):
+    """(vector, cache_hit) for a search query"""
+    return query_embedding_service().embed(text)
+
+
+def query_embedding_stats():
+    service = _services.get(os.getpid())
+    return service.stats() if service is not None else {}
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import time
+import queue
+import random
+import hashlib
+import datetime
+import threading
+from py_index.database_settings import TELEMETRY_SETTINGS
+
+
+TELEMETRY_COLUMNS = [
+    'event_time', 'engine', 'caller', 'table_name', 'fingerprint', 'fingerprint_sql', 'sql',
+    'latency_ms', 'rows', 'bytes', 'error', 'meta',
+]
+
+# frames from these files are skipped when looking for the caller of a query
+_INTERNAL_FILES = {
+    'manticore_database_ops.py', 'clickhouse_client.py', 'async_query.py', 'query_telemetry.py', 'query_cache.py',
+    'metadata_cache.py', 'contextlib.py',
+}
+
+_queue = queue.Queue(maxsize=TELEMETRY_SETTINGS['max_queue'])
+_flusher = None
+_flusher_lock = threading.Lock()
+_dropped = 0
+
+
+def init_query_telemetry_table(client):
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS query_telemetry (
+        event_time DateTime64(3),
+        engine LowCardinality(String),
+        caller LowCardinality(String),
+        table_name String,
+        fingerprint UInt64,
+        fingerprint_sql String,
+        sql String,
+        latency_ms Float64,
+        rows UInt64,
+        bytes UInt64,
+        error String,
+        meta Map(String, String)
+    ) ENGINE = MergeTree() ORDER BY (engine, fingerprint, event_time)
+    TTL toDateTime(event_time) + INTERVAL {TELEMETRY_SETTINGS['ttl_days']} DAY
+    """)
+
+
+def should_sample():
+    """Decide before running a query whether it is recorded, so `SHOW META` is only paid for sampled ones"""
+    return TELEMETRY_SETTINGS['enabled'] and random.random() < TELEMETRY_SETTINGS['sample_rate']
+
+
+def fingerprint_sql(sql):
+    """The SQL with literals replaced by `?`, so the same query with other values groups together"""
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'", '?', sql)
+    sql = re.sub(r'\(\s*-?[\d.e-]+(?:\s*,\s*-?[\d.e-]+)+\s*\)', '(?+)', sql)
+    # a number not inside an identifier (table_12), with its sign only when it is not a subtraction (a-1)
+    sql = re.sub(r'(?:(?<=[\s(,=<>])-)?(?<![\w.])\d+(?:\.\d+)?(?:e-?\d+)?\b', '?', sql)
+    return re.sub(r'\s+', ' ', sql).strip().lower()
+
+
+def statement_head(sql):
+    """INSERT/REPLACE up to their VALUES, so every batch of rows gets the same fingerprint; other statements whole"""
+    if re.match(r'\s*(?:insert|replace)\b', sql, flags=re.IGNORECASE):
+        match = re.search(r'\bvalues\b', sql, flags=re.IGNORECASE)
+        if match:
+            return sql[:match.end()] + ' ...'
+    return sql
+
+
+def query_table_name(sql):
+    match = re.search(r"\b(?:from|into|table)\s+`?([\w.]+)`?|\bcall\s+\w+\(.*?,\s*'([\w.]+)'", sql, flags=re.IGNORECASE | re.DOTALL)
+    if not match:
+        return ''
+    return match.group(1) or match.group(2)
+
+
+def query_caller():
+    frame = sys._getframe(1)
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _INTERNAL_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return ''
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def record_query(engine, sql, latency_s, rows=0, bytes_=0, error=None, meta=None, sampled=None):
+    """Queue one query for the background sink; never blocks and never prints.
+
+    Errors and queries slower than `slow_query_ms` are always kept, the rest according to `sample_rate`.
+    """
+    global _dropped
+    if not TELEMETRY_SETTINGS['enabled'] or threading.current_thread() is _flusher:
+        return
+    latency_ms = latency_s * 1000
+    if sampled is None:
+        sampled = random.random() < TELEMETRY_SETTINGS['sample_rate']
+    if not (sampled or error is not None or latency_ms >= TELEMETRY_SETTINGS['slow_query_ms']):
+        return
+
+    # bulk REPLACE/INSERT statements run to megabytes and are slow, so always recorded: cut them before any regex
+    sql = sql[:TELEMETRY_SETTINGS['max_sql_length']]
+    fingerprint = fingerprint_sql(statement_head(sql))
+    row = [
+        datetime.datetime.now(),
+        engine,
+        query_caller(),
+        query_table_name(sql),
+        int.from_bytes(hashlib.blake2b(fingerprint.encode(), digest_size=8).digest(), 'little'),
+        fingerprint[:TELEMETRY_SETTINGS['max_sql_length']],
+        sql,
+        latency_ms,
+        int(rows or 0),
+        int(bytes_ or 0),
+        str(error) if error is not None else '',
+        {str(k): str(v) for k, v in (meta or {}).items()},
+    ]
+    _start_flusher()
+    try:
+        _queue.put_nowait(row)
+    except queue.Full:
+        _dropped += 1
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_forever, name='query-telemetry', daemon=True)
+            _flusher.start()
+
+
+def _flush_forever():
+    from py_index.clickhouse_client import clickhouse_client
+    initialized = False
+    while True:
+        batch = [_queue.get()]
+        deadline = time.time() + TELEMETRY_SETTINGS['flush_interval_s']
+        while len(batch) < TELEMETRY_SETTINGS['batch_size']:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            with clickhouse_client() as client:
+                if not initialized:
+                    init_query_telemetry_table(client)
+                    initialized = True
+                client.insert('query_telemetry', batch, column_names=TELEMETRY_COLUMNS)
+        except Exception as e:
+            # off the hot path; losing a batch of telemetry is fine
+            print(f"Error writing {len(batch)} telemetry rows: {str(e)}")
+
+
+def telemetry_stats():
+    return {'queued': _queue.qsize(), 'dropped': _dropped}
@@ -1,7 +1,6 @@
 from dash import html, dcc, callback, Output, Input, State, ALL, no_update
 import pandas as pd
-from clickhouse_connect import get_client
-from py_index.database_settings import CLICKHOUSE_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
 from py_index.search_demo.components import create_data_table, create_error_div
 import time
 import datetime
@@ -35,7 +34,7 @@ def create_clickhouse_tab():
 
 def get_history_buttons():
     """Helper function to get history buttons"""
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client('interactive') as client:
         df = client.query_df("""
             SELECT 
                 event_time,
@@ -100,7 +99,7 @@ def run_clickhouse_query(n_clicks, query):
     
     print("run query")
     try:
-        with get_client(**CLICKHOUSE_SETTINGS) as client:
+        with clickhouse_client('interactive') as client:
             t0 = time.time()
             result = client.query_df(query)
             dt_ms = (time.time() - t0) * 1000
@@ -1,12 +1,16 @@
-from dash import html, dcc, callback, Output, Input
-from py_index.database_settings import CLICKHOUSE_SETTINGS
-from clickhouse_connect import get_client
-from py_index.manticore_database_ops import manticore_client_data_server, manticore_query
+from dash import html, dcc, callback, Output, Input, State
+from dash.exceptions import PreventUpdate
+from py_index.database_settings import MANTICORE_INDEX_SETTINGS, SEARCH_DEADLINE_SETTINGS
+from py_index.manticore_database_ops import manticore_dictionary_tables
 from py_index.search_demo.components import create_data_table, create_error_div
+from py_index.async_query import fan_out, manticore_sql_async
+from py_index.query_cache import cache_lookup, cache_store
+from py_index.metadata_cache import indexed_tables
+from py_index.search_requests import start_search_request, finish_search_request, SESSION_STORE_ID
 import pandas as pd
+import asyncio
 import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 def create_manticore_autocomplete_tab():
@@ -28,9 +32,10 @@ def create_manticore_autocomplete_tab():
 
 @callback(
     Output('manticore-autocomplete-output', 'children'),
-    Input('manticore-autocomplete-input', 'value')
+    Input('manticore-autocomplete-input', 'value'),
+    State(SESSION_STORE_ID, 'data')
 )
-def update_output(value):
+def update_output(value, session_id):
     try:
         if value is None:
             return '...'
@@ -39,11 +44,20 @@ def update_output(value):
         if len(value) < 3:
             return '... 3 letters plz ...'
         
-        with get_client(**CLICKHOUSE_SETTINGS) as client:
-            tables = client.query_df('select table_name from input_tables_summary')['table_name'].tolist()
+        tables = indexed_tables()
         
         t0 = time.time()
-        data = list(autocomplete_query_all_tables(tables, value))
+        request = start_search_request('autocomplete', SEARCH_DEADLINE_SETTINGS['autocomplete_ms'], session_id)
+        try:
+            if MANTICORE_INDEX_SETTINGS['unified_index']:
+                data = list(autocomplete_query_unified(value, request))
+            else:
+                data = list(autocomplete_query_all_tables(tables, value, request))
+        finally:
+            finish_search_request(request)
+        if request.cancelled:
+            # a newer keystroke owns the output now
+            raise PreventUpdate
         dt_ms = (time.time() - t0) * 1000
         short_list = combine_autocomplete_results(data)
         
@@ -56,34 +70,47 @@ def update_output(value):
             create_data_table(df, title=f'Autocomplete Results for "{value}" on {len(tables)} tables ({dt_ms:.2f}ms)'),
             html.Div(f'{len(tables)} tables')
         ]
+    except PreventUpdate:
+        raise
     except Exception as e:
         return create_error_div(e)
 
-def autocomplete_query_all_tables(tables, query):
-    # Use ThreadPool to parallelize queries
-    with ThreadPoolExecutor(max_workers=6) as executor:
-        # Create a partial function with the query parameter fixed
-        query_fn = partial(autocomplete_query_table, query=query)
-        # Map the function over tables and collect results as they complete
-        future_to_table = {executor.submit(query_fn, table): table for table in tables}
-        
-        # Collect and yield results as they complete
-        for future in future_to_table:
-            table = future_to_table[future]
-            try:
-                hits = future.result()
-                if hits:  # Only yield if we have hits
-                    yield (table, hits)
-            except Exception as e:
-                print(f"Error querying table {table}: {str(e)}")
+def autocomplete_query_all_tables(tables, query, request=None):
+    # Cached tables answer right away, the rest fan out over the async HTTP layer and yield as they complete
+    jobs = {}
+    cache_keys = {}
+    for table in tables:
+        cache_keys[table], hit = cache_lookup('autocomplete', [table], AUTOCOMPLETE_SQL, (query,))
+        if hit is None:
+            jobs[table] = partial(autocomplete_query_table_async, manticore_dictionary_tables(table), query)
+        elif hit[0]:
+            yield (table, hit[0])
+    for table, hits, error in fan_out(jobs, request=request):
+        if error is not None:
+            print(f"Error querying table {table}: {str(error)}")
+            continue
+        # past the deadline or after a newer keystroke the suggestions may be partial, don't keep them
+        if request is None or not (request.expired() or request.cancelled):
+            cache_store(cache_keys[table], hits)
+        if hits:  # Only yield if we have hits
+            yield (table, hits)
+
+def autocomplete_query_unified(query, request=None):
+    """One AUTOCOMPLETE call on the unified index instead of one per table, under the same deadline"""
+    table = MANTICORE_INDEX_SETTINGS['unified_index_name']
+    jobs = {table: partial(autocomplete_query_table_async, [table], query)}
+    for table, hits, error in fan_out(jobs, request=request):
+        if error is not None:
+            print(f"Error querying table {table}: {str(error)}")
+        elif hits:
+            yield (table, hits)
+
+AUTOCOMPLETE_SQL = "CALL AUTOCOMPLETE(%s, '{table}')"
 
-def autocomplete_query_table(table, query):
-    sql = f"CALL AUTOCOMPLETE(%s, '{table}')"
-    with manticore_client_data_server() as client:
-        df = manticore_query(client, sql, (query,))
-    if not df.empty:
-        return df['query'].tolist()
-    return []
+async def autocomplete_query_table_async(local_tables, query):
+    # main and delta dictionaries of one table, merged like the per-table results are
+    results = await asyncio.gather(*(manticore_sql_async(AUTOCOMPLETE_SQL.format(table=t), (query,)) for t in local_tables))
+    return combine_autocomplete_results([(t, [row['query'] for row in rows]) for t, rows in zip(local_tables, results)])
 
 def combine_autocomplete_results(data):
     data = data[::-1]
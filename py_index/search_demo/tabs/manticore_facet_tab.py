@@ -1,7 +1,11 @@
 from dash import html, dcc, callback, Output, Input, State, ALL, callback_context, no_update, dash_table
-from py_index.database_settings import CLICKHOUSE_SETTINGS
-from clickhouse_connect import get_client
-from py_index.manticore_database_ops import manticore_client_data_server, manticore_query
+from dash.exceptions import PreventUpdate
+from py_index.database_settings import SEARCH_DEADLINE_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
+from py_index.manticore_database_ops import manticore_client_data_server, manticore_query, manticore_query_rows, manticore_multi_query, manticore_suggest
+from py_index.query_cache import cache_lookup, cache_store
+from py_index.search_requests import start_search_request, finish_search_request, with_max_query_time, SESSION_STORE_ID
+from py_index.metadata_cache import cached_metadata, manticore_table_structure, table_to_file_mapping
 from py_index.search_demo.components import create_data_table, create_sql_query_display, create_facet_table, create_highlighted_data_table, highlight_text_to_spans, create_error_div
 import pandas as pd
 import json
@@ -15,7 +19,7 @@ HIGHLIGHTER_AFTER_MATCH = "__after__"
 
 def get_table_options():
     """Get table options from Clickhouse"""
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client('interactive') as client:
         df = client.query_df('SELECT file_name, table_name FROM input_tables_summary')
         # Sort by table_name
         df = df.sort_values('table_name')
@@ -401,12 +405,14 @@ def toggle_search_input(selected_table):
     return {'display': 'block', 'marginBottom': '20px'}
 
 def get_table_structure(table_name):
-    """Get the table structure from Manticore"""
-    with manticore_client_data_server() as client:
-        return manticore_query(client, f"DESC {table_name}")
+    """Get the table structure from Manticore (cached per index generation)"""
+    return manticore_table_structure(table_name)
 
 def get_numeric_field_stats(table_name, fields_df):
-    """Get min/max values for numeric fields"""
+    """Get min/max values for numeric fields (cached per index generation)"""
+    return cached_metadata('numeric_stats', table_name, lambda: load_numeric_field_stats(table_name, fields_df))
+
+def load_numeric_field_stats(table_name, fields_df):
     # Filter for numeric fields
     numeric_fields = fields_df[
         fields_df['Type'].isin(['bigint', 'timestamp', 'float', 'double'])
@@ -427,15 +433,15 @@ def get_numeric_field_stats(table_name, fields_df):
     
     # Execute query
     with manticore_client_data_server() as client:
-        stats_df = manticore_query(client, query)
-        if stats_df.empty:
+        rows = manticore_query_rows(client, query)
+        if not rows:
             return {}
             
-        # Convert the single row to a dict of field stats
+        # Convert the single row to a dict of field stats, the columns come in (min, max) pairs
         stats = {}
-        for field in numeric_fields:
-            min_val = stats_df[f'min_{field}'].iloc[0]
-            max_val = stats_df[f'max_{field}'].iloc[0]
+        for i, field in enumerate(numeric_fields):
+            min_val = rows[0][2 * i]
+            max_val = rows[0][2 * i + 1]
             if min_val is not None and max_val is not None:  # Only store if we got valid values
                 stats[field] = {'min': min_val, 'max': max_val}
         return stats
@@ -935,9 +941,11 @@ def create_filters_and_sql_display(sql, query_time_ms=None, filter_states=None):
      Output('manticore-facet-results', 'children')],
     [Input('manticore-facet-search-input', 'value'),
      Input('manticore-facet-table-selector', 'value'),
-     Input('manticore-facet-filter-states', 'data')]
+     Input('manticore-facet-filter-states', 'data')],
+    State(SESSION_STORE_ID, 'data')
 )
-def update_search_results(search_query, selected_table, filter_states):
+def update_search_results(search_query, selected_table, filter_states, session_id):
+    request = start_search_request('facet', SEARCH_DEADLINE_SETTINGS['facet_ms'], session_id)
     try:
         if not selected_table:
             return '', None, html.Div(), html.Div()
@@ -950,32 +958,22 @@ def update_search_results(search_query, selected_table, filter_states):
         numeric_stats = get_numeric_field_stats(selected_table, fields_df)
         
         # Get file name for the selected table
-        with get_client(**CLICKHOUSE_SETTINGS) as client:
-            df = client.query_df(
-                'SELECT file_name FROM input_tables_summary WHERE table_name = %s',
-                parameters=(selected_table,)
-            )
-            if df.empty:
-                return '', None, html.Div(), html.H3('Table not found', style={'color': 'red'})
-            file_name = df['file_name'].iloc[0]
+        file_name = table_to_file_mapping().get(selected_table)
+        if file_name is None:
+            return '', None, html.Div(), html.H3('Table not found', style={'color': 'red'})
         
-        # First get the total count with filters
-        with manticore_client_data_server() as client:
-            # Build count query with same WHERE conditions but without the SELECT list
-            if search_query and len(search_query.strip()) > 0:
-                count_sql = f"SELECT COUNT(*) as count FROM {selected_table} WHERE match(%s)"
-                count_params = (search_query,)
-            else:
-                count_sql = f"SELECT COUNT(*) as count FROM {selected_table} WHERE 1=1"
-                count_params = tuple()
-            
-            if filter_states:
-                conditions = build_filter_conditions(filter_states)
-                if conditions:
-                    count_sql += "\nAND " + "\nAND ".join(conditions)
-            
-            count_df = manticore_query(client, count_sql, count_params)
-            total_count = count_df.iloc[0]['count'] if not count_df.empty else 0
+        # Build count query with same WHERE conditions but without the SELECT list
+        if search_query and len(search_query.strip()) > 0:
+            count_sql = f"SELECT COUNT(*) as count FROM {selected_table} WHERE match(%s)"
+            search_params = (search_query,)
+        else:
+            count_sql = f"SELECT COUNT(*) as count FROM {selected_table} WHERE 1=1"
+            search_params = tuple()
+        
+        if filter_states:
+            conditions = build_filter_conditions(filter_states)
+            if conditions:
+                count_sql += "\nAND " + "\nAND ".join(conditions)
         
         # Execute search with facets and filters
         t0 = time.time()
@@ -996,78 +994,88 @@ def update_search_results(search_query, selected_table, filter_states):
                     search_query=search_query
                 )
         
-        with manticore_client_data_server() as client:
-            # Get main results
-            if search_query and len(search_query.strip()) > 0:
-                results = manticore_query(client, search_sql, (search_query,))
-            else:
-                results = manticore_query(client, search_sql, tuple())
-            dt_ms = (time.time() - t0) * 1000
-            
-            # Get facets for each field
-            field_facets = {}
-            for field, query in facet_queries.items():
-                if search_query and len(search_query.strip()) > 0:
-                    field_facets[field] = manticore_query(client, query, (search_query,))
-                else:
-                    field_facets[field] = manticore_query(client, query, tuple())
+        # count, main results and the per-field facets go out as one multi-query
+        batch = {'count': (count_sql, search_params), 'main': (search_sql, search_params)}
+        for field, query in facet_queries.items():
+            batch[('facet', field)] = (query, search_params)
+        
+        cache_key, hit = cache_lookup('facet', [selected_table], ';'.join(sql for sql, _ in batch.values()), (search_params, list(batch)))
+        if hit is not None:
+            batch_results = hit[0]
+        else:
+            if request.cancelled:
+                raise PreventUpdate
+            with manticore_client_data_server() as client:
+                batch_results = manticore_multi_query(client, {name: (with_max_query_time(sql, request), params) for name, (sql, params) in batch.items()})
+            if request.cancelled:
+                # a newer keystroke or filter change owns the output now
+                raise PreventUpdate
+            # past the deadline Manticore may have returned partial results, don't keep them
+            if not request.expired():
+                cache_store(cache_key, batch_results)
+        dt_ms = (time.time() - t0) * 1000
+        
+        count_df = batch_results['count']
+        total_count = count_df.iloc[0]['count'] if not count_df.empty else 0
+        results = batch_results['main']
+        field_facets = {field: batch_results[('facet', field)] for field in facet_queries}
+        
+        # Process results and facets
+        if isinstance(results, list) and len(results) > 0:
+            results_df = results[0]
             
-            # Process results and facets
-            if isinstance(results, list) and len(results) > 0:
-                results_df = results[0]
+            # Process facets from additional result sets
+            facet_data = {}
+            if len(results) > 1:
+                string_fields = fields_df[fields_df['Type'] == 'string']['Field'].tolist()
+                numeric_fields = fields_df[fields_df['Type'].isin(['bigint', 'timestamp', 'float', 'double'])]['Field'].tolist()
                 
-                # Process facets from additional result sets
-                facet_data = {}
-                if len(results) > 1:
-                    string_fields = fields_df[fields_df['Type'] == 'string']['Field'].tolist()
-                    numeric_fields = fields_df[fields_df['Type'].isin(['bigint', 'timestamp', 'float', 'double'])]['Field'].tolist()
-                    
-                    facet_idx = 1  # Skip first result set (main search results)
-                    
-                    # Process string facets
-                    for field in string_fields:
-                        if facet_idx < len(results):
-                            try:
+                facet_idx = 1  # Skip first result set (main search results)
+                
+                # Process string facets
+                for field in string_fields:
+                    if facet_idx < len(results):
+                        try:
+                            # If this field has an active filter, use its specific facet query results
+                            if field in field_facets and isinstance(field_facets[field], list) and len(field_facets[field]) > facet_idx:
+                                facet_df = field_facets[field][facet_idx]
+                                # Verify the facet data has the required columns
+                                if field in facet_df.columns and 'count(*)' in facet_df.columns:
+                                    facet_data[field] = facet_df
+                            else:
+                                # Verify the results data has the required columns
+                                if field in results[facet_idx].columns and 'count(*)' in results[facet_idx].columns:
+                                    facet_data[field] = results[facet_idx]
+                        except Exception as e:
+                            print(f"Error processing string facet for field {field}: {e}")
+                        facet_idx += 1
+                
+                # Process numeric facets
+                for field in numeric_fields:
+                    if facet_idx < len(results):
+                        try:
+                            # Get the numeric stats for this field
+                            stats = numeric_stats.get(field)
+                            if stats and stats.get('min') is not None and stats.get('max') is not None:
                                 # If this field has an active filter, use its specific facet query results
                                 if field in field_facets and isinstance(field_facets[field], list) and len(field_facets[field]) > facet_idx:
-                                    facet_df = field_facets[field][facet_idx]
-                                    # Verify the facet data has the required columns
-                                    if field in facet_df.columns and 'count(*)' in facet_df.columns:
-                                        facet_data[field] = facet_df
+                                    df = field_facets[field][facet_idx].copy()
                                 else:
-                                    # Verify the results data has the required columns
-                                    if field in results[facet_idx].columns and 'count(*)' in results[facet_idx].columns:
-                                        facet_data[field] = results[facet_idx]
-                            except Exception as e:
-                                print(f"Error processing string facet for field {field}: {e}")
-                            facet_idx += 1
-                    
-                    # Process numeric facets
-                    for field in numeric_fields:
-                        if facet_idx < len(results):
-                            try:
-                                # Get the numeric stats for this field
-                                stats = numeric_stats.get(field)
-                                if stats and stats.get('min') is not None and stats.get('max') is not None:
-                                    # If this field has an active filter, use its specific facet query results
-                                    if field in field_facets and isinstance(field_facets[field], list) and len(field_facets[field]) > facet_idx:
-                                        df = field_facets[field][facet_idx].copy()
-                                    else:
-                                        df = results[facet_idx].copy()
-                                    
-                                    # Verify the facet data has the required columns
-                                    range_col = f'{field}_range'
-                                    if range_col in df.columns and 'count(*)' in df.columns:
-                                        # Add min/max values to the facet data
-                                        df['min'] = stats['min']
-                                        df['max'] = stats['max']
-                                        facet_data[field] = df
-                            except Exception as e:
-                                print(f"Error processing numeric facet for field {field}: {e}")
-                            facet_idx += 1
-                else:
-                    results_df = pd.DataFrame()
-                    facet_data = {}
+                                    df = results[facet_idx].copy()
+                                
+                                # Verify the facet data has the required columns
+                                range_col = f'{field}_range'
+                                if range_col in df.columns and 'count(*)' in df.columns:
+                                    # Add min/max values to the facet data
+                                    df['min'] = stats['min']
+                                    df['max'] = stats['max']
+                                    facet_data[field] = df
+                        except Exception as e:
+                            print(f"Error processing numeric facet for field {field}: {e}")
+                        facet_idx += 1
+            else:
+                results_df = pd.DataFrame()
+                facet_data = {}
         
         # Create facets with the facet data
         facets = html.Div([
@@ -1095,9 +1103,8 @@ def update_search_results(search_query, selected_table, filter_states):
         
         # If no results and we have a search query, show suggestions
         if total_count == 0 and search_query and len(search_query.strip()) > 0:
-            suggest_sql = f"CALL SUGGEST('{search_query}', '{selected_table}', 5 as limit)"
             with manticore_client_data_server() as client:
-                suggestions_df = manticore_query(client, suggest_sql)
+                suggestions_df = manticore_suggest(client, search_query, selected_table)
             
             if isinstance(suggestions_df, list) or suggestions_df.empty:
                 results_display = [
@@ -1138,8 +1145,12 @@ def update_search_results(search_query, selected_table, filter_states):
             facets,
             html.Div(results_display)
         )
+    except PreventUpdate:
+        raise
     except Exception as e:
         return "", "", "", create_error_div(e)
+    finally:
+        finish_search_request(request)
 
 def create_suggestion_box(suggestions_df, title="Suggested searches:"):
     """Create a box with clickable suggestions"""
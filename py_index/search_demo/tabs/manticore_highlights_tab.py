@@ -1,11 +1,15 @@
 from dash import callback_context, html, dcc, callback, Output, Input, State, ALL, no_update
-from py_index.database_settings import CLICKHOUSE_SETTINGS
-from clickhouse_connect import get_client
-from py_index.manticore_database_ops import manticore_client_data_server, manticore_query
+from dash.exceptions import PreventUpdate
+from py_index.database_settings import MANTICORE_INDEX_SETTINGS, SEARCH_DEADLINE_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
+from py_index.manticore_database_ops import manticore_client_data_server, manticore_query, manticore_suggest
 from py_index.search_demo.components import create_data_table, create_error_div
+from py_index.async_query import fan_out, manticore_sql_async
+from py_index.query_cache import cache_lookup, cache_store
+from py_index.metadata_cache import cached_metadata, manticore_table_structure, indexed_tables, table_to_file_mapping
+from py_index.search_requests import start_search_request, finish_search_request, with_max_query_time, SESSION_STORE_ID
 import pandas as pd
 import time
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 import json
 import traceback
@@ -186,9 +190,7 @@ def create_custom_data_table(df, title, table_name):
 
 def get_table_to_file_mapping():
     """Get a mapping of table names to their original file names"""
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
-        df = client.query_df('SELECT file_name, table_name FROM input_tables_summary')
-        return dict(zip(df['table_name'], df['file_name']))
+    return table_to_file_mapping()
 
 def format_table_display(table_name, table_to_file):
     """Format the display of a table name with its file name"""
@@ -248,19 +250,16 @@ def create_suggestion_box(suggestions_df, title="Suggested searches across all t
 
 def get_suggestions_for_table(table, query):
     """Get suggestions for a single table"""
-    suggest_sql = f"CALL SUGGEST('{query}', '{table}', 5 as limit)"
     with manticore_client_data_server() as client:
-        suggestions_df = manticore_query(client, suggest_sql)
-        if not suggestions_df.empty:
-            # Convert docs to integer
-            suggestions_df['docs'] = suggestions_df['docs'].astype(int)
-    return suggestions_df
+        return manticore_suggest(client, query, table)
 
 def aggregate_suggestions(tables, query):
     """Get and aggregate suggestions from all tables"""
     all_suggestions = []
     
-    # Collect suggestions from all tables
+    # Collect suggestions from all tables (or from the unified index, in one call)
+    if MANTICORE_INDEX_SETTINGS['unified_index']:
+        tables = [MANTICORE_INDEX_SETTINGS['unified_index_name']]
     for table in tables:
         suggestions_df = get_suggestions_for_table(table, query)
         if not suggestions_df.empty:
@@ -289,9 +288,10 @@ def aggregate_suggestions(tables, query):
 
 @callback(
     Output('manticore-highlights-output', 'children'),
-    Input('manticore-highlights-input', 'value')
+    Input('manticore-highlights-input', 'value'),
+    State(SESSION_STORE_ID, 'data')
 )
-def update_output(value):
+def update_output(value, session_id):
     if value is None:
         return '...'
     if value.strip() == '':
@@ -299,11 +299,20 @@ def update_output(value):
     if len(value) < 2:
         return '... 2 letters plz ...'
     
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
-        tables = client.query_df('select table_name from input_tables_summary')['table_name'].tolist()
+    tables = indexed_tables()
     
     t0 = time.time()
-    data = sorted(list(highlight_query_all_tables(tables, value)))
+    request = start_search_request('highlights', SEARCH_DEADLINE_SETTINGS['highlights_ms'], session_id)
+    try:
+        if MANTICORE_INDEX_SETTINGS['unified_index']:
+            data = sorted(list(highlight_query_unified(value, request)))
+        else:
+            data = sorted(list(highlight_query_all_tables(tables, value, request)))
+    finally:
+        finish_search_request(request)
+    if request.cancelled:
+        # a newer keystroke owns the output now
+        raise PreventUpdate
     dt_ms = (time.time() - t0) * 1000
     
     # Get table name to file name mapping
@@ -352,28 +361,47 @@ def update_output(value):
     
     return output_elements
 
-def highlight_query_all_tables(tables, query):
-    # Use ThreadPool to parallelize queries
-    with ThreadPoolExecutor(max_workers=6) as executor:
-        # Create a partial function with the query parameter fixed
-        query_fn = partial(highlight_query_table, query=query)
-        # Map the function over tables and collect results as they complete
-        future_to_table = {executor.submit(query_fn, table): table for table in tables}
-        
-        # Collect and yield results as they complete
-        for future in future_to_table:
-            table = future_to_table[future]
-            try:
-                hits = future.result()
-                if hits:  # Only yield if we have hits
-                    yield (table, hits)
-            except Exception as e:
-                print(f"Error querying table {table}: {str(e)}")
+def highlight_query_all_tables(tables, query, request=None):
+    # Cached tables answer right away, the rest fan out over the async HTTP layer and yield as they complete
+    jobs = {}
+    cache_keys = {}
+    for table in tables:
+        cache_keys[table], hit = cache_lookup('highlights', [table], 'highlight_query_table', (query,))
+        if hit is None:
+            fields = manticore_table_structure(table).to_dict(orient='records')
+            jobs[table] = partial(highlight_query_table, table, fields, query, request)
+        elif hit[0]:
+            yield (table, hit[0])
+    for table, hits, error in fan_out(jobs, request=request):
+        if error is not None:
+            print(f"Error querying table {table}: {str(error)}")
+            continue
+        # past the deadline Manticore may have returned partial matches, don't keep them
+        if request is None or not request.expired():
+            cache_store(cache_keys[table], hits)
+        if hits:  # Only yield if we have hits
+            yield (table, hits)
 
-def highlight_query_table(table, query):
+def highlight_query_unified(query, request=None):
+    """Search every table with one query on the unified index, grouped by table in the same request"""
+    sql = f"""
+    select WEIGHT() as weight, highlight({{before_match='{HIGHLIGHTER_BEFORE_MATCH}', after_match='{HIGHLIGHTER_AFTER_MATCH}'}}) as highlight_all, table_rowid as id, table_name
+    from {MANTICORE_INDEX_SETTINGS['unified_index_name']}
+    where match(%s)
+    group 50 by table_name
+    within group order by weight() desc
+    limit 5000
+    option max_matches=5000
+    """
     with manticore_client_data_server() as client:
-        fields = manticore_query(client, f"desc {table}").to_dict(orient='records')
+        df = manticore_query(client, with_max_query_time(sql, request), (query,))
+    if df.empty:
+        return
 
+    for table_name, table_df in df.groupby('table_name'):
+        yield (table_name, table_df.drop(columns=['table_name']).to_dict('records'))
+
+async def highlight_query_table(table, fields, query, request=None):
     fields = [field for field in fields if field['Field'] != 'id' and field['Type'] == 'text']
 
     other_highlights = [
@@ -391,8 +419,7 @@ def highlight_query_table(table, query):
     where match(%s)
     limit 50
     """
-    with manticore_client_data_server() as client:
-        df = manticore_query(client, sql, (query,))
+    df = pd.DataFrame(await manticore_sql_async(with_max_query_time(sql, request), (query,)))
     if df.empty:
         return []
     
@@ -477,7 +504,7 @@ def handle_row_click(clicks, current_selection, row_ids, timestamps):
 def get_row_details(table_name, row_id):
     """Fetch detailed information about a specific row"""
     # with manticore_mysql_client() as client:
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client('interactive') as client:
         query = f"SELECT * FROM {table_name} where id = {row_id}"
         # df = manticore_query(client, query)
         df = client.query_df(query)
@@ -546,8 +573,11 @@ def toggle_popup_state(overlay_clicks, minimize_clicks, current_state, selected_
     return no_update, no_update, no_update
 
 def get_column_name_mapping(table_name):
-    """Get a mapping of fixed column names to their original names"""
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    """Get a mapping of fixed column names to their original names (cached per index generation)"""
+    return cached_metadata('column_names', table_name, lambda: load_column_name_mapping(table_name))
+
+def load_column_name_mapping(table_name):
+    with clickhouse_client('interactive') as client:
         print(f"Fetching column mapping for table: {table_name}")
         df = client.query_df(f"""
             SELECT column_name, column_name_fixed
@@ -1,9 +1,11 @@
 import clickhouse_connect
 from dash import html, dcc, callback, Input, Output, State
-from py_index.database_settings import CLICKHOUSE_SETTINGS
+from py_index.database_settings import CLICKHOUSE_SETTINGS, CLICKHOUSE_VECTOR_SETTINGS
 from py_index.search_demo.components import create_error_div
 from py_index.manticore_database_ops import manticore_client_weights_server, manticore_query
-import process_3_encode_sentence as process_3
+from py_index.query_cache import cached_query
+from py_index.clickhouse_vectors import clickhouse_knn
+from py_index.query_embeddings import embed_query
 import time
 import pandas as pd
 from collections import defaultdict
@@ -144,28 +146,40 @@ def perform_knn_search(search_query, ef_value, k_value):
     try:
         # Get embedding for the search query
         t0_embed = time.time()
-        model = process_3.model
-        embeddings = model.encode([search_query])
-        vector_values = [float(x) for x in embeddings[0]]
+        embedding, embedding_cached = embed_query(search_query)
+        vector_values = [float(x) for x in embedding]
         vector_str = ','.join(str(x) for x in vector_values)
         t1_embed = time.time()
         embed_time_ms = (t1_embed - t0_embed) * 1000
 
         # Perform KNN search in Manticore
         t0_search = time.time()
-        with manticore_client_weights_server() as client:
-            sql = f"""
-            SELECT id, table_name, table_rowid, text_str, knn_dist() as distance
-            FROM text_vector_64_floats
-            WHERE knn(text_vector, {k_value}, ({vector_str}), {ef_value})
-            ORDER BY distance ASC
-            """
-            results = manticore_query(client, sql)
+        sql = f"""
+        SELECT id, table_name, table_rowid, text_str, knn_dist() as distance
+        FROM text_vector_64_floats
+        WHERE knn(text_vector, {k_value}, ({vector_str}), {ef_value})
+        ORDER BY distance ASC
+        """
+        
+        def run_search():
+            with manticore_client_weights_server() as client:
+                return manticore_query(client, sql)
+        
+        search_source = ""
+        try:
+            results = cached_query('knn', ['text_vector_64_floats'], sql, None, run_search)
+        except Exception as e:
+            if not CLICKHOUSE_VECTOR_SETTINGS['enabled']:
+                raise
+            # weights server down: same search over the ClickHouse copy of the vectors, not cached
+            print(f"KNN search on the weights server failed, falling back to ClickHouse: {e}")
+            results = clickhouse_knn(vector_values, k_value)
+            search_source = " (ClickHouse fallback)"
         t1_search = time.time()
         search_time_ms = (t1_search - t0_search) * 1000
 
         # We no longer need to fetch from Clickhouse as text_str is in the result
-        timing_text = f"Embedding: {embed_time_ms:.1f}ms | Search: {search_time_ms:.1f}ms | Total: {(embed_time_ms + search_time_ms):.1f}ms"
+        timing_text = f"Embedding: {embed_time_ms:.1f}ms{' (cached)' if embedding_cached else ''} | Search: {search_time_ms:.1f}ms{search_source} | Total: {(embed_time_ms + search_time_ms):.1f}ms"
 
         if results.empty:
             return html.Div("No results found", style={
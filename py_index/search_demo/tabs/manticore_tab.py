@@ -1,8 +1,7 @@
 from dash import html, dcc, callback, Output, Input, State, ALL, no_update
 from py_index.manticore_database_ops import manticore_client_data_server, manticore_client_weights_server, manticore_query
 from py_index.search_demo.components import create_data_table, create_error_div
-from clickhouse_connect import get_client
-from py_index.database_settings import CLICKHOUSE_SETTINGS
+from py_index.clickhouse_client import clickhouse_client
 import time
 import datetime
 import traceback
@@ -48,7 +47,7 @@ def create_manticore_tab():
 
 def get_history_buttons(client_type='data'):
     """Helper function to get history buttons"""
-    with get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client('interactive') as client:
         df = client.query_df("""
             SELECT 
                 event_time,
@@ -146,7 +145,7 @@ def run_manticore_query(n_clicks, query, client_type):
                 ])
             
         # Store query history in Clickhouse
-        with get_client(**CLICKHOUSE_SETTINGS) as ch_client:
+        with clickhouse_client('interactive') as ch_client:
             ch_client.insert(
                 'search_demo_query_history',
                 column_names = [
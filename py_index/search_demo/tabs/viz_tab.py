@@ -1,6 +1,5 @@
-import clickhouse_connect
+from py_index.clickhouse_client import clickhouse_client
 from dash import html, dcc, callback, Input, Output
-from py_index.database_settings import CLICKHOUSE_SETTINGS
 from py_index.search_demo.components import create_error_div
 
 # List of visualization URLs - we'll start with one and expand later
@@ -10,7 +9,7 @@ SUPERSET_IDS = [
 
 def get_table_options():
     """Get table options from Clickhouse, only for tables that have charts"""
-    with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as client:
+    with clickhouse_client('interactive') as client:
         df = client.query_df('''
             SELECT DISTINCT i.file_name, i.table_name
             FROM input_tables_summary i
@@ -137,7 +136,7 @@ def update_viz_grid(selected_table):
                 'textAlign': 'center'
             })
 
-        with clickhouse_connect.get_client(**CLICKHOUSE_SETTINGS) as c:
+        with clickhouse_client('interactive') as c:
             charts = c.query_df(
                 "SELECT * FROM superset_charts WHERE table_name = %s",
                 parameters=(selected_table,)
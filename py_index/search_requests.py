@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import re
+import time
+import threading
+
+
+class SearchRequest:
+    """One keystroke-driven search: a deadline, and a flag set once a newer search from the same session starts"""
+
+    def __init__(self, key, budget_ms):
+        self.key = key
+        self.budget_ms = budget_ms
+        self.deadline = time.time() + budget_ms / 1000
+        self.cancelled = False
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def remaining_s(self):
+        return max(0.0, self.deadline - time.time())
+
+    def expired(self):
+        return time.time() >= self.deadline
+
+    def attach(self, future):
+        """Cancel `future` together with this request"""
+        with self._lock:
+            if self.cancelled:
+                future.cancel()
+            else:
+                self._futures.append(future)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+
+
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+# dcc.Store holding a random id per browser tab (sessionStorage), filled in by a clientside callback of the app
+SESSION_STORE_ID = 'search-session-id'
+
+
+def session_key():
+    """Fallback session of the current Dash callback before the tab's session id is set: address + user agent"""
+    from flask import request, has_request_context
+    if not has_request_context():
+        return threading.get_ident()
+    return (request.remote_addr, request.headers.get('User-Agent', ''))
+
+
+def start_search_request(channel, budget_ms, session_id=None):
+    """Start a search on `channel` (e.g. 'autocomplete'), cancelling the session's previous one on that channel.
+
+    `session_id` is the browser tab's id from the SESSION_STORE_ID store, so two tabs, or two users behind the
+    same proxy, never cancel each other's searches.
+    """
+    request = SearchRequest((session_id or session_key(), channel), budget_ms)
+    with _latest_lock:
+        previous = _latest.get(request.key)
+        _latest[request.key] = request
+    if previous is not None:
+        previous.cancel()
+    return request
+
+
+def finish_search_request(request):
+    with _latest_lock:
+        if _latest.get(request.key) is request:
+            del _latest[request.key]
+
+
+def with_max_query_time(sql, request):
+    """Add `OPTION max_query_time` so Manticore itself stops working on the request at its deadline.
+
+    Manticore wants OPTION before any FACET clause, so the option goes in front of the first FACET. The time is what
+    is left of the budget when the statement is built, not the whole budget.
+    """
+    if request is None:
+        return sql
+    max_query_time_ms = max(1, int(request.remaining_s() * 1000))
+    sql = sql.rstrip().rstrip(';')
+    facet_start = _keyword_position(sql, 'FACET')
+    if facet_start is None:
+        head, tail = sql, ''
+    else:
+        head, tail = sql[:facet_start].rstrip(), '\n' + sql[facet_start:]
+    if _keyword_position(head, 'OPTION') is not None:
+        return f"{head}, max_query_time={max_query_time_ms}{tail}"
+    return f"{head}\nOPTION max_query_time={max_query_time_ms}{tail}"
+
+
+def _keyword_position(sql, keyword):
+    """Offset of the first `keyword` outside quoted strings (filter values may contain any word), or None"""
+    return next(_keyword_positions(sql, keyword), None)
+
+
+def keyword_count(sql, keyword):
+    """How many times `keyword` appears outside quoted strings, e.g. the FACET clauses of a statement"""
+    return sum(1 for _ in _keyword_positions(sql, keyword))
+
+
+def _keyword_positions(sql, keyword):
+    for match in re.finditer(r"'(?:[^'\\]|\\.)*'|\b" + keyword + r"\b", sql, flags=re.IGNORECASE):
+        if not match.group(0).startswith("'"):
+            yield match.start()
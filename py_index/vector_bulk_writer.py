@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import time
+import contextlib
+from py_index.database_settings import VECTOR_UPLOAD_SETTINGS
+from py_index.manticore_database_ops import manticore_client_weights_server, manticore_query
+from py_index.concurrency_limiter import adaptive_limiter
+
+
+class VectorBulkWriter:
+    """Streams (doc_id, table_name, rowid, text, vector) rows into a Manticore vector table over one reused connection.
+
+    Rows are formatted into the INSERT as they arrive and sent whenever the statement reaches `batch_bytes`, so
+    memory stays at one statement no matter how many rows go through. Rows are written with REPLACE, so sending a
+    doc_id again overwrites the row instead of adding a duplicate. Vectors are written with `float_format`
+    (`%.6g` by default: 6 significant digits, well past float32 model noise and about half the size of `str()`).
+
+        with VectorBulkWriter('text_vector_64_floats') as writer:
+            writer.add_many(table_name, doc_ids, ids, texts, embeddings)
+    """
+
+    def __init__(self, vector_table, batch_bytes=None, float_format=None, limiter_name='manticore_weights_insert'):
+        self.vector_table = vector_table
+        self.batch_bytes = batch_bytes or VECTOR_UPLOAD_SETTINGS['batch_bytes']
+        self.float_format = float_format or VECTOR_UPLOAD_SETTINGS['float_format']
+        self.limiter_name = limiter_name
+        self._vector_formats = {}
+        self._client = None
+        self._exit_stack = None
+        self._prefix = f"REPLACE INTO {vector_table} (id, table_name, table_rowid, text_str, text_vector) VALUES "
+        self._values = []
+        self._values_bytes = 0
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self._t0 = None
+
+    def __enter__(self):
+        self._exit_stack = contextlib.ExitStack()
+        self._client = self._exit_stack.enter_context(manticore_client_weights_server())
+        self._t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._exit_stack.close()
+            self._client = None
+        return False
+
+    def format_vector(self, vector):
+        """`(0.123457,-1.5e-05,...)` using one precompiled format string per vector length"""
+        vector = vector.tolist() if hasattr(vector, 'tolist') else list(vector)
+        fmt = self._vector_formats.get(len(vector))
+        if fmt is None:
+            fmt = self._vector_formats[len(vector)] = '(' + ','.join([self.float_format] * len(vector)) + ')'
+        return fmt % tuple(vector)
+
+    def add(self, doc_id, table_name, rowid, text, vector):
+        # the vector tuple is not a type the driver can parameterize, the text is escaped by the driver
+        value = f"({int(doc_id)}, {self._client.escape(table_name)}, {int(rowid)}, {self._client.escape(text)}, {self.format_vector(vector)})"
+        self._values.append(value)
+        self._values_bytes += len(value) + 2
+        if self._values_bytes >= self.batch_bytes:
+            self.flush()
+
+    def add_many(self, table_name, doc_ids, ids, texts, vectors):
+        for doc_id, rowid, text, vector in zip(doc_ids, ids, texts, vectors):
+            self.add(doc_id, table_name, rowid, text, vector)
+
+    def flush(self):
+        if not self._values:
+            return
+        sql = self._prefix + ', '.join(self._values)
+        rows = len(self._values)
+        self._values = []
+        self._values_bytes = 0
+
+        # the thread pools only cap the parallelism, the limiter decides how much of it the weights server gets
+        with adaptive_limiter(self.limiter_name).slot():
+            manticore_query(self._client, sql)
+            manticore_query(self._client, "COMMIT")
+
+        self.rows += rows
+        self.bytes += len(sql)
+        self.batches += 1
+
+    def report(self):
+        duration = time.time() - self._t0 if self._t0 else 0
+        rate = self.rows / duration if duration > 0 else 0
+        mb_s = self.bytes / duration / 1024 / 1024 if duration > 0 else 0
+        return (f"Inserted {self.rows} vectors in {self.batches} batches ({self.bytes/1024/1024:.2f} MB) "
+                f"in {duration:.2f} seconds = {rate:.0f} vectors/s, {mb_s:.2f} MB/s")
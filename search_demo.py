@@ -1,18 +1,47 @@
-from dash import Dash, html, dcc
+import os
+from dash import Dash, html, dcc, Output, Input, State
 from py_index.search_demo.tabs.clickhouse_tab import create_clickhouse_tab
 from py_index.search_demo.tabs.manticore_tab import create_manticore_tab
 from py_index.search_demo.tabs.manticore_autocomplete_tab import create_manticore_autocomplete_tab
-from py_index.search_demo.tabs.manticore_highlights_tab import create_manticore_highlights_tab
-from py_index.search_demo.tabs.manticore_facet_tab import create_manticore_facet_tab
+from py_index.search_demo.tabs.manticore_highlights_tab import create_manticore_highlights_tab, get_column_name_mapping
+from py_index.search_demo.tabs.manticore_facet_tab import create_manticore_facet_tab, get_table_structure, get_numeric_field_stats
 from py_index.search_demo.tabs.viz_tab import create_viz_tab
 from py_index.search_demo.tabs.manticore_knn_tab import create_manticore_knn_tab
+from py_index.clickhouse_client import start_request_query_count, request_query_count
+from py_index.query_cache import query_cache_stats
+from py_index.query_telemetry import telemetry_stats
+from py_index.concurrency_limiter import limiter_stats
+from py_index.manticore_database_ops import manticore_pool_stats
+from py_index.query_embeddings import query_embedding_stats
+from py_index.metadata_cache import warm_metadata_cache_in_background
+from py_index.search_requests import SESSION_STORE_ID
 
 # Initialize the app
 app = Dash(__name__)
 
+
+@app.server.before_request
+def count_clickhouse_queries():
+    start_request_query_count()
+
+
+@app.server.after_request
+def report_clickhouse_queries(response):
+    response.headers['X-ClickHouse-Queries'] = str(request_query_count())
+    return response
+
+
+@app.server.route('/stats')
+def stats():
+    """Cache hit ratios and connection pool counters of this process"""
+    return {'query_cache': query_cache_stats(), 'manticore_pools': manticore_pool_stats(), 'telemetry': telemetry_stats(), 'concurrency_limits': limiter_stats(), 'query_embeddings': query_embedding_stats()}
+
+
 app.layout = html.Div([
     # Store component for persisting tab selection
     dcc.Store(id='selected-tab', storage_type='local'),
+    # one id per browser tab, so a search only supersedes the previous search of its own tab
+    dcc.Store(id=SESSION_STORE_ID, storage_type='session'),
     
     html.H1("Search Demo", style={'textAlign': 'center'}),
     
@@ -41,5 +70,27 @@ app.layout = html.Div([
     ], id='tabs', persistence=True, persistence_type='local')
 ])
 
+app.clientside_callback(
+    """
+    function(modified, sessionId) {
+        if (sessionId) {
+            return window.dash_clientside.no_update;
+        }
+        return window.crypto && crypto.randomUUID ? crypto.randomUUID() : Date.now() + '-' + Math.random().toString(16).slice(2);
+    }
+    """,
+    Output(SESSION_STORE_ID, 'data'),
+    Input(SESSION_STORE_ID, 'modified_timestamp'),
+    State(SESSION_STORE_ID, 'data'),
+)
+
 if __name__ == "__main__":
-    app.run(debug=True, host='localhost', port=8099)
\ No newline at end of file
+    debug = True
+    # table structures, numeric stats and column mappings, so the first keystrokes don't pay for them;
+    # with debug the reloader runs this script twice, only its serving child (WERKZEUG_RUN_MAIN) warms up
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_metadata_cache_in_background([
+            lambda table_name: get_numeric_field_stats(table_name, get_table_structure(table_name)),
+            get_column_name_mapping,
+        ])
+    app.run(debug=debug, host='localhost', port=8099)
\ No newline at end of file
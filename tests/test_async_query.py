@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from py_index.async_query import AsyncHttpConnectionPool, StaleConnectionError
+
+
+class OneResponseServer:
+    """Answers each connection's first request (or none) with keep-alive headers, then closes it"""
+
+    def __init__(self, respond=True):
+        self.respond = respond
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        headers = b''
+        while not headers.endswith(b'\r\n\r\n'):
+            headers += await reader.readline()
+        length = int(headers.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+        await reader.readexactly(length)
+        if self.respond:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+        writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+
+class AsyncHttpConnectionPoolTest(unittest.TestCase):
+
+    def test_retries_a_reused_connection_closed_by_the_server(self):
+        async def run():
+            server = OneResponseServer()
+            pool = AsyncHttpConnectionPool('127.0.0.1', await server.start(), 1)
+            first = await pool.request('POST', '/sql', b'a')
+            # let the server's close reach the idle connection
+            await asyncio.sleep(0.05)
+            second = await pool.request('POST', '/sql', b'b')
+            server.server.close()
+            return first, second, server.connections
+        first, second, connections = asyncio.run(run())
+        self.assertEqual(first, (200, b'ok'))
+        self.assertEqual(second, (200, b'ok'))
+        self.assertEqual(connections, 2)
+
+    def test_does_not_retry_a_fresh_connection(self):
+        async def run():
+            server = OneResponseServer(respond=False)
+            pool = AsyncHttpConnectionPool('127.0.0.1', await server.start(), 1)
+            try:
+                with self.assertRaises(StaleConnectionError):
+                    await pool.request('POST', '/sql', b'a')
+            finally:
+                server.server.close()
+            return server.connections
+        self.assertEqual(asyncio.run(run()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
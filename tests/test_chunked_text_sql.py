@@ -0,0 +1,38 @@
+import re
+import unittest
+from process_3_encode_sentence import chunked_text_sql
+
+
+class ChunkedTextSqlTest(unittest.TestCase):
+
+    def test_columns_and_doc_id(self):
+        sql = chunked_text_sql('table_x', ['c001_a', 'c002_b'])
+        self.assertIn("SELECT id, text, bitAnd(cityHash64('table_x', id, chunk_index), 9223372036854775807) AS doc_id", sql)
+        self.assertIn("concatWithSeparator(' ', ifNull(c001_a, ''), ifNull(c002_b, ''))", sql)
+        self.assertIn("ORDER BY id ASC, chunk_index ASC", sql)
+
+    def test_id_range(self):
+        self.assertNotIn("AND id >=", chunked_text_sql('t', ['a']))
+        self.assertIn("AND id >= 100 AND id < 200", chunked_text_sql('t', ['a'], id_range=(100, 200)))
+
+    def test_words_go_to_the_window_of_their_end(self):
+        sql = chunked_text_sql('t', ['a'], chunk_size=1000, overlap=200)
+        self.assertIn("intDiv(e - 2, 800)", sql)
+        # only single words are capped, a chunk's text is never cut in the middle of a word
+        self.assertEqual(re.findall(r"substringUTF8\((\w+)", sql), ['w'])
+
+    def test_overlap(self):
+        self.assertNotIn("arrayConcat", chunked_text_sql('t', ['a'], chunk_size=1000, overlap=0))
+        sql = chunked_text_sql('t', ['a'], chunk_size=1000, overlap=200)
+        self.assertIn("arrayConcat", sql)
+        self.assertIn("e > arrayMax(previous_ends) - 200", sql)
+
+    def test_one_pass_over_the_words(self):
+        # filtering all the words once per chunk is quadratic on long texts
+        sql = chunked_text_sql('t', ['a'])
+        self.assertNotIn("chunk_index *", sql)
+        self.assertEqual(sql.count("arraySplit"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from py_index.concurrency_limiter import AIMDLimit, AsyncAdaptiveLimiter
+
+
+LIMIT_SETTINGS = {'min_limit': 1, 'max_limit': 8, 'latency_target_ms': 1000, 'backoff': 0.5, 'cooldown_s': 60}
+
+
+class AIMDLimitTest(unittest.TestCase):
+
+    def test_fast_calls_grow_the_limit(self):
+        limit = AIMDLimit('test', initial_limit=4, **LIMIT_SETTINGS)
+        for _ in range(4):
+            limit.on_acquired(0)
+            limit.on_released(0.01)
+        self.assertAlmostEqual(limit.limit, 5, delta=0.1)
+        self.assertEqual(limit.in_flight, 0)
+
+    def test_slow_calls_shrink_the_limit_once_per_cooldown(self):
+        limit = AIMDLimit('test', initial_limit=8, **LIMIT_SETTINGS)
+        for _ in range(3):
+            limit.on_acquired(0)
+            limit.on_released(2.0)
+        self.assertEqual(limit.limit, 4)
+        self.assertEqual(limit.stats()['decreases'], 1)
+
+    def test_limit_stays_within_bounds(self):
+        limit = AIMDLimit('test', initial_limit=1, **{**LIMIT_SETTINGS, 'cooldown_s': 0})
+        limit.on_acquired(0)
+        limit.on_released(0, error=True)
+        self.assertEqual(limit.limit, 1)
+        for _ in range(200):
+            limit.on_acquired(0)
+            limit.on_released(0)
+        self.assertEqual(limit.limit, 8)
+
+
+class AsyncAdaptiveLimiterTest(unittest.TestCase):
+
+    def test_cancelled_call_is_not_a_success(self):
+        async def run():
+            limiter = AsyncAdaptiveLimiter('test', initial_limit=2, **LIMIT_SETTINGS)
+            started = asyncio.Event()
+
+            async def call():
+                async with limiter.slot():
+                    started.set()
+                    await asyncio.sleep(10)
+
+            task = asyncio.ensure_future(call())
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return limiter
+        limiter = asyncio.run(run())
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_waiter_cancelled_after_its_wakeup_passes_it_on(self):
+        async def run():
+            # a fixed limit of 1: exactly one waiter is woken per release
+            limiter = AsyncAdaptiveLimiter('test', initial_limit=1, **{**LIMIT_SETTINGS, 'max_limit': 1})
+            release = asyncio.Event()
+            tasks = {}
+
+            async def holder():
+                async with limiter.slot():
+                    await release.wait()
+                # the slot is free and the first waiter woken; cancel it before it gets to run
+                tasks['first'].cancel()
+
+            async def waiter():
+                async with limiter.slot():
+                    return True
+
+            tasks['holder'] = asyncio.ensure_future(holder())
+            await asyncio.sleep(0)
+            tasks['first'] = asyncio.ensure_future(waiter())
+            tasks['second'] = asyncio.ensure_future(waiter())
+            await asyncio.sleep(0)
+            release.set()
+            await tasks['holder']
+            with self.assertRaises(asyncio.CancelledError):
+                await tasks['first']
+            return await asyncio.wait_for(tasks['second'], 1), limiter.in_flight
+        self.assertEqual(asyncio.run(run()), (True, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
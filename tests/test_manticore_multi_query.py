@@ -0,0 +1,87 @@
+import unittest
+import importlib.util
+from py_index.database_settings import TELEMETRY_SETTINGS
+from py_index.manticore_database_ops import manticore_multi_query
+from py_index.search_requests import keyword_count
+
+
+class FakeCursor:
+    """Plays back result sets for one multi-statement, enough of a pymysql cursor for manticore_multi_query"""
+
+    def __init__(self, result_sets):
+        self.result_sets = result_sets
+        self.executed = []
+        self._executed = None
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, sql, args=None):
+        if not args:
+            return sql
+        return sql % tuple("'" + str(arg).replace("'", "\\'") + "'" for arg in args)
+
+    def execute(self, sql, args=None):
+        self.executed.append(sql)
+        self._executed = sql
+        self._position = 0
+
+    @property
+    def description(self):
+        if self._position >= len(self.result_sets):
+            return None
+        return [(name,) for name in self.result_sets[self._position][0]]
+
+    def fetchall(self):
+        return self.result_sets[self._position][1]
+
+    def nextset(self):
+        self._position += 1
+        return self._position < len(self.result_sets) or None
+
+
+class FakeClient:
+
+    def __init__(self, result_sets):
+        self.cursor_ = FakeCursor(result_sets)
+
+    def cursor(self, *args):
+        return self.cursor_
+
+
+class ManticoreMultiQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.telemetry_enabled = TELEMETRY_SETTINGS['enabled']
+        TELEMETRY_SETTINGS['enabled'] = False
+
+    def tearDown(self):
+        TELEMETRY_SETTINGS['enabled'] = self.telemetry_enabled
+
+    @unittest.skipUnless(importlib.util.find_spec('pandas'), 'pandas is not installed')
+    def test_search_for_the_word_facet(self):
+        client = FakeClient([
+            (['id'], [(1,), (2,)]),
+            (['district', 'count(*)'], [('001', 2)]),
+            (['total'], [(2,)]),
+        ])
+        results = manticore_multi_query(client, {
+            'hits': ("SELECT id FROM t WHERE MATCH(%s) FACET district", ('facet',)),
+            'count': "SELECT COUNT(*) AS total FROM t WHERE MATCH('facet FACET')",
+        })
+        self.assertEqual(len(results['hits']), 2)
+        self.assertEqual(results['hits'][0]['id'].tolist(), [1, 2])
+        self.assertEqual(results['hits'][1]['district'].tolist(), ['001'])
+        self.assertEqual(results['count']['total'].tolist(), [2])
+
+    def test_keyword_count_skips_string_literals(self):
+        sql = "SELECT id FROM t WHERE MATCH('facet \\' facet') AND c = 'FACET' FACET a FACET b"
+        self.assertEqual(keyword_count(sql, 'FACET'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
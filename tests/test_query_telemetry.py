@@ -0,0 +1,45 @@
+import unittest
+from py_index.query_telemetry import fingerprint_sql, statement_head
+
+
+class FingerprintSqlTest(unittest.TestCase):
+
+    def test_same_query_with_other_values_groups_together(self):
+        self.assertEqual(
+            fingerprint_sql("SELECT id FROM t WHERE MATCH('theft') LIMIT 20"),
+            fingerprint_sql("select id  from t\nwhere match('battery')   limit 50"),
+        )
+
+    def test_string_literals(self):
+        self.assertEqual(fingerprint_sql("CALL SUGGEST('it\\'s', 't', 5 as limit)"), "call suggest(?, ?, ? as limit)")
+
+    def test_numbers_but_not_identifiers(self):
+        self.assertEqual(fingerprint_sql("SELECT id FROM table_12 WHERE x = -5 AND y > 2.5 AND z < 1e-05"),
+                         "select id from table_12 where x = ? and y > ? and z < ?")
+
+    def test_subtraction_keeps_its_operator(self):
+        self.assertEqual(fingerprint_sql("SELECT a-1 FROM t"), "select a-? from t")
+
+    def test_number_lists_collapse(self):
+        self.assertEqual(fingerprint_sql("SELECT * FROM t WHERE id IN (1, 2, 3)"), "select * from t where id in (?+)")
+        self.assertEqual(
+            fingerprint_sql("SELECT id FROM text_vector_64_floats WHERE knn(text_vector, 5, (0.1,-0.2,3e-05), 100)"),
+            "select id from text_vector_64_floats where knn(text_vector, ?, (?+), ?)",
+        )
+
+
+class StatementHeadTest(unittest.TestCase):
+
+    def test_bulk_inserts_stop_at_values(self):
+        one_row = "REPLACE INTO text_vector_64_floats (id, text_vector) VALUES (1, (0.1,0.2))"
+        many_rows = "replace into text_vector_64_floats (id, text_vector) values " + ", ".join(f"({i}, (0.1,0.2))" for i in range(1000))
+        self.assertEqual(fingerprint_sql(statement_head(one_row)), fingerprint_sql(statement_head(many_rows)))
+        self.assertEqual(statement_head(one_row), "REPLACE INTO text_vector_64_floats (id, text_vector) VALUES ...")
+
+    def test_other_statements_are_kept_whole(self):
+        sql = "SELECT id FROM t WHERE MATCH('values')"
+        self.assertEqual(statement_head(sql), sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
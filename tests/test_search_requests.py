@@ -0,0 +1,62 @@
+import unittest
+from py_index.search_requests import SearchRequest, with_max_query_time, start_search_request, finish_search_request
+
+
+class WithMaxQueryTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.request = SearchRequest('test', 3000)
+        self.request.remaining_s = lambda: 3.0
+
+    def test_no_request_leaves_sql_alone(self):
+        self.assertEqual(with_max_query_time("SELECT id FROM t", None), "SELECT id FROM t")
+
+    def test_appends_option(self):
+        sql = with_max_query_time("SELECT id FROM t WHERE match(%s);", self.request)
+        self.assertEqual(sql, "SELECT id FROM t WHERE match(%s)\nOPTION max_query_time=3000")
+
+    def test_extends_existing_option(self):
+        sql = with_max_query_time("SELECT id FROM t OPTION ranker=bm25", self.request)
+        self.assertEqual(sql, "SELECT id FROM t OPTION ranker=bm25, max_query_time=3000")
+
+    def test_option_goes_before_facets(self):
+        sql = with_max_query_time("SELECT id FROM t WHERE match(%s) LIMIT 20 FACET a FACET b ORDER BY COUNT(*) DESC", self.request)
+        self.assertEqual(sql, "SELECT id FROM t WHERE match(%s) LIMIT 20\nOPTION max_query_time=3000\nFACET a FACET b ORDER BY COUNT(*) DESC")
+
+    def test_existing_option_before_facets(self):
+        sql = with_max_query_time("SELECT id FROM t OPTION ranker=bm25 FACET a", self.request)
+        self.assertEqual(sql, "SELECT id FROM t OPTION ranker=bm25, max_query_time=3000\nFACET a")
+
+    def test_keywords_in_string_values_are_ignored(self):
+        sql = with_max_query_time("SELECT id FROM t WHERE a IN ('facet option', 'it''s \\' FACET') FACET a", self.request)
+        self.assertEqual(sql, "SELECT id FROM t WHERE a IN ('facet option', 'it''s \\' FACET')\nOPTION max_query_time=3000\nFACET a")
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class MaxQueryTimeBudgetTest(unittest.TestCase):
+
+    def test_sends_what_is_left_of_the_budget(self):
+        request = SearchRequest('test', 3000)
+        request.remaining_s = lambda: 1.2345
+        self.assertEqual(with_max_query_time("SELECT id FROM t", request), "SELECT id FROM t\nOPTION max_query_time=1234")
+
+    def test_expired_request_still_sends_a_positive_time(self):
+        request = SearchRequest('test', 3000)
+        request.remaining_s = lambda: 0.0
+        self.assertEqual(with_max_query_time("SELECT id FROM t", request), "SELECT id FROM t\nOPTION max_query_time=1")
+
+
+class SearchSessionTest(unittest.TestCase):
+
+    def test_new_search_cancels_the_previous_one_of_the_same_tab_only(self):
+        first_tab = start_search_request('autocomplete', 1000, 'tab-1')
+        other_tab = start_search_request('autocomplete', 1000, 'tab-2')
+        self.assertFalse(first_tab.cancelled)
+        next_in_first_tab = start_search_request('autocomplete', 1000, 'tab-1')
+        self.assertTrue(first_tab.cancelled)
+        self.assertFalse(other_tab.cancelled)
+        for request in (other_tab, next_in_first_tab):
+            finish_search_request(request)
@@ -0,0 +1,52 @@
+import datetime
+import unittest
+from py_index.manticore_database_ops import config_table_versions, latest_version_statuses
+
+
+T0 = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+
+def event(version, status, seconds, seq):
+    return (version, status, T0 + datetime.timedelta(seconds=seconds), seq)
+
+
+class ConfigTableVersionsTest(unittest.TestCase):
+
+    def test_legacy_table_stays_while_its_first_version_builds(self):
+        versions, live, legacy = config_table_versions([event(1, 'building', 0, 1)], indexed=True)
+        self.assertEqual(versions, {1: 'building'})
+        self.assertEqual(live, [])
+        self.assertTrue(legacy)
+
+    def test_legacy_table_stays_after_its_first_build_fails(self):
+        # building and failed in the same second: seq decides
+        events = [event(1, 'failed', 0, 2), event(1, 'building', 0, 1)]
+        versions, live, legacy = config_table_versions(events, indexed=True)
+        self.assertEqual(versions, {})
+        self.assertEqual(live, [])
+        self.assertTrue(legacy)
+
+    def test_legacy_table_goes_once_a_version_is_live(self):
+        events = [event(1, 'building', 0, 1), event(1, 'live', 30, 2)]
+        versions, live, legacy = config_table_versions(events, indexed=True)
+        self.assertEqual(versions, {1: 'live'})
+        self.assertEqual(live, [1])
+        self.assertFalse(legacy)
+
+    def test_later_failed_build_keeps_the_live_version(self):
+        events = [event(1, 'building', 0, 1), event(1, 'live', 30, 2), event(2, 'building', 60, 3), event(2, 'failed', 60, 4)]
+        versions, live, legacy = config_table_versions(events, indexed=True)
+        self.assertEqual(versions, {1: 'live'})
+        self.assertEqual(live, [1])
+        self.assertFalse(legacy)
+
+    def test_new_table_is_not_legacy(self):
+        self.assertFalse(config_table_versions([event(1, 'building', 0, 1)], indexed=False)[2])
+
+    def test_rows_without_seq_fall_back_to_event_time(self):
+        events = [event(1, 'retired', 90, 0), event(1, 'live', 30, 0)]
+        self.assertEqual(latest_version_statuses(events), {1: 'retired'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Memory, build time, query latency and recall@k of text_vector_64_floats and its quantized variants.
+
+Queries are embedded from the first words of random chunks, like in knn_benchmark.py, so they are not vectors
+stored in the tables, and the same queries are sent to every table. Recall is measured against the exact
+neighbours of the ClickHouse copy of the vectors (`text_vectors`), with equidistant chunks counted as found.
+
+    uv run vector_index_report.py            # compare the tables as they are
+    uv run vector_index_report.py --build    # first rebuild the float table and the variants from ClickHouse, timing it
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from knn_benchmark import sample_query_texts, exact_neighbours, stored_vectors, tie_aware_recall, manticore_knn_ids
+from py_index.clickhouse_client import clickhouse_client
+from py_index.database_settings import CLICKHOUSE_VECTOR_SETTINGS, VECTOR_INDEX_VARIANTS
+from py_index.embedding_models import embedding_model
+from py_index.manticore_database_ops import (
+    manticore_client_weights_server, manticore_query, manticore_query_rows, manticore_table_status,
+    create_manticore_vector_table,
+)
+from py_index.vector_bulk_writer import VectorBulkWriter
+
+
+FLOAT_TABLE = 'text_vector_64_floats'
+QUERIES = 200
+K = 10
+EF = 2000
+
+
+def build_variant(table_name, quantization):
+    """Recreate a vector table from the ClickHouse copy of the vectors; returns (seconds, vectors)"""
+    with manticore_client_weights_server() as client:
+        manticore_query(client, f"DROP TABLE IF EXISTS {table_name}")
+        create_manticore_vector_table(client, table_name, quantization=quantization)
+    t0 = time.time()
+    with clickhouse_client() as ch_client, VectorBulkWriter(table_name) as writer:
+        sql = f"SELECT doc_id, table_name, table_rowid, text_str, embedding FROM {CLICKHOUSE_VECTOR_SETTINGS['table']} FINAL"
+        with ch_client.query_row_block_stream(sql) as block_stream:
+            for block in block_stream:
+                for doc_id, source_table, rowid, text, vector in block:
+                    writer.add(doc_id, source_table, rowid, text, vector)
+    build_time_s = time.time() - t0
+    print(f"Built {table_name}: {writer.report()}")
+    return build_time_s, writer.rows
+
+
+def compare_tables(tables, build_times, k=K, ef=EF):
+    texts = sample_query_texts(QUERIES)
+    if not texts:
+        print(f"No vectors in {CLICKHOUSE_VECTOR_SETTINGS['table']}, run process_3_encode_sentence.py first")
+        return None
+    queries = np.asarray(embedding_model().encode(texts), dtype=np.float32)
+    _, truth_distances, _ = exact_neighbours(queries, k)
+
+    runs = {}
+    statuses = {}
+    with manticore_client_weights_server() as client:
+        for table_name in tables:
+            statuses[table_name] = manticore_table_status(client, table_name)
+            runs[table_name] = [manticore_knn_ids(client, query, k, ef, table_name) for query in queries]
+    vectors = stored_vectors(doc_id for results in runs.values() for ids, _ in results for doc_id in ids)
+
+    report = []
+    for table_name, results in runs.items():
+        status = statuses[table_name]
+        latencies = [latency_ms for _, latency_ms in results]
+        recalls = [tie_aware_recall(query, ids, distances, k, vectors)
+                   for query, distances, (ids, _) in zip(queries, truth_distances, results)]
+        recalls = [r for r in recalls if r is not None]
+        p50, p95 = np.percentile(latencies, [50, 95])
+        report.append({
+            'table_name': table_name,
+            'quantization': VECTOR_INDEX_VARIANTS.get(table_name, {}).get('quantization', 'float32'),
+            'ram_mb': status.get('ram_bytes', 0) / 1024 / 1024,
+            'disk_mb': status.get('disk_bytes', 0) / 1024 / 1024,
+            'build_time_s': build_times.get(table_name),
+            'p50_ms': p50,
+            'p95_ms': p95,
+            f'recall@{k}': float(np.mean(recalls)) if recalls else None,
+        })
+    df = pd.DataFrame(report)
+    print(f"{len(queries)} queries, k={k}, ef={ef}, recall against the exact neighbours")
+    print(df.to_string(index=False))
+    return df
+
+
+def run_report(build=False):
+    build_times = {}
+    if build:
+        # the float table is rebuilt the same way, so its build time is comparable with the variants'
+        variants = {FLOAT_TABLE: None, **{t: v['quantization'] for t, v in VECTOR_INDEX_VARIANTS.items()}}
+        for table_name, quantization in variants.items():
+            build_times[table_name], _ = build_variant(table_name, quantization)
+
+    with manticore_client_weights_server() as client:
+        existing = {row[0] for row in manticore_query_rows(client, "SHOW TABLES")}
+    tables = [FLOAT_TABLE] + [t for t in VECTOR_INDEX_VARIANTS if t in existing]
+    missing = [t for t in VECTOR_INDEX_VARIANTS if t not in existing]
+    if missing:
+        print(f"Not built yet, skipped: {', '.join(missing)} (enable them in VECTOR_INDEX_VARIANTS or use --build)")
+    return compare_tables(tables, build_times)
+
+
+if __name__ == "__main__":
+    run_report(build='--build' in sys.argv)